@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+"""
+Crawl benchmark of PiCrawler.
+
+Drives :func:`PiCloudConnection.send_iter` through
+:class:`LocalBackend <picrawler.backends.LocalBackend>` against a local
+stand-in HTTP server, and reports the throughput, the end-to-end latency, the
+client CPU time, the peak RSS and the serialized bytes per response for every
+combination of the swept parameters.
+
+Usage:
+
+    $ python benchmarks/crawl.py --urls 2000 --latency 0.05 \\
+        --jobs 4,16 --batch-sizes 1,20 --compression none,zlib \\
+        --output results.json
+
+    $ python benchmarks/crawl.py --compare results.json --output new.json
+
+Each run is executed in its own process, so that the peak RSS and the CPU time
+are not affected by the other runs.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from picrawler import PiCloudConnection
+from picrawler.backends import LocalBackend
+from picrawler.response import Response
+
+from server import StandInServer
+
+# metrics compared by --compare, and whether larger values are better
+COMPARED_METRICS = (
+    ('urls_per_sec', True),
+    ('latency_p50', False),
+    ('latency_p99', False),
+    ('client_cpu_sec', False),
+    ('peak_rss_kb', False),
+    ('bytes_per_response', False),
+)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+
+    return values[index]
+
+
+def run_crawl(base_url, config):
+    """Runs a single crawl, and returns its metrics."""
+
+    urls = ['%spage/%d' % (base_url, n) for n in xrange(config['urls'])]
+
+    conn = PiCloudConnection(backend=LocalBackend(processes=True),
+                             max_parallel_jobs=config['jobs'],
+                             batch_size=config['batch_size'],
+                             compression=config['compression'],
+                             pop_timeout=1, backoff_base=0.001,
+                             backoff_max=0.05)
+
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    latencies = []
+    num_responses = 0
+    errors = 0
+
+    with conn:
+        start = time.time()
+        for response in conn.send_iter(urls):
+            num_responses += 1
+
+            # the end-to-end latency from the enqueue to the pop
+            timings = response.timings
+            if timings is not None and timings.total is not None:
+                latencies.append(timings.total)
+
+            if not isinstance(response, Response) or response.status_code != 200:
+                errors += 1
+        elapsed = time.time() - start
+
+        stats = conn.stats.as_dict()
+
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    client_cpu = ((usage_end.ru_utime - usage_start.ru_utime) +
+                  (usage_end.ru_stime - usage_start.ru_stime))
+
+    return dict(
+        urls_per_sec=num_responses / elapsed,
+        latency_p50=percentile(latencies, 50),
+        latency_p99=percentile(latencies, 99),
+        client_cpu_sec=client_cpu,
+        peak_rss_kb=usage_end.ru_maxrss,
+        bytes_per_response=stats.get('encoded_bytes', 0) / max(1, num_responses),
+        errors=errors,
+        elapsed_sec=elapsed,
+        pop_calls=stats.get('pop_calls', 0),
+    )
+
+
+def _run_in_process(base_url, config, result_queue):
+    result_queue.put(run_crawl(base_url, config))
+
+
+def run_isolated(base_url, config):
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_in_process,
+                                      args=(base_url, config, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+
+    return result
+
+
+def compare(baseline, results):
+    baseline_map = {}
+    for entry in baseline['results']:
+        baseline_map[json.dumps(entry['config'], sort_keys=True)] = entry
+
+    for entry in results:
+        key = json.dumps(entry['config'], sort_keys=True)
+        base_entry = baseline_map.get(key)
+        if base_entry is None:
+            continue
+
+        print 'config:', key
+        for (name, larger_is_better) in COMPARED_METRICS:
+            (old, new) = (base_entry['metrics'][name], entry['metrics'][name])
+            if not old:
+                continue
+
+            change = (new - old) * 100.0 / old
+            improved = (change > 0) == larger_is_better
+            print '  %-20s %12.4f -> %12.4f (%+.1f%%%s)' % (
+                name, old, new, change, '' if improved or not change else ' !')
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def _str_list(value):
+    return value.split(',')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--urls', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--body-size', type=int, default=20480)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--no-keep-alive', action='store_true')
+    parser.add_argument('--jobs', type=_int_list, default=[4, 16])
+    parser.add_argument('--batch-sizes', type=_int_list, default=[1, 20])
+    parser.add_argument('--compression', type=_str_list, default=['none', 'zlib'])
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None)
+    args = parser.parse_args()
+
+    server = StandInServer(latency=args.latency,
+                           latency_jitter=args.latency_jitter,
+                           body_size=args.body_size,
+                           error_rate=args.error_rate,
+                           keep_alive=not args.no_keep_alive)
+    server.start()
+
+    results = []
+    try:
+        for (jobs, batch_size, compression) in itertools.product(
+                args.jobs, args.batch_sizes, args.compression):
+            config = dict(urls=args.urls, jobs=jobs, batch_size=batch_size,
+                          compression=compression)
+
+            for n in xrange(args.repeat):
+                metrics = run_isolated(server.url, config)
+                results.append(dict(config=config, run=n, metrics=metrics))
+
+                print json.dumps(config, sort_keys=True)
+                print '  %.1f urls/sec, p50 %.3fs, p99 %.3fs, cpu %.2fs, ' \
+                      'rss %d KB, %d bytes/response' % (
+                          metrics['urls_per_sec'], metrics['latency_p50'],
+                          metrics['latency_p99'], metrics['client_cpu_sec'],
+                          metrics['peak_rss_kb'], metrics['bytes_per_response'])
+    finally:
+        server.stop()
+
+    output = dict(
+        server=dict(latency=args.latency, latency_jitter=args.latency_jitter,
+                    body_size=args.body_size, error_rate=args.error_rate,
+                    keep_alive=not args.no_keep_alive),
+        platform=dict(python=platform.python_version(),
+                      machine=platform.machine(),
+                      cpu_count=multiprocessing.cpu_count()),
+        created_at=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        results=results,
+    )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+A local HTTP server that stands in for the crawled web sites.
+
+The server responds to any GET request with a body of the configured size
+after the configured latency. The size of a single response can be overridden
+by the ``size`` query parameter.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import random
+import threading
+import time
+import urlparse
+
+
+_VOCABULARY = ['w%x' % (n * 2654435761 % 2 ** 32) for n in xrange(2000)] + [
+    '<p>', '</p>', '<div class="content">', '</div>', '<a href="/">', '</a>']
+
+
+_NUM_VARIANTS = 16
+_bodies = {}
+
+
+def _generate_body(size, seed):
+    # the body consists of random words so that it is compressed about as
+    # well as real HTML pages
+    rand = random.Random(seed)
+    words = []
+    length = 0
+    while length < size:
+        word = _VOCABULARY[rand.randint(0, len(_VOCABULARY) - 1)]
+        words.append(word)
+        length += len(word) + 1
+
+    return ' '.join(words)[:size]
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server with configurable latency, body size and error rate.
+
+    :param float latency: (optional) Seconds to wait before responding.
+    :param float latency_jitter: (optional) Seconds added to the latency at
+        random.
+    :param int body_size: (optional) The size of the response body in bytes.
+    :param float error_rate: (optional) The ratio of the requests answered
+        with the status code 500.
+    :param bool keep_alive: (optional) Whether the connections are kept alive.
+    :param int seed: (optional) The seed of the random generator.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, port=0, latency=0.0, latency_jitter=0.0, body_size=10240,
+                 error_rate=0.0, keep_alive=True, seed=0):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.body_size = body_size
+        self.error_rate = error_rate
+        self.keep_alive = keep_alive
+
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port),
+                                           _StandInHandler)
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % self.server_address
+
+    def random(self):
+        with self._random_lock:
+            return self._random.random()
+
+    def start(self):
+        """Starts serving in a background thread."""
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # the status line, the headers and the body are written at once, since
+    # small unbuffered writes on a keep-alive connection are delayed by the
+    # Nagle algorithm and the delayed ACK
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        if self.server.keep_alive:
+            self.protocol_version = 'HTTP/1.1'
+
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        server = self.server
+        query = urlparse.parse_qs(urlparse.urlsplit(self.path).query)
+
+        delay = server.latency + server.latency_jitter * server.random()
+        if delay > 0:
+            time.sleep(delay)
+
+        if server.random() < server.error_rate:
+            status = 500
+            body = 'error'
+        else:
+            status = 200
+            size = int(query.get('size', [server.body_size])[0])
+            body = self._body(size)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self, size):
+        # a few variants of the body are generated per size, and are reused
+        # so that the server does not become the bottleneck
+        variant = hash(self.path) % _NUM_VARIANTS
+        key = (size, variant)
+
+        body = _bodies.get(key)
+        if body is None:
+            body = _bodies[key] = _generate_body(size, variant)
+
+        return body
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+import cloud
+import logging
+import multiprocessing
+import multiprocessing.dummy
+import threading
+import Queue
+
+logger = logging.getLogger(__name__)
+
+
+class Backend(object):
+    """Base class of the backends that provide the queues and the jobs
+    processing them.
+
+    The queues returned by :func:`get_queue` must implement the subset of the
+    interface of PiCloud's ``cloud.queue.CloudQueue`` used by
+    :class:`PiCloudConnection <picrawler.PiCloudConnection>`: ``push``,
+    ``pop``, ``count``, ``info``, ``attach`` and ``delete``.
+    """
+
+    def get_queue(self, name):
+        """Returns the queue with the given name.
+
+        :param str name: The name of the queue.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """Releases the resources of the backend."""
+        pass
+
+
+class PiCloudBackend(Backend):
+    """Backend that uses PiCloud's queues."""
+
+    def get_queue(self, name):
+        return cloud.queue.get(name)
+
+    def close(self):
+        cloud.close()
+
+
+class LocalBackend(Backend):
+    """Backend that processes the queues on the local machine.
+
+    The jobs attached to the queues run as threads, or as processes if
+    ``processes`` is True, so that the same crawl code can run without
+    PiCloud.
+
+    Usage:
+
+        >>> from picrawler import PiCloudConnection
+        >>> from picrawler.backends import LocalBackend
+        >>> with PiCloudConnection(backend=LocalBackend()) as conn:
+        ...     response = conn.send(['http://www.wikipedia.org'])
+
+    :param bool processes: (optional) Whether the jobs run as processes.
+    """
+
+    def __init__(self, processes=False):
+        if processes:
+            self._mp = multiprocessing
+        else:
+            self._mp = multiprocessing.dummy
+
+        self._queues = {}
+
+    def get_queue(self, name):
+        queue = self._queues.get(name)
+        if queue is None:
+            queue = self._queues[name] = LocalQueue(name, self._mp)
+
+        return queue
+
+    def close(self):
+        for queue in self._queues.values():
+            queue.delete()
+
+        self._queues = {}
+
+
+class LocalQueue(object):
+    """Class that represents a queue of :class:`LocalBackend`.
+
+    :param str name: The name of the queue.
+    :param module mp: :mod:`multiprocessing` or :mod:`multiprocessing.dummy`.
+    """
+
+    def __init__(self, name, mp=multiprocessing.dummy):
+        self.name = name
+
+        self._mp = mp
+        self._queue = mp.Queue()
+        self._processing_jobs = mp.Value('i', 0)
+        self._lock = mp.Lock()
+        self._workers = []
+        self._num_readers = 0
+        self._timers = []
+
+    def push(self, messages, delay=0):
+        """Puts the messages into the queue.
+
+        :param list messages: The messages.
+        :param int delay: (optional) Seconds before the messages become
+            available.
+        """
+
+        if delay > 0:
+            timer = threading.Timer(delay, self.push, args=(messages,))
+            timer.daemon = True
+            timer.start()
+            self._timers.append(timer)
+            return True
+
+        for message in messages:
+            self._queue.put(message)
+
+        return True
+
+    def pop(self, max_count=10, timeout=20):
+        """Pops at most *max_count* messages from the queue. Blocks until at
+        least one message is available, or until *timeout* seconds elapses.
+
+        :return: A list of the messages.
+        """
+
+        messages = []
+        try:
+            messages.append(self._queue.get(timeout=timeout) if timeout > 0
+                            else self._queue.get_nowait())
+            while len(messages) < max_count:
+                messages.append(self._queue.get_nowait())
+        except Queue.Empty:
+            pass
+
+        return messages
+
+    def count(self):
+        """Returns the number of the messages in the queue."""
+
+        return self._queue.qsize()
+
+    def info(self):
+        """Returns a dictionary describing the queue."""
+
+        return dict(count=self.count(),
+                    processing_jobs=self._processing_jobs.value,
+                    queued_jobs=0)
+
+    def attach(self, message_handler, output_queues=[], max_parallel_jobs=1,
+               readers_per_job=1, **kwargs):
+        """Starts the jobs that process the messages in the queue.
+
+        :param message_handler: A callable invoked with each message. The
+            return value is pushed to each queue in ``output_queues`` unless
+            it is None.
+        :param list output_queues: (optional) The output queues.
+        :param int max_parallel_jobs: (optional) The number of jobs.
+        :param int readers_per_job: (optional) The number of messages
+            processed by a job in parallel.
+        :param kwargs: PiCloud specific arguments, which are ignored.
+        """
+
+        output_queues = [q._queue for q in output_queues]
+        for n in xrange(max_parallel_jobs):
+            worker = self._mp.Process(target=_run_job,
+                                      args=(self._queue, message_handler,
+                                            output_queues, readers_per_job,
+                                            self._processing_jobs,
+                                            self._lock))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+        self._num_readers += max_parallel_jobs * readers_per_job
+
+    def delete(self):
+        """Stops the attached jobs and discards the messages."""
+
+        for timer in self._timers:
+            timer.cancel()
+
+        try:
+            while True:
+                self._queue.get_nowait()
+        except Queue.Empty:
+            pass
+
+        # each reader stops when it pops None
+        for n in xrange(self._num_readers):
+            self._queue.put(None)
+
+        # wait for the jobs so that they do not outlive the interpreter
+        for worker in self._workers:
+            worker.join()
+
+        self._workers = []
+        self._num_readers = 0
+        self._timers = []
+
+
+def _run_job(queue, message_handler, output_queues, readers_per_job,
+             processing_jobs, lock):
+    if readers_per_job <= 1:
+        _read_messages(queue, message_handler, output_queues, processing_jobs,
+                       lock)
+        return
+
+    readers = [threading.Thread(target=_read_messages,
+                                args=(queue, message_handler, output_queues,
+                                      processing_jobs, lock))
+               for n in xrange(readers_per_job)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+
+
+def _read_messages(queue, message_handler, output_queues, processing_jobs,
+                   lock):
+    while True:
+        message = queue.get()
+        if message is None:
+            break
+
+        with lock:
+            processing_jobs.value += 1
+
+        try:
+            result = message_handler(message)
+            if result is not None:
+                for output_queue in output_queues:
+                    output_queue.put(result)
+
+        except Exception:
+            logger.exception('Failed to process a message')
+
+        finally:
+            with lock:
+                processing_jobs.value -= 1
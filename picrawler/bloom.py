@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import math
+import struct
+
+
+class BloomFilter(object):
+    """A space-efficient set that may report false positives but never false
+    negatives.
+
+    Usage:
+
+        >>> seen = BloomFilter(capacity=1000000, error_rate=0.001)
+        >>> seen.add('http://www.wikipedia.org/')
+        True
+        >>> 'http://www.wikipedia.org/' in seen
+        True
+
+    :param int capacity: The expected number of items.
+    :param float error_rate: (optional) The false positive rate when the
+        filter holds ``capacity`` items.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self._num_bits = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self._num_hashes = max(1, int(round(
+            float(self._num_bits) / capacity * math.log(2))))
+
+        self._bits = bytearray((self._num_bits + 7) / 8)
+        self._count = 0
+
+    @property
+    def num_bits(self):
+        return self._num_bits
+
+    @property
+    def num_hashes(self):
+        return self._num_hashes
+
+    def __len__(self):
+        """Returns the number of the added items."""
+
+        return self._count
+
+    def __contains__(self, item):
+        bits = self._bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+
+        return True
+
+    def add(self, item):
+        """Adds the item.
+
+        :param str item: The item.
+        :return: True if the item has not been added before.
+        """
+
+        bits = self._bits
+        added = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                added = True
+
+        if added:
+            self._count += 1
+
+        return added
+
+    def _positions(self, item):
+        if isinstance(item, unicode):
+            item = item.encode('utf-8')
+
+        # double hashing derives all the positions from two hash values
+        (h1, h2) = struct.unpack('<QQ', hashlib.md5(item).digest())
+        for n in xrange(self._num_hashes):
+            yield (h1 + n * h2) % self._num_bits
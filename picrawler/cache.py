@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+import calendar
+import collections
+import email.utils
+import threading
+import time
+
+from response import Response
+from stats import Stats
+from store import ContentNotFound
+
+CACHEABLE_STATUS_CODES = frozenset([200, 203, 300, 301, 410])
+
+
+class CacheEntry(object):
+    __slots__ = ('status_code', 'headers', 'content', 'extracted', 'etag',
+                 'last_modified', 'expires_at', 'stored_at')
+
+    def __init__(self, status_code, headers, content, extracted, etag,
+                 last_modified, expires_at, stored_at):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.extracted = extracted
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+        self.stored_at = stored_at
+
+
+class HTTPCache(object):
+    """Class that caches the responses on the client.
+
+    The cached responses are used in two ways. While a response is fresh
+    according to its ``Cache-Control`` or ``Expires`` header, the request is
+    not sent at all. Otherwise, the request is sent with ``If-None-Match``
+    and ``If-Modified-Since`` headers, and a ``304 Not Modified`` response is
+    replaced with the cached response.
+
+    Only the responses of GET requests are cached, and the ``Vary`` header is
+    not taken into account. The responses of the requests with an extractor
+    are cached separately for each extractor, since they carry the result of
+    the extractor and possibly no content.
+
+    Usage:
+
+        >>> cache = HTTPCache(max_entries=100000, ttl=86400)
+        >>> with PiCloudConnection(cache=cache) as conn:
+        ...     response = conn.send(urls)
+        >>> cache.hit_ratio
+        0.0
+
+    :param int max_entries: (optional) The maximum number of the cached
+        responses. The least recently used responses are evicted first.
+    :param float ttl: (optional) Seconds after which a response is evicted,
+        regardless of its freshness. If None, the responses are kept until
+        they are evicted by ``max_entries``.
+    :param float default_max_age: (optional) Seconds during which a response
+        without any freshness information is considered fresh.
+    :param store: (optional) A :class:`ContentStore <picrawler.store.ContentStore>`
+        instance where the cached contents are saved. If not specified, the
+        contents are kept in memory.
+    """
+
+    def __init__(self, max_entries=10000, ttl=None, default_max_age=0,
+                 store=None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._default_max_age = default_max_age
+        self._store = store
+
+        self._entries = collections.OrderedDict()
+        # request id -> the headers before the conditional headers are added
+        self._revalidating = {}
+        self._lock = threading.Lock()
+        self._stats = Stats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, request):
+        # accepts either a request or the URL of a plain GET request
+        if isinstance(request, basestring):
+            return (request, None, True) in self._entries
+
+        return _get_key(request) in self._entries
+
+    @property
+    def stats(self):
+        """The numbers of the fresh hits (``hits``), the revalidated
+        responses (``revalidations``), the misses (``misses``) and the
+        evicted responses (``evictions``).
+
+        :type: :class:`Stats <picrawler.stats.Stats>`
+        """
+        return self._stats
+
+    @property
+    def hit_ratio(self):
+        """The ratio of the requests answered by the cache, including the
+        revalidated responses.
+
+        :type: float
+        """
+
+        hits = self._stats['hits'] + self._stats['revalidations']
+        total = hits + self._stats['misses']
+        if not total:
+            return 0.0
+
+        return float(hits) / total
+
+    def prepare(self, request, now=None):
+        """Looks up the cached response of the request.
+
+        If a fresh response is cached, it is returned. Otherwise, the
+        conditional headers are added to the request if a stale response is
+        cached.
+
+        :param request: A :class:`Request <picrawler.request.Request>`
+            instance.
+        :return: A :class:`Response <picrawler.response.Response>` instance,
+            or None if the request needs to be sent.
+        """
+
+        if request.method != 'get':
+            return None
+
+        if now is None:
+            now = time.time()
+
+        key = _get_key(request)
+
+        with self._lock:
+            entry = self._get_entry(key, now)
+            if entry is None:
+                self._stats.incr('misses')
+                return None
+
+            if entry.expires_at is not None and now < entry.expires_at:
+                response = self._to_response(key, request, entry, None)
+                if response is None:
+                    self._stats.incr('misses')
+                    return None
+
+                self._stats.incr('hits')
+                return response
+
+            headers = {}
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+            if headers:
+                self._revalidating[request.id] = request.headers
+                request.headers = dict(request.headers, **headers)
+
+        return None
+
+    def update(self, response, now=None):
+        """Updates the cache with the response received.
+
+        :param response: A :class:`BaseResponse <picrawler.response.BaseResponse>`
+            instance.
+        :return: The cached response if the response is ``304 Not Modified``,
+            otherwise the given response. None is returned if the cached
+            response has been evicted since the conditional headers were
+            added. The request must then be sent again, and its conditional
+            headers are removed.
+        """
+
+        if response.request.method != 'get':
+            return response
+
+        with self._lock:
+            original_headers = self._revalidating.pop(response.request.id,
+                                                      None)
+
+        if not isinstance(response, Response):
+            return response
+
+        if now is None:
+            now = time.time()
+
+        key = _get_key(response.request)
+
+        with self._lock:
+            if response.status_code == 304:
+                entry = self._get_entry(key, now)
+                cached = None
+                if entry is not None:
+                    cached = self._to_response(key, response.request, entry,
+                                               response.timings)
+
+                if cached is None:
+                    # the cached response has been evicted in the meantime
+                    self._stats.incr('misses')
+                    if original_headers is None:
+                        # the conditional headers were given by the caller
+                        return response
+
+                    response.request.headers = original_headers
+                    return None
+
+                self._stats.incr('revalidations')
+
+                # the 304 response updates the headers of the cached response
+                headers = dict(entry.headers)
+                headers.update(response.headers or {})
+                entry.headers = headers
+                entry.expires_at = self._get_expires_at(headers, now)
+                entry.stored_at = now
+
+                return cached
+
+            if (response.status_code not in CACHEABLE_STATUS_CODES or
+                response.truncated):
+                return response
+
+            headers = response.headers or {}
+            cache_control = _parse_cache_control(_get_header(headers, 'cache-control'))
+            if 'no-store' in cache_control:
+                self._remove(key)
+                return response
+
+            content = response.content
+            if content is not None:
+                content = content[:]
+                if self._store is not None:
+                    content = self._store.put(content)
+
+            self._remove(key)
+            self._entries[key] = CacheEntry(
+                response.status_code, headers, content, response.extracted,
+                _get_header(headers, 'etag'),
+                _get_header(headers, 'last-modified'),
+                self._get_expires_at(headers, now), now)
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._stats.incr('evictions')
+
+        return response
+
+    def _get_entry(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        if self._ttl is not None and now - entry.stored_at >= self._ttl:
+            self._remove(key)
+            self._stats.incr('evictions')
+            return None
+
+        # move the entry to the end of the LRU order
+        del self._entries[key]
+        self._entries[key] = entry
+
+        return entry
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+
+    def _get_expires_at(self, headers, now):
+        cache_control = _parse_cache_control(_get_header(headers, 'cache-control'))
+        if 'no-cache' in cache_control:
+            return None
+
+        max_age = cache_control.get('max-age')
+        if max_age is not None:
+            try:
+                return now + int(max_age)
+            except ValueError:
+                return None
+
+        expires = _get_header(headers, 'expires')
+        if expires:
+            parsed = email.utils.parsedate(expires)
+            return calendar.timegm(parsed) if parsed else None
+
+        if self._default_max_age:
+            return now + self._default_max_age
+
+        return None
+
+    def _to_response(self, key, request, entry, timings):
+        # returns None if the content has been evicted from the store
+        content = entry.content
+        if content is not None and self._store is not None:
+            try:
+                content = self._store.get(content)[:]
+            except ContentNotFound:
+                self._remove(key)
+                self._stats.incr('evictions')
+                return None
+
+        response = Response(request, entry.status_code, content,
+                            entry.headers, timings)
+        if entry.extracted is not None:
+            response.set_extracted(entry.extracted, keep_content=True)
+
+        return response
+
+
+def _get_key(request):
+    # the responses of the extractors do not carry the same values as the
+    # responses of the plain requests
+    if request.extractor is None:
+        return (request.url, None, True)
+
+    return (request.url, request.extractor, request.keep_content)
+
+
+def _get_header(headers, name):
+    value = headers.get(name)
+    if value is None:
+        # the headers of plain dicts are case-sensitive
+        for (key, header_value) in headers.iteritems():
+            if key.lower() == name:
+                return header_value
+
+    return value
+
+
+def _parse_cache_control(value):
+    directives = {}
+    if not value:
+        return directives
+
+    for directive in value.split(','):
+        (name, _, arg) = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+
+    return directives
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+
+from response import ErrorResponse
+
+
+class CallbackRegistry(object):
+    """Class that keeps the callbacks of the requests in flight.
+
+    Since the callbacks are not sent to PiCloud, the connection registers them
+    when the requests are pushed, and releases them when the responses are
+    delivered. A callback shared by many requests is stored only once.
+    """
+
+    def __init__(self):
+        # callback id -> [callback, reference count]
+        self._callbacks = {}
+        # callback -> callback id
+        self._callback_ids = {}
+        # request id -> (success callback id, error callback id)
+        self._requests = {}
+
+        self._id_counter = itertools.count()
+
+    def __len__(self):
+        """Returns the number of the requests that have callbacks."""
+
+        return len(self._requests)
+
+    @property
+    def num_callbacks(self):
+        """The number of the distinct callbacks.
+
+        :type: int
+        """
+        return len(self._callbacks)
+
+    def register(self, request):
+        """Registers the callbacks of the request.
+
+        :param request: A :class:`Request <picrawler.request.Request>` instance.
+        """
+
+        if not request.success_callback and not request.error_callback:
+            return
+
+        if request.id in self._requests:
+            self.release(request.id)
+
+        self._requests[request.id] = (self._add(request.success_callback),
+                                      self._add(request.error_callback))
+
+    def release(self, request_id):
+        """Removes the callbacks of the request.
+
+        :param request_id: The ID of the request.
+        :return: A tuple of the success callback and the error callback.
+        """
+
+        callback_ids = self._requests.pop(request_id, None)
+        if callback_ids is None:
+            return (None, None)
+
+        return tuple(self._remove(callback_id) for callback_id in callback_ids)
+
+    def release_for(self, response, request_id=None):
+        """Releases the callbacks of the request, and returns the one that
+        corresponds to the response.
+
+        :param response: A :class:`BaseResponse <picrawler.response.BaseResponse>` instance.
+        :param request_id: (optional) The ID of the request whose callbacks
+            are released. Defaults to the ID of the request of the response.
+        :return: The callback, or None if it is not defined.
+        """
+
+        if request_id is None:
+            request_id = response.request.id
+
+        (success_callback, error_callback) = self.release(request_id)
+
+        if isinstance(response, ErrorResponse):
+            return error_callback
+        else:
+            return success_callback
+
+    def run(self, response):
+        """Releases the callbacks of the request and runs the one that
+        corresponds to the response.
+
+        :param response: A :class:`BaseResponse <picrawler.response.BaseResponse>` instance.
+        """
+
+        callback = self.release_for(response)
+        if callback:
+            callback(response)
+
+    def _add(self, callback):
+        if not callback:
+            return None
+
+        callback_id = self._callback_ids.get(callback)
+        if callback_id is None:
+            callback_id = self._id_counter.next()
+            self._callback_ids[callback] = callback_id
+            self._callbacks[callback_id] = [callback, 0]
+
+        self._callbacks[callback_id][1] += 1
+
+        return callback_id
+
+    def _remove(self, callback_id):
+        if callback_id is None:
+            return None
+
+        entry = self._callbacks[callback_id]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._callbacks[callback_id]
+            del self._callback_ids[entry[0]]
+
+        return entry[0]
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import urllib
+import urlparse
+
+# query parameters that only track the visitors and do not change the pages
+TRACKING_PARAMETERS = frozenset([
+    'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content',
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'mc_cid', 'mc_eid', '_ga',
+    'yclid', 'igshid',
+])
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class URLCanonicalizer(object):
+    """Class that converts URLs into a canonical form, so that the URLs of
+    the same page are fetched only once.
+
+    Usage:
+
+        >>> canonicalizer = URLCanonicalizer()
+        >>> canonicalizer('HTTP://Example.COM:80/a?b=2&a=1&utm_source=x#top')
+        'http://example.com/a?a=1&b=2'
+
+    :param bool remove_fragment: (optional) Whether the fragments are removed.
+    :param bool remove_default_port: (optional) Whether the default ports of
+        the schemes are removed.
+    :param bool sort_query: (optional) Whether the query parameters are sorted.
+    :param strip_parameters: (optional) The names of the query parameters
+        removed from the URLs. Defaults to the common tracking parameters.
+    :param bool lowercase_path: (optional) Whether the paths are lowercased.
+        This is only safe for case-insensitive servers.
+    :param bool remove_trailing_slash: (optional) Whether the trailing slashes
+        of the paths are removed.
+    :param rules: (optional) A list of functions that take a URL and return a
+        modified URL. They are applied after the other rules.
+    """
+
+    def __init__(self, remove_fragment=True, remove_default_port=True,
+                 sort_query=True, strip_parameters=TRACKING_PARAMETERS,
+                 lowercase_path=False, remove_trailing_slash=False, rules=()):
+        self._remove_fragment = remove_fragment
+        self._remove_default_port = remove_default_port
+        self._sort_query = sort_query
+        self._strip_parameters = frozenset(p.lower() for p in strip_parameters)
+        self._lowercase_path = lowercase_path
+        self._remove_trailing_slash = remove_trailing_slash
+        self._rules = list(rules)
+
+    def __call__(self, url):
+        """Returns the canonical form of the URL.
+
+        :param str url: A URL.
+        """
+
+        (scheme, netloc, path, query, fragment) = urlparse.urlsplit(url)
+
+        # the scheme and the host are case-insensitive
+        scheme = scheme.lower()
+        netloc = self._canonicalize_netloc(scheme, netloc)
+
+        if not path:
+            path = '/'
+        elif self._lowercase_path:
+            path = path.lower()
+
+        if self._remove_trailing_slash and len(path) > 1:
+            path = path.rstrip('/') or '/'
+
+        if query:
+            query = self._canonicalize_query(query)
+
+        if self._remove_fragment:
+            fragment = ''
+
+        url = urlparse.urlunsplit((scheme, netloc, path, query, fragment))
+        for rule in self._rules:
+            url = rule(url)
+
+        return url
+
+    def _canonicalize_netloc(self, scheme, netloc):
+        (userinfo, at, host) = netloc.rpartition('@')
+        host = host.lower()
+
+        if self._remove_default_port and ':' in host and not host.endswith(']'):
+            (hostname, port) = host.rsplit(':', 1)
+            if not port or (port.isdigit() and
+                            int(port) == DEFAULT_PORTS.get(scheme)):
+                host = hostname
+
+        return userinfo + at + host
+
+    def _canonicalize_query(self, query):
+        # the parameters are kept as they are encoded, since decoding and
+        # encoding them again may change the meaning of the URL, e.g. "?wsdl"
+        # and "?wsdl=", or "a;b" and "a&b"
+        params = [param for param in query.split('&')
+                  if param and self._get_param_name(param).lower()
+                  not in self._strip_parameters]
+
+        if self._sort_query:
+            # the order of the values of the same name is preserved
+            params.sort(key=lambda param: param.partition('=')[0])
+
+        return '&'.join(params)
+
+    def _get_param_name(self, param):
+        return urllib.unquote_plus(param.partition('=')[0])
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+import zlib
+
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+# content types whose bodies are already compressed
+COMPRESSED_CONTENT_TYPES = (
+    'image/',
+    'video/',
+    'audio/',
+    'font/woff',
+    'application/zip',
+    'application/gzip',
+    'application/x-gzip',
+    'application/x-bzip2',
+    'application/x-xz',
+    'application/x-7z-compressed',
+    'application/x-rar-compressed',
+    'application/font-woff',
+)
+
+
+class UnsupportedCodec(Exception):
+    pass
+
+
+class Codec(object):
+    """Base class of the codecs used to compress pickled responses."""
+
+    name = None
+
+    def compress(self, data):
+        raise NotImplementedError()
+
+    def decompress(self, data):
+        raise NotImplementedError()
+
+
+class NullCodec(Codec):
+    """Codec that leaves the data as it is."""
+
+    name = 'none'
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+
+class ZlibCodec(Codec):
+    """Codec using zlib.
+
+    :param int level: (optional) The compression level from 1 (fastest) to 9
+        (smallest).
+    """
+
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self._level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self._level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class LZ4Codec(Codec):
+    """Codec using `lz4 <https://pypi.python.org/pypi/lz4>`_."""
+
+    name = 'lz4'
+
+    def compress(self, data):
+        return lz4_block.compress(data)
+
+    def decompress(self, data):
+        return lz4_block.decompress(data)
+
+
+class SnappyCodec(Codec):
+    """Codec using `python-snappy <https://pypi.python.org/pypi/python-snappy>`_."""
+
+    name = 'snappy'
+
+    def compress(self, data):
+        return snappy.compress(data)
+
+    def decompress(self, data):
+        return snappy.decompress(data)
+
+
+_codec_classes = {
+    NullCodec.name: NullCodec,
+    ZlibCodec.name: ZlibCodec,
+}
+if lz4_block is not None:
+    _codec_classes[LZ4Codec.name] = LZ4Codec
+if snappy is not None:
+    _codec_classes[SnappyCodec.name] = SnappyCodec
+
+_decoders = {}
+
+
+def available_codecs():
+    """Returns the names of the codecs available in this environment."""
+
+    return sorted(_codec_classes.keys())
+
+
+def get_codec(name, **kwargs):
+    """Returns a codec instance.
+
+    :param str name: The name of the codec. ("none" or "zlib" or "lz4" or
+        "snappy")
+    :param kwargs: Arguments passed to the codec class.
+    """
+
+    codec_class = _codec_classes.get(name)
+    if codec_class is None:
+        raise UnsupportedCodec('Unsupported codec: %s' % name)
+
+    return codec_class(**kwargs)
+
+
+def _get_decoder(name):
+    decoder = _decoders.get(name)
+    if decoder is None:
+        decoder = _decoders[name] = get_codec(name)
+
+    return decoder
+
+
+class Compressor(object):
+    """Class that decides how the pickled responses are compressed.
+
+    :param str codec: (optional) The name of the codec.
+    :param int level: (optional) The compression level. Only used by the zlib
+        codec.
+    :param int threshold: (optional) The data smaller than this number of
+        bytes is not compressed.
+    """
+
+    def __init__(self, codec='zlib', level=6, threshold=1024):
+        if codec == ZlibCodec.name:
+            self._codec = get_codec(codec, level=level)
+        else:
+            self._codec = get_codec(codec)
+
+        self._threshold = threshold
+
+    @property
+    def codec(self):
+        return self._codec
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    def encode(self, data, content_type=None):
+        """Compresses the data.
+
+        :param str data: The data to be compressed.
+        :param str content_type: (optional) The content type of the response.
+            The data is not compressed if the content is already compressed.
+        :return: A tuple of the codec name and the encoded data.
+        """
+
+        if len(data) < self._threshold or is_compressed_type(content_type):
+            return (NullCodec.name, data)
+
+        return (self._codec.name, self._codec.compress(data))
+
+    @staticmethod
+    def decode(codec_name, data):
+        """Decompresses the data encoded by :func:`encode`.
+
+        :param str codec_name: The name of the codec.
+        :param str data: The encoded data.
+        """
+
+        return _get_decoder(codec_name).decompress(data)
+
+
+def is_compressed_type(content_type):
+    """Returns whether the content type indicates compressed content."""
+
+    if not content_type:
+        return False
+
+    content_type = content_type.lower().lstrip()
+
+    return content_type.startswith(COMPRESSED_CONTENT_TYPES)
+
+
+DEFAULT_COMPRESSOR = Compressor()
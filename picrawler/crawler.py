@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import urlparse
+
+from bloom import BloomFilter
+from extractors import extract_links
+from request import Request
+from response import Response
+
+
+class Crawler(object):
+    """Class that crawls the web recursively by following the links.
+
+    The URLs found in the responses are pushed to the connection while the
+    earlier requests are still in flight, so the crawl never waits for the
+    slowest URL of a round. The links are extracted in the PiCloud jobs by
+    :func:`extract_links <picrawler.extractors.extract_links>`, so the
+    contents are not sent back unless ``keep_content`` is True.
+
+    Usage:
+
+        >>> from picrawler import PiCloudConnection
+        >>> from picrawler.crawler import Crawler
+        >>>
+        >>> with PiCloudConnection() as conn:
+        ...     crawler = Crawler(conn, max_depth=2,
+        ...                       allowed_domains=['wikipedia.org'])
+        ...     for response in crawler.crawl(['http://www.wikipedia.org/']):
+        ...         print response.request.url
+
+    :param conn: A :class:`PiCloudConnection <picrawler.PiCloudConnection>`
+        instance.
+    :param int max_depth: (optional) The maximum number of links followed
+        from the seed URLs.
+    :param list allowed_domains: (optional) The domains to be crawled. The
+        subdomains of the domains are also crawled. If not specified, all the
+        domains are crawled.
+    :param int max_urls: (optional) The maximum number of URLs to be fetched.
+    :param seen: (optional) A set-like object with ``add`` and ``__contains__``
+        that records the seen URLs. Defaults to a
+        :class:`BloomFilter <picrawler.bloom.BloomFilter>` instance.
+    :param int capacity: (optional) The expected number of URLs, used to size
+        the default Bloom filter.
+    :param bool keep_content: (optional) Whether the contents are sent back.
+    :param dict headers: (optional) HTTP headers to send.
+    :param dict args: (optional) Additional arguments passed to
+        :class:`Request <picrawler.request.Request>`.
+    """
+
+    def __init__(self, conn, max_depth=1, allowed_domains=None, max_urls=None,
+                 seen=None, capacity=10000000, keep_content=False, headers=None,
+                 args=None):
+        self._conn = conn
+        self._max_depth = max_depth
+        self._max_urls = max_urls
+        self._keep_content = keep_content
+        self._headers = headers
+        self._args = args
+
+        if allowed_domains is not None:
+            self._allowed_domains = [d.lower().lstrip('.') for d in allowed_domains]
+        else:
+            self._allowed_domains = None
+
+        if seen is None:
+            seen = BloomFilter(capacity)
+        self._seen = seen
+
+        # request id -> depth of the requests in flight
+        self._depths = {}
+        self._num_pushed = 0
+
+    @property
+    def num_pushed(self):
+        """The number of the URLs pushed to the connection.
+
+        :type: int
+        """
+        return self._num_pushed
+
+    def crawl(self, urls):
+        """Crawls from the seed URLs, and yields the responses as they arrive.
+
+        :param list urls: The seed URLs.
+        :return: A generator of :class:`BaseResponse <picrawler.response.BaseResponse>` instances.
+        """
+
+        self._push(urls, 0)
+
+        for response in self._conn.iter_responses():
+            depth = self._depths.pop(response.request.id, 0)
+
+            yield response
+
+            if depth < self._max_depth and isinstance(response, Response):
+                self._push(self._get_links(response), depth + 1)
+
+    def is_allowed(self, url):
+        """Returns whether the URL is in the crawled domains.
+
+        :param str url: A URL.
+        """
+
+        if self._allowed_domains is None:
+            return True
+
+        host = (urlparse.urlsplit(url).hostname or '').lower()
+        for domain in self._allowed_domains:
+            if host == domain or host.endswith('.' + domain):
+                return True
+
+        return False
+
+    def _get_links(self, response):
+        if response.extracted is not None:
+            return response.extracted
+
+        # the links have not been extracted in the PiCloud job
+        return extract_links(response)
+
+    def _push(self, urls, depth):
+        requests = []
+        for url in urls:
+            if self._max_urls is not None and self._num_pushed >= self._max_urls:
+                break
+
+            if url in self._seen or not self.is_allowed(url):
+                continue
+
+            self._seen.add(url)
+
+            request = Request(url, headers=self._headers, args=self._args,
+                              extractor=extract_links,
+                              keep_content=self._keep_content)
+            self._depths[request.id] = depth
+            self._num_pushed += 1
+            requests.append(request)
+
+        if requests:
+            self._conn.push(requests)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import urlparse
+import Queue
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackDispatcher(object):
+    """Class that runs callbacks on a pool of threads, so that slow callbacks
+    do not stop the polling of the result queue.
+
+    The number of the callbacks waiting to be run is bounded by
+    ``queue_size``. When the queue is full, :func:`submit` blocks until a
+    worker becomes available, which propagates the backpressure to the
+    polling loop. The exceptions raised in the callbacks are logged and
+    counted as ``callback_errors`` in the stats.
+
+    :param int num_workers: The number of the worker threads.
+    :param int queue_size: (optional) The maximum number of the callbacks
+        waiting to be run.
+    :param bool ordered_per_host: (optional) If True, the callbacks of the
+        responses from the same host are run one by one in the order of
+        submission.
+    :param stats: (optional) A :class:`Stats <picrawler.stats.Stats>`
+        instance.
+    """
+
+    def __init__(self, num_workers, queue_size=100, ordered_per_host=False,
+                 stats=None):
+        self._ordered_per_host = ordered_per_host
+        self._stats = stats
+
+        if ordered_per_host:
+            # each host is assigned to a single worker
+            queue_size = max(1, queue_size / num_workers)
+            self._queues = [Queue.Queue(queue_size) for n in xrange(num_workers)]
+            queues = self._queues
+        else:
+            self._queues = [Queue.Queue(queue_size)]
+            queues = self._queues * num_workers
+
+        self._worker_queues = queues
+        self._workers = []
+        for queue in queues:
+            worker = threading.Thread(target=self._run, args=(queue,))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, callback, response, on_done=None):
+        """Schedules the callback.
+
+        :param callback: A function called with the response.
+        :param response: A :class:`BaseResponse <picrawler.response.BaseResponse>` instance.
+        :param on_done: (optional) A function called with the response after
+            the callback is completed.
+        """
+
+        if self._ordered_per_host:
+            host = urlparse.urlsplit(response.request.url).netloc.lower()
+            queue = self._queues[hash(host) % len(self._queues)]
+        else:
+            queue = self._queues[0]
+
+        queue.put((callback, response, on_done))
+
+    def join(self):
+        """Blocks until all the submitted callbacks are completed."""
+
+        for queue in self._queues:
+            queue.join()
+
+    def close(self):
+        """Waits for the submitted callbacks, and stops the workers."""
+
+        self.join()
+
+        # each worker stops when it gets None
+        for queue in self._worker_queues:
+            queue.put(None)
+
+        for worker in self._workers:
+            worker.join()
+
+        self._workers = []
+        self._worker_queues = []
+
+    def _run(self, queue):
+        while True:
+            task = queue.get()
+            try:
+                if task is None:
+                    break
+
+                (callback, response, on_done) = task
+                try:
+                    if callback:
+                        callback(response)
+                except Exception:
+                    logger.exception('Exception in a callback')
+                    if self._stats is not None:
+                        self._stats.incr('callback_errors')
+
+                if on_done:
+                    on_done(response)
+
+            finally:
+                queue.task_done()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import HTMLParser
+import re
+import sys
+import urlparse
+
+_extractors = {}
+
+_LINK_RE = re.compile(r"""<a\s[^>]*?href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""",
+                      re.IGNORECASE)
+
+
+_html_parser = HTMLParser.HTMLParser()
+
+
+class InvalidExtractor(Exception):
+    pass
+
+
+def get_extractor_path(extractor):
+    """Returns the import path of an extractor.
+
+    :param extractor: A module-level function, or its import path in the
+        form of ``"package.module:function"``.
+    :return: The import path.
+    """
+
+    if isinstance(extractor, basestring):
+        if ':' not in extractor:
+            raise InvalidExtractor('The import path must be in the form of '
+                                   '"package.module:function"')
+        return extractor
+
+    module_name = getattr(extractor, '__module__', None)
+    name = getattr(extractor, '__name__', None)
+
+    # the extractor is imported by name in the PiCloud job
+    module = sys.modules.get(module_name)
+    if module is None or getattr(module, name, None) is not extractor:
+        raise InvalidExtractor('The extractor must be a module-level function')
+
+    return '%s:%s' % (module_name, name)
+
+
+def resolve_extractor(path):
+    """Imports the extractor.
+
+    :param str path: The import path returned by :func:`get_extractor_path`.
+    :return: The extractor function.
+    """
+
+    extractor = _extractors.get(path)
+    if extractor is None:
+        (module_name, name) = path.split(':', 1)
+        module = __import__(module_name, fromlist=[name])
+        extractor = _extractors[path] = getattr(module, name)
+
+    return extractor
+
+
+def extract_links(response):
+    """Extractor that returns the absolute URLs of the links in an HTML page.
+
+    The HTML entities in the links are decoded, and the relative links are
+    resolved against the URL of the response after the redirects. The
+    fragments are removed from the URLs, and only the HTTP and HTTPS links
+    are returned.
+
+    :param response: A :class:`Response <picrawler.response.Response>` instance.
+    :return: A list of URLs.
+    """
+
+    content_type = (response.headers or {}).get('content-type', 'text/html')
+    if 'html' not in content_type.lower() or not response.content:
+        return []
+
+    base_url = response.url
+    links = []
+    seen = set()
+
+    for match in _LINK_RE.finditer(response.content):
+        href = (match.group(1) or match.group(2) or match.group(3) or '').strip()
+        if not href or href.startswith('#'):
+            continue
+
+        href = _unescape(href)
+        url = urlparse.urldefrag(urlparse.urljoin(base_url, href))[0]
+        if not url.startswith(('http://', 'https://')) or url in seen:
+            continue
+
+        seen.add(url)
+        links.append(url)
+
+    return links
+
+
+def _unescape(href):
+    # decodes the HTML entities such as "&amp;" in an attribute value
+    if '&' not in href:
+        return href
+
+    try:
+        href = _html_parser.unescape(href)
+    except UnicodeDecodeError:
+        # the entities are decoded into unicode characters, which cannot be
+        # mixed with the non-ASCII bytes of the value
+        href = _html_parser.unescape(href.decode('utf-8', 'replace'))
+
+    if isinstance(href, unicode):
+        href = href.encode('utf-8')
+
+    return href
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import cPickle as pickle
+import sqlite3
+import threading
+import time
+
+PENDING = 0
+COMPLETED = 1
+
+
+class Journal(object):
+    """Class that records the progress of the requests in a SQLite database,
+    so that the unfinished requests can be resumed after the client dies.
+
+    The pending requests are written when they are pushed, whereas the
+    completions are buffered in memory and written in a single transaction
+    every ``flush_interval`` seconds or every ``flush_size`` records. If the
+    client dies before the buffer is written, the requests completed in the
+    meantime are fetched again on resume.
+
+    .. note::
+        The callbacks of the requests are not recorded. The resumed requests
+        are sent without callbacks.
+
+    Usage:
+
+        >>> journal = Journal('/tmp/picrawler.journal')
+        >>> journal.add_pending([Request('http://www.wikipedia.org')])
+        >>> [r.url for r in journal.pending_requests()]
+        ['http://www.wikipedia.org']
+
+    :param str path: The path to the database file.
+    :param float flush_interval: (optional) The maximum number of seconds the
+        completions are kept in the buffer.
+    :param int flush_size: (optional) The maximum number of the completions
+        kept in the buffer.
+    """
+
+    def __init__(self, path, flush_interval=1.0, flush_size=1000):
+        self._path = path
+        self._flush_interval = flush_interval
+        self._flush_size = flush_size
+
+        self._buffer = []
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # the committed writes survive a crash of the client process without
+        # waiting for the disk. only an OS crash may lose the latest writes
+        self._db.execute('PRAGMA synchronous = OFF')
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS requests ('
+                         'id INTEGER PRIMARY KEY, '
+                         'state INTEGER NOT NULL, '
+                         'url TEXT NOT NULL, '
+                         'data BLOB, '
+                         'content_key TEXT)')
+        self._db.commit()
+
+    @property
+    def path(self):
+        return self._path
+
+    def add_pending(self, requests):
+        """Records the requests as pending. The records are written
+        immediately.
+
+        :param requests: A list of :class:`Request <picrawler.request.Request>`
+            instances.
+        """
+
+        rows = [(request.id, PENDING, request.url,
+                 sqlite3.Binary(pickle.dumps(request, pickle.HIGHEST_PROTOCOL)))
+                for request in requests]
+
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO requests '
+                                 '(id, state, url, data) VALUES (?, ?, ?, ?)',
+                                 rows)
+            self._db.commit()
+
+    def add_completed(self, request_id, content_key=None):
+        """Records the request as completed. The record is buffered.
+
+        :param int request_id: The ID of the request.
+        :param str content_key: (optional) The key of the content saved in a
+            :class:`ContentStore <picrawler.store.ContentStore>`.
+        """
+
+        with self._lock:
+            self._buffer.append((COMPLETED, content_key, request_id))
+
+            if (len(self._buffer) >= self._flush_size or
+                time.time() - self._last_flush >= self._flush_interval):
+                self._flush()
+
+    def flush(self):
+        """Writes the buffered records."""
+
+        with self._lock:
+            self._flush()
+
+    def pending_requests(self):
+        """Returns the requests that have not been completed.
+
+        :return: A list of :class:`Request <picrawler.request.Request>`
+            instances in the order of their IDs.
+        """
+
+        with self._lock:
+            self._flush()
+            rows = self._db.execute('SELECT data FROM requests WHERE state = ? '
+                                    'ORDER BY id', (PENDING,)).fetchall()
+
+        return [pickle.loads(str(data)) for (data,) in rows]
+
+    def completed(self):
+        """Returns the completed requests.
+
+        :return: A list of ``(request_id, url, content_key)`` tuples.
+            ``content_key`` is None unless the content has been saved in a
+            :class:`ContentStore <picrawler.store.ContentStore>`.
+        """
+
+        with self._lock:
+            self._flush()
+            return self._db.execute('SELECT id, url, content_key FROM requests '
+                                    'WHERE state = ? ORDER BY id',
+                                    (COMPLETED,)).fetchall()
+
+    def max_id(self):
+        """Returns the largest request ID recorded, or 0 if it is empty.
+
+        :type: int
+        """
+
+        with self._lock:
+            (max_id,) = self._db.execute('SELECT MAX(id) FROM requests').fetchone()
+
+        return max_id or 0
+
+    def close(self):
+        """Writes the buffered records and closes the database."""
+
+        with self._lock:
+            self._flush()
+            self._db.close()
+
+    def _flush(self):
+        if self._buffer:
+            self._db.executemany('UPDATE requests SET state = ?, '
+                                 'content_key = ? WHERE id = ?', self._buffer)
+            self._db.commit()
+            self._buffer = []
+
+        self._last_flush = time.time()
@@ -1,14 +1,34 @@
 # -*- coding: utf-8 -*-
 
-import cloud
 import collections
 import datetime
+import itertools
+import logging
+import math
+import time
 
-from request import Request
+from backends import PiCloudBackend
+from callbacks import CallbackRegistry
+from compression import Compressor
+from dispatcher import CallbackDispatcher
+from journal import Journal
+from request import FetchLimits, Request, skip_ids
+from response import Response, Timings
+from scheduler import HostScheduler
+from simhash import SimHashIndex
+from stats import Stats
+from store import ContentStore
+from worker import RequestHandler
 
 REQUEST_QUEUE_PREFIX = 'picrawler_request_'
 RESULT_QUEUE_PREFIX = 'picrawler_result_'
 
+# the maximum delay of a message supported by the queue
+MAX_PUSH_DELAY = 900
+
+
+logger = logging.getLogger(__name__)
+
 
 class InvalidRequest(Exception):
     pass
@@ -29,11 +49,218 @@ class PiCloudConnection(object):
 
     :param int max_parallel_jobs: (optional) The number of parallel jobs to run.
     :param str core_type: (optional) PiCloud core type.
+    :param int pop_timeout: (optional) Seconds to block on each pop of the
+        result queue. Must be an integer between 0 and 20.
+    :param float backoff_base: (optional) Seconds to sleep after the first
+        empty pop. The sleep is doubled on each subsequent empty pop.
+    :param float backoff_max: (optional) The upper bound of the sleep.
+    :param float stall_timeout: (optional) Seconds without any result after
+        which the remote queues are inspected to detect requests whose
+        results will never arrive.
+    :param int pool_size: (optional) The maximum number of keep-alive
+        connections per host in each PiCloud job process.
+    :param float pool_idle_timeout: (optional) Seconds after which an unused
+        keep-alive connection pool is closed.
+    :param int batch_size: (optional) The number of requests processed by a
+        single PiCloud job. The requests in a batch are fetched concurrently,
+        and their responses are returned in a single message.
+    :param int per_job_concurrency: (optional) The maximum number of requests
+        fetched at the same time inside a single PiCloud job. Since the jobs
+        mostly wait for network I/O, a single core can keep many requests in
+        flight. Defaults to ``batch_size``.
+    :param str compression: (optional) The codec used to compress the
+        responses. ("none" or "zlib" or "lz4" or "snappy")
+    :param int compression_level: (optional) The compression level of the
+        zlib codec.
+    :param int compression_threshold: (optional) The responses smaller than
+        this number of bytes are not compressed.
+    :param str store_path: (optional) A directory where large contents are
+        saved. If specified, the contents larger than ``spill_threshold`` are
+        moved out of the memory into a
+        :class:`ContentStore <picrawler.store.ContentStore>`, and are read
+        back through memory-mapped views.
+    :param int store_max_size: (optional) The maximum total size of the
+        stored contents in bytes.
+    :param int spill_threshold: (optional) The contents larger than this
+        number of bytes are saved into the store.
+    :param backend: (optional) A :class:`Backend <picrawler.backends.Backend>`
+        instance that provides the queues. Defaults to
+        :class:`PiCloudBackend <picrawler.backends.PiCloudBackend>`.
+    :param int callback_workers: (optional) The number of threads that run
+        the callbacks. If 0, the callbacks are run in the polling loop. In
+        either case, the exceptions raised in the callbacks are logged and
+        counted as ``callback_errors`` in the stats.
+    :param int callback_queue_size: (optional) The maximum number of the
+        callbacks waiting to be run. The polling loop blocks while the queue
+        is full.
+    :param bool callback_ordered_per_host: (optional) If True, the callbacks
+        of the responses from the same host are run in the order of arrival.
+    :param str journal_path: (optional) A SQLite database file where the
+        progress of the requests is recorded. If specified, the requests left
+        unfinished by a previous client can be sent again by :func:`resume`.
+        (See :class:`Journal <picrawler.journal.Journal>`)
+    :param float journal_flush_interval: (optional) The maximum number of
+        seconds the completions are buffered before written to the journal.
+    :param float host_rate: (optional) The maximum number of requests per
+        second sent to each host. If specified, the requests are held back on
+        the client and pushed to the queue when their hosts allow.
+        (See :class:`HostScheduler <picrawler.scheduler.HostScheduler>`)
+    :param int host_burst: (optional) The number of requests that can be sent
+        to a host at once after it has been idle.
+    :param int max_per_host: (optional) The maximum number of requests in
+        flight for each host.
+    :param retry_policy: (optional) A
+        :class:`RetryPolicy <picrawler.retry.RetryPolicy>` instance used for
+        the requests that do not have their own policy. If None, the failed
+        requests are not retried.
+    :param float hedge_percentile: (optional) If specified, a request that
+        has not completed within this percentile of the latencies observed so
+        far is pushed once more, and the response that arrives first is used.
+    :param int hedge_min_samples: (optional) The number of completed requests
+        required before the requests are hedged.
+    :param cache: (optional) An :class:`HTTPCache <picrawler.cache.HTTPCache>`
+        instance. If specified, the fresh cached responses are returned
+        without sending the requests, and the other GET requests are sent as
+        conditional requests.
+    :param int max_content_bytes: (optional) The maximum size of a body
+        downloaded in the PiCloud job. The larger bodies are truncated.
+    :param float max_fetch_time: (optional) The maximum number of seconds
+        spent to download a body. The bodies taking longer are truncated.
+    :param allowed_content_types: (optional) A list of content types such as
+        ``"text/html"`` or ``"text/*"`` whose bodies are downloaded. The
+        bodies of the other content types are discarded without being
+        downloaded. (See :class:`FetchLimits <picrawler.request.FetchLimits>`)
+    :param str near_duplicates: (optional) How the responses whose contents
+        are nearly identical to an earlier response are handled. If
+        ``"drop"``, they are not returned at all. If ``"collapse"``, they are
+        returned without the contents, and
+        :attr:`duplicate_of <picrawler.response.Response.duplicate_of>` is set.
+        The near-duplicates are detected by the SimHash fingerprints computed
+        in the PiCloud jobs. (See :class:`SimHashIndex <picrawler.simhash.SimHashIndex>`)
+    :param int near_duplicate_distance: (optional) The maximum number of
+        differing bits of the fingerprints of the near-duplicates.
+    :param canonicalizer: (optional) A function that converts a URL into its
+        canonical form, such as a
+        :class:`URLCanonicalizer <picrawler.canonical.URLCanonicalizer>`
+        instance. If specified, the URLs of the requests are replaced with
+        the canonical URLs, and the GET and HEAD requests for the same
+        canonical URL are sent only once while one of them is in flight.
+        The other requests share the response, and their callbacks are run
+        with it.
+    :param int max_in_flight: (optional) The maximum number of requests in
+        flight. If specified, the requests are read lazily from the input,
+        and new requests are pushed as the responses arrive, so the memory
+        usage does not depend on the length of the input.
+    :param int push_chunk_size: (optional) The maximum number of messages
+        pushed to the request queue at once. If None, all the requests are
+        pushed at once.
+    :param str queue_id: (optional) The suffix of the names of the queues.
+        Defaults to the current time. The connections used at the same time
+        must have different IDs.
     """
 
-    def __init__(self, max_parallel_jobs=10, core_type='s1'):
+    def __init__(self, max_parallel_jobs=10, core_type='s1', pop_timeout=20,
+                 backoff_base=0.1, backoff_max=5.0, stall_timeout=60,
+                 pool_size=10, pool_idle_timeout=60, batch_size=1,
+                 per_job_concurrency=None, compression='zlib',
+                 compression_level=6, compression_threshold=1024,
+                 store_path=None, store_max_size=1024 ** 3,
+                 spill_threshold=1024 ** 2, backend=None, callback_workers=0,
+                 callback_queue_size=100, callback_ordered_per_host=False,
+                 journal_path=None, journal_flush_interval=1.0,
+                 host_rate=None, host_burst=1, max_per_host=None,
+                 retry_policy=None, hedge_percentile=None,
+                 hedge_min_samples=20, cache=None, max_content_bytes=None,
+                 max_fetch_time=None, allowed_content_types=None,
+                 near_duplicates=None, near_duplicate_distance=3,
+                 canonicalizer=None, max_in_flight=None, push_chunk_size=None,
+                 queue_id=None):
         self._max_parallel_jobs = max_parallel_jobs
         self._core_type = core_type
+        self._pop_timeout = pop_timeout
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._stall_timeout = stall_timeout
+        self._pool_size = pool_size
+        self._pool_idle_timeout = pool_idle_timeout
+        self._batch_size = batch_size
+        self._per_job_concurrency = per_job_concurrency or batch_size
+        self._compressor = Compressor(compression, compression_level,
+                                      compression_threshold)
+        self._spill_threshold = spill_threshold
+
+        if (max_content_bytes is not None or max_fetch_time is not None or
+            allowed_content_types is not None):
+            self._limits = FetchLimits(max_content_bytes, max_fetch_time,
+                                       allowed_content_types)
+        else:
+            self._limits = None
+
+        if near_duplicates not in (None, 'drop', 'collapse'):
+            raise ValueError('near_duplicates must be either "drop" or "collapse"')
+
+        self._near_duplicates = near_duplicates
+        if near_duplicates is not None:
+            self._fingerprint_index = SimHashIndex(near_duplicate_distance)
+        else:
+            self._fingerprint_index = None
+
+        if store_path:
+            self._store = ContentStore(store_path, store_max_size)
+        else:
+            self._store = None
+
+        self._backend = backend or PiCloudBackend()
+        self._callback_workers = callback_workers
+        self._callback_queue_size = callback_queue_size
+        self._callback_ordered_per_host = callback_ordered_per_host
+        self._dispatcher = None
+
+        if journal_path:
+            self._journal = Journal(journal_path, journal_flush_interval)
+            # the new requests must not reuse the IDs in the journal
+            skip_ids(self._journal.max_id())
+        else:
+            self._journal = None
+
+        if host_rate is not None or max_per_host is not None:
+            self._scheduler = HostScheduler(host_rate, host_burst, max_per_host)
+        else:
+            self._scheduler = None
+
+        self._retry_policy = retry_policy
+        self._retries = {}
+        self._hedge_percentile = hedge_percentile
+        self._hedge_min_samples = hedge_min_samples
+        self._hedge_candidates = collections.OrderedDict()
+        self._hedged = {}
+        self._delayed_until = 0
+
+        self._cache = cache
+
+        self._canonicalizer = canonicalizer
+        # canonical key -> request id
+        self._coalesce_keys = {}
+        # request id -> canonical key
+        self._request_keys = {}
+        # request id -> requests waiting for the same response
+        self._followers = {}
+        # request id of a follower -> request id of the sent request
+        self._primary_ids = {}
+        # the same mapping of the completed followers recorded during send()
+        self._completed_primary_ids = None
+        self._ready = collections.deque()
+
+        self._max_in_flight = max_in_flight
+        self._push_chunk_size = push_chunk_size
+        # iterators of the requests that have not been pushed yet
+        self._sources = collections.deque()
+
+        self._queue_id = queue_id
+
+        self._outstanding = set()
+        self._callbacks = CallbackRegistry()
+        self._stats = Stats()
 
         self._connected = False
 
@@ -50,6 +277,14 @@ class PiCloudConnection(object):
     def is_connected(self):
         return self._connected
 
+    @property
+    def is_idle(self):
+        """Whether no request is in flight or waiting to be pushed.
+
+        :type: bool
+        """
+        return self._requests_completed()
+
     @property
     def request_queue(self):
         return self._request_queue
@@ -58,11 +293,74 @@ class PiCloudConnection(object):
     def result_queue(self):
         return self._result_queue
 
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def callbacks(self):
+        """The callbacks of the requests in flight.
+
+        :type: :class:`CallbackRegistry <picrawler.callbacks.CallbackRegistry>`
+        """
+        return self._callbacks
+
+    @property
+    def store(self):
+        """The :class:`ContentStore <picrawler.store.ContentStore>` where the
+        large contents are saved, or None if it is not used.
+
+        :type: :class:`ContentStore <picrawler.store.ContentStore>`
+        """
+        return self._store
+
+    @property
+    def journal(self):
+        """The :class:`Journal <picrawler.journal.Journal>` where the progress
+        of the requests is recorded, or None if it is not used.
+
+        :type: :class:`Journal <picrawler.journal.Journal>`
+        """
+        return self._journal
+
+    @property
+    def scheduler(self):
+        """The :class:`HostScheduler <picrawler.scheduler.HostScheduler>` that
+        holds the requests back, or None if the requests are pushed at once.
+
+        :type: :class:`HostScheduler <picrawler.scheduler.HostScheduler>`
+        """
+        return self._scheduler
+
+    @property
+    def cache(self):
+        """The :class:`HTTPCache <picrawler.cache.HTTPCache>`, or None if the
+        responses are not cached.
+
+        :type: :class:`HTTPCache <picrawler.cache.HTTPCache>`
+        """
+        return self._cache
+
+    @property
+    def stats(self):
+        """Runtime counters of the connection, such as the number of calls to
+        the queue service, and the histograms of the durations of the stages
+        of the requests. (See :class:`Timings <picrawler.response.Timings>`)
+
+        :type: :class:`Stats <picrawler.stats.Stats>`
+        """
+        return self._stats
+
     def connect(self):
         """Establishes a connection to PiCloud."""
 
         self._initialize_queues()
 
+        if self._callback_workers > 0:
+            self._dispatcher = CallbackDispatcher(
+                self._callback_workers, self._callback_queue_size,
+                self._callback_ordered_per_host, self._stats)
+
         self._connected = True
 
     def close(self):
@@ -70,8 +368,15 @@ class PiCloudConnection(object):
 
         assert self._connected, 'The connection to PiCloud has not been established.'
 
+        if self._dispatcher is not None:
+            self._dispatcher.close()
+            self._dispatcher = None
+
         self._destroy_queues()
-        cloud.close()
+        self._backend.close()
+
+        if self._journal is not None:
+            self._journal.flush()
 
         self._connected = False
 
@@ -90,47 +395,170 @@ class PiCloudConnection(object):
 
         assert self._connected, 'The connection to PiCloud has not been established.'
 
-        # covert req into a list of Request instances
-        if isinstance(req, basestring):
-            requests = [Request(req)]
-
-        elif isinstance(req, Request):
-            requests = [req]
-
-        elif isinstance(req, collections.Iterable):
-            requests = []
-            for request in req:
-                if isinstance(request, Request):
-                    requests.append(request)
-                elif isinstance(request, basestring):
-                    requests.append(Request(request))
-                else:
-                    raise InvalidRequest('Invalid request item')
+        requests = self._to_requests(req)
 
-        else:
-            raise InvalidRequest('req must be either an instance of the '
-                                 'Request class or an iteratable of Request instances')
+        # the coalesced requests receive the responses of the sent requests.
+        # the mapping is recorded as the responses arrive, since the requests
+        # may be coalesced while the input is pushed lazily
+        primary_ids = self._completed_primary_ids = {}
+        try:
+            # send requests to the PiCloud queue
+            self._add_requests(iter(requests))
 
-        # send requests to the PiCloud queue
-        self._request_queue.push(requests)
+            responses = self._loop()
+        finally:
+            self._completed_primary_ids = None
 
-        responses = self._loop()
         req_resp_map = {}
         for resp in responses:
             req_resp_map[resp.request.id] = resp
 
-        return [req_resp_map.get(r.id) for r in requests]
+        return [req_resp_map.get(primary_ids.get(r.id, r.id)) for r in requests]
+
+    def send_iter(self, req):
+        """Sends the requests to PiCloud and yields the responses as they
+        arrive.
+
+        Unlike :func:`send`, the responses are not gathered into a list, so
+        only the responses currently being processed are kept in memory. The
+        responses are yielded in the order of completion, not in the order of
+        the requests.
+
+        Usage:
+
+            >>> with PiCloudConnection() as conn:
+            ...     for response in conn.send_iter(urls):
+            ...         print response.request.url, response.status_code
+
+        .. note::
+            The generator must be exhausted before sending other requests
+            through the same connection. Otherwise, the remaining responses
+            are left in the result queue.
+
+        :param req: Requests to be sended to PiCloud. Accepts the same values as
+            :func:`send`. If ``max_in_flight`` is specified, an iterable is
+            read lazily while the responses are iterated.
+        :return: A generator of :class:`BaseResponse <picrawler.response.BaseResponse>` instances.
+        """
+
+        assert self._connected, 'The connection to PiCloud has not been established.'
+
+        # send requests to the PiCloud queue
+        self._add_requests(iter_requests(req))
+
+        return self._iter_responses()
+
+    def push(self, req):
+        """Sends the requests to PiCloud without waiting for the responses.
+
+        The responses are yielded by :func:`iter_responses`. The requests can
+        be pushed while iterating the responses, which allows feeding new
+        requests based on the earlier responses.
+
+        :param req: Requests to be sended to PiCloud. Accepts the same values as
+            :func:`send_iter`.
+        """
+
+        assert self._connected, 'The connection to PiCloud has not been established.'
+
+        self._add_requests(iter_requests(req))
+
+    def iter_responses(self):
+        """Yields the responses of the pushed requests as they arrive, until
+        no request remains in flight.
+
+        :return: A generator of :class:`BaseResponse <picrawler.response.BaseResponse>` instances.
+        """
+
+        assert self._connected, 'The connection to PiCloud has not been established.'
+
+        return self._iter_responses()
+
+    def resume(self):
+        """Sends the requests left unfinished in the journal again without
+        waiting for the responses. The responses are yielded by
+        :func:`iter_responses`.
+
+        Usage:
+
+            >>> with PiCloudConnection(journal_path='crawl.journal') as conn:
+            ...     conn.resume()
+            ...     for response in conn.iter_responses():
+            ...         print response.request.url, response.status_code
+
+        .. note::
+            The callbacks are not recorded in the journal, so the resumed
+            requests have no callbacks.
+
+        :return: List of the resumed :class:`Request <picrawler.request.Request>` instances.
+        """
+
+        assert self._connected, 'The connection to PiCloud has not been established.'
+        assert self._journal is not None, 'The journal is not specified.'
+
+        requests = [r for r in self._journal.pending_requests()
+                    if r.id not in self._outstanding]
+        if requests:
+            self._push(requests)
+
+        return requests
+
+    def _to_requests(self, req):
+        # covert req into a list of Request instances
+        return list(iter_requests(req))
+
+    def _add_requests(self, requests):
+        if self._max_in_flight is None and self._push_chunk_size is None:
+            self._push(list(requests))
+        else:
+            self._sources.append(requests)
+            self._fill()
+
+    def _fill(self):
+        # push the requests from the sources while the window has room
+        while self._sources:
+            size = self._push_chunk_size
+            if self._max_in_flight is not None:
+                room = self._max_in_flight - len(self._outstanding)
+                if room <= 0:
+                    return
+
+                size = min(size or room, room)
+
+            requests = list(itertools.islice(self._sources[0], size))
+            if len(requests) < size:
+                self._sources.popleft()
+
+            if requests:
+                self._push(requests)
 
     def _initialize_queues(self):
 
-        queue_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        self._request_queue = cloud.queue.get(REQUEST_QUEUE_PREFIX + queue_id)
-        self._result_queue = cloud.queue.get(RESULT_QUEUE_PREFIX + queue_id)
+        queue_id = self._queue_id
+        if queue_id is None:
+            queue_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        self._request_queue = self._backend.get_queue(REQUEST_QUEUE_PREFIX + queue_id)
+        self._result_queue = self._backend.get_queue(RESULT_QUEUE_PREFIX + queue_id)
 
         # attach the request handler to the queue
-        self._request_queue.attach(lambda req: req(),
+        handler = RequestHandler(pool_size=self._pool_size,
+                                 pool_idle_timeout=self._pool_idle_timeout,
+                                 concurrency=self._per_job_concurrency,
+                                 compressor=self._compressor,
+                                 limits=self._limits,
+                                 fingerprint=self._near_duplicates is not None)
+
+        # the requests in a batch are fetched concurrently by the handler,
+        # whereas single requests are read concurrently by the job itself
+        if self._batch_size > 1:
+            readers_per_job = 1
+        else:
+            readers_per_job = self._per_job_concurrency
+
+        self._request_queue.attach(handler,
                                    output_queues=[self._result_queue],
                                    max_parallel_jobs=self._max_parallel_jobs,
+                                   readers_per_job=readers_per_job,
                                    _type=self._core_type)
 
     def _destroy_queues(self):
@@ -141,37 +569,497 @@ class PiCloudConnection(object):
         self._request_queue = None
         self._result_queue = None
 
+    def _push(self, requests):
+        if self._canonicalizer is not None:
+            requests = self._coalesce(requests)
+            if not requests:
+                return
+
+        for request in requests:
+            self._outstanding.add(request.id)
+            self._callbacks.register(request)
+
+            retry_policy = request.retry_policy or self._retry_policy
+            if retry_policy is not None:
+                self._retries[request.id] = [request, retry_policy, 0]
+
+        if self._journal is not None:
+            # the requests are recorded before they are pushed so that no
+            # request is lost if the client dies in between
+            self._journal.add_pending(requests)
+
+        if self._cache is not None:
+            requests = self._serve_from_cache(requests)
+            if not requests:
+                return
+
+        if self._scheduler is not None:
+            self._scheduler.add(requests)
+            self._push_scheduled()
+        else:
+            self._enqueue(requests)
+
+    def _coalesce(self, requests):
+        # returns the requests to be sent. the others wait for the responses
+        # of the requests in flight with the same canonical key
+        primaries = []
+        for request in requests:
+            request.url = self._canonicalizer(request.url)
+
+            key = _get_coalesce_key(request)
+            primary_id = self._coalesce_keys.get(key) if key else None
+            if primary_id is None:
+                if key:
+                    self._coalesce_keys[key] = request.id
+                    self._request_keys[request.id] = key
+                primaries.append(request)
+                continue
+
+            self._followers.setdefault(primary_id, []).append(request)
+            self._primary_ids[request.id] = primary_id
+            self._callbacks.register(request)
+            self._stats.incr('coalesced_requests')
+
+        return primaries
+
+    def _serve_from_cache(self, requests):
+        # the fresh responses are delivered by the next pop. returns the
+        # requests to be sent
+        missed = []
+        for request in requests:
+            response = self._cache.prepare(request)
+            if response is not None:
+                self._ready.append(response)
+            else:
+                missed.append(request)
+
+        return missed
+
+    def _push_scheduled(self):
+        # push the requests whose hosts are ready
+        requests = self._scheduler.ready()
+        if requests:
+            self._enqueue(requests)
+
+    def _enqueue(self, requests, delay=0):
+        # the delayed requests become visible in the queue after the delay
+        now = time.time() + delay
+        for request in requests:
+            request.enqueued_at = now
+
+            if self._hedge_percentile is not None:
+                # the candidates are kept in the order of the push. the
+                # delayed retries are not hedged, since a hedge would be
+                # pushed without the delay requested by the server
+                self._hedge_candidates.pop(request.id, None)
+                if not delay:
+                    self._hedge_candidates[request.id] = request
+
+        self._push_messages(requests, delay)
+
+    def _push_messages(self, requests, delay=0):
+        if self._batch_size > 1:
+            # each batch is processed by a single job
+            messages = [requests[n:n + self._batch_size]
+                        for n in xrange(0, len(requests), self._batch_size)]
+        else:
+            messages = requests
+
+        chunk_size = self._push_chunk_size or len(messages) or 1
+        for n in xrange(0, len(messages), chunk_size):
+            chunk = messages[n:n + chunk_size]
+            if delay:
+                self._request_queue.push(chunk, delay=delay)
+            else:
+                self._request_queue.push(chunk)
+            self._stats.incr('push_calls')
+
+    def _push_hedges(self):
+        histogram = self._stats.histogram('response_latency')
+        if histogram is None or histogram.count < self._hedge_min_samples:
+            return
+
+        now = time.time()
+        deadline = now - histogram.percentile(self._hedge_percentile)
+
+        requests = []
+        while self._hedge_candidates:
+            (request_id, request) = self._hedge_candidates.iteritems().next()
+            if request.enqueued_at > deadline:
+                break
+
+            del self._hedge_candidates[request_id]
+            requests.append(request)
+
+        if not requests:
+            return
+
+        # the duplicates share the IDs with the original requests, so the
+        # response that arrives later is dropped as a stray response
+        for request in requests:
+            request.enqueued_at = now
+            self._hedged[request.id] = now
+
+        self._push_messages(requests)
+        self._stats.incr('hedged_requests', len(requests))
+
+    def _hedge_wait_time(self):
+        # returns seconds until the oldest candidate is hedged, or None if no
+        # request will be hedged
+        if not self._hedge_candidates:
+            return None
+
+        histogram = self._stats.histogram('response_latency')
+        if histogram is None or histogram.count < self._hedge_min_samples:
+            return None
+
+        request = self._hedge_candidates.itervalues().next()
+        hedge_at = (request.enqueued_at +
+                    histogram.percentile(self._hedge_percentile))
+
+        return max(0.0, hedge_at - time.time())
+
+    def _retry(self, response):
+        entry = self._retries.get(response.request.id)
+        if entry is None:
+            return False
+
+        (request, retry_policy, attempt) = entry
+        if not retry_policy.should_retry(response, attempt):
+            return False
+
+        entry[2] += 1
+        delay = retry_policy.get_delay(response, attempt)
+        # the delay is clamped before the conversion, which overflows on huge
+        # values
+        delay = int(math.ceil(min(MAX_PUSH_DELAY, delay)))
+
+        # the retried request keeps its slot in the scheduler
+        self._hedged.pop(request.id, None)
+        self._delayed_until = max(self._delayed_until, time.time() + delay)
+        self._enqueue([request], delay)
+        self._stats.incr('retries')
+
+        return True
+
+    def _find_near_duplicate(self, response):
+        # returns the URL of the earlier response with a similar content
+        if (not isinstance(response, Response) or
+            response.fingerprint is None or
+            not 200 <= response.status_code < 300):
+            return None
+
+        duplicate_of = self._fingerprint_index.find(response.fingerprint)
+        if duplicate_of is None:
+            self._fingerprint_index.add(response.fingerprint,
+                                        response.request.url)
+
+        return duplicate_of
+
+    def _complete(self, response):
+        # returns the coalesced requests waiting for the response
+        request_id = response.request.id
+
+        self._outstanding.discard(request_id)
+        self._retries.pop(request_id, None)
+        followers = self._release_key(request_id)
+
+        if self._scheduler is not None:
+            self._scheduler.release(request_id)
+
+        if self._journal is not None:
+            if isinstance(response, Response):
+                content_key = response.content_key
+            else:
+                content_key = None
+            self._journal.add_completed(request_id, content_key)
+
+        if self._hedge_percentile is not None:
+            self._hedge_candidates.pop(request_id, None)
+            hedged_at = self._hedged.pop(request_id, None)
+            enqueued_at = response.request.enqueued_at
+            if enqueued_at is not None:
+                if hedged_at is not None and enqueued_at == hedged_at:
+                    self._stats.incr('hedge_wins')
+
+                self._stats.observe('response_latency',
+                                    time.time() - enqueued_at)
+
+        return followers
+
+    def _release_key(self, request_id):
+        key = self._request_keys.pop(request_id, None)
+        if key is not None:
+            del self._coalesce_keys[key]
+
+        followers = self._followers.pop(request_id, [])
+        for request in followers:
+            del self._primary_ids[request.id]
+
+        return followers
+
+    def _pop(self, timeout):
+        if self._ready:
+            # the responses served from the cache
+            responses = list(self._ready)
+            self._ready.clear()
+            return responses
+
+        self._stats.incr('pop_calls')
+        messages = self._result_queue.pop(timeout=timeout)
+        if not messages:
+            self._stats.incr('empty_pops')
+            return []
+
+        # unpack the batch results
+        responses = []
+        for message in messages:
+            if isinstance(message, list):
+                responses.extend(message)
+            else:
+                responses.append(message)
+
+        now = time.time()
+        for response in responses:
+            if response.timings is not None:
+                response.timings.popped = now
+
+            if response.encode_time is not None:
+                self._stats.incr('encode_time', response.encode_time)
+            if response.encoded_size is not None:
+                self._stats.incr('encoded_bytes', response.encoded_size)
+
+            if isinstance(response, Response) and response.truncated:
+                self._stats.incr('truncated_responses')
+
+        if self._cache is not None:
+            # replace the 304 responses with the cached responses
+            updated = []
+            for response in responses:
+                cached = self._cache.update(response)
+                if cached is not None:
+                    updated.append(cached)
+                elif response.request.id in self._outstanding:
+                    # the cached response has been evicted, so the request is
+                    # sent again without the conditional headers
+                    self._enqueue([response.request])
+                    self._stats.incr('cache_resends')
+
+            responses = updated
+
+        return responses
+
     def _loop(self):
-        gathered_responses = []
+        return list(self._iter_responses())
+
+    def _iter_responses(self):
+        backoff = self._backoff_base
+        idle_since = time.time()
+
+        while not self._requests_completed():
+            if self._sources:
+                self._fill()
+
+            timeout = self._pop_timeout
+            wait_time = None
+            if self._hedge_percentile is not None:
+                self._push_hedges()
+                wait_time = self._hedge_wait_time()
+
+            if self._scheduler is not None:
+                self._push_scheduled()
+
+                scheduler_wait_time = self._scheduler.wait_time()
+                if (scheduler_wait_time is not None and
+                    (wait_time is None or scheduler_wait_time < wait_time)):
+                    wait_time = scheduler_wait_time
+
+            # do not block longer than the next scheduled push or hedge
+            if wait_time is not None:
+                timeout = min(timeout, int(math.ceil(wait_time)))
 
-        c = 0
-        while True:
             # get the results
-            responses = self._result_queue.pop(timeout=0)
+            responses = self._pop(timeout)
 
-            if responses:
-                for response in responses:
-                    response.run_callback()
+            if not responses:
+                if time.time() - idle_since >= self._stall_timeout:
+                    self._check_stalled()
+                    idle_since = time.time()
 
-                gathered_responses += responses
+                # back off exponentially while the result queue is empty
+                if wait_time is not None:
+                    time.sleep(min(backoff, wait_time))
+                else:
+                    time.sleep(backoff)
+                backoff = min(self._backoff_max, backoff * 2)
+                continue
 
-            # break the loop if completed
-            if c % 3 == 0 and self._requests_completed():
-                break
+            backoff = self._backoff_base
+            idle_since = time.time()
+
+            for response in responses:
+                request_id = response.request.id
+                if request_id not in self._outstanding:
+                    self._stats.incr('stray_responses')
+                    continue
+
+                if self._retry(response):
+                    continue
+
+                if self._fingerprint_index is not None:
+                    duplicate_of = self._find_near_duplicate(response)
+                    if duplicate_of is not None:
+                        self._stats.incr('near_duplicates')
+                        if self._near_duplicates == 'drop':
+                            followers = self._complete(response)
+                            for request in [response.request] + followers:
+                                self._callbacks.release(request.id)
+                            continue
+
+                        response.collapse(duplicate_of)
+
+                # the contents are moved to the store after the stray and
+                # duplicate responses are filtered out
+                if self._store is not None and isinstance(response, Response):
+                    if response.spill(self._store, self._spill_threshold):
+                        self._stats.incr('spilled_responses')
+
+                followers = self._complete(response)
+                if self._completed_primary_ids is not None:
+                    for request in followers:
+                        self._completed_primary_ids[request.id] = request_id
+
+                callback = self._callbacks.release_for(response)
+                if followers:
+                    callback = _chain_callbacks(
+                        [callback] + [self._callbacks.release_for(response, r.id)
+                                      for r in followers])
+                if self._dispatcher is not None:
+                    self._dispatcher.submit(callback, response,
+                                            self._on_callback_done)
+                else:
+                    if callback:
+                        try:
+                            callback(response)
+                        except Exception:
+                            # the same as the callbacks run by the dispatcher
+                            logger.exception('Exception in a callback')
+                            self._stats.incr('callback_errors')
+                    self._on_callback_done(response)
 
-            c += 1
+                yield response
 
-        return gathered_responses
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+
+    def _on_callback_done(self, response):
+        if response.timings is not None:
+            response.timings.callback_done = time.time()
+            self._record_timings(response.timings)
+
+    def _record_timings(self, timings):
+        for phase in Timings.PHASES:
+            duration = getattr(timings, phase)
+            if duration is not None:
+                self._stats.observe(phase, duration)
 
     def _requests_completed(self):
+        return not self._outstanding and not self._sources
+
+    def _check_stalled(self):
+        # the results of the requests will never arrive if the remote queues
+        # are idle while some requests are still outstanding
+        if time.time() < self._delayed_until:
+            # the delayed retries are not visible in the queue yet
+            return
+
+        self._stats.incr('info_calls')
         request_queue_info = self._request_queue.info()
 
         if (request_queue_info['count'] == 0 and
             request_queue_info['processing_jobs'] == 0 and
             request_queue_info['queued_jobs'] == 0):
 
-            # exit the loop if the result queue is empty
+            self._stats.incr('info_calls')
             if self._result_queue.count() == 0:
-                return True
+                if self._scheduler is not None:
+                    # the requests held back by the scheduler are not lost
+                    lost = self._outstanding - self._scheduler.waiting_ids()
+                else:
+                    lost = set(self._outstanding)
+
+                if not lost:
+                    return
+
+                logger.warning('%d requests have been lost', len(lost))
+                self._stats.incr('lost_requests', len(lost))
+                for request_id in lost:
+                    self._callbacks.release(request_id)
+                    for request in self._release_key(request_id):
+                        self._callbacks.release(request.id)
+                    self._retries.pop(request_id, None)
+                    self._hedge_candidates.pop(request_id, None)
+                    self._hedged.pop(request_id, None)
+                    if self._scheduler is not None:
+                        self._scheduler.release(request_id)
+                self._outstanding -= lost
+
+
+def iter_requests(req):
+    """Converts the value accepted by
+    :func:`PiCloudConnection.send_iter <picrawler.PiCloudConnection.send_iter>`
+    into an iterator of :class:`Request <picrawler.request.Request>`
+    instances. The items of an iterable are converted lazily.
+
+    :param req: A URL string, a :class:`Request <picrawler.request.Request>`
+        instance, or an iterable of them.
+    """
+
+    if isinstance(req, basestring):
+        return iter([Request(req)])
+
+    elif isinstance(req, Request):
+        return iter([req])
 
-        return False
+    elif isinstance(req, collections.Iterable):
+        return _convert_requests(req)
+
+    else:
+        raise InvalidRequest('req must be either an instance of the '
+                             'Request class or an iteratable of Request instances')
+
+
+def _get_coalesce_key(request):
+    # returns None if the request must not be coalesced
+    if request.method not in ('get', 'head'):
+        return None
+
+    try:
+        headers = frozenset(request.headers.iteritems())
+        args = frozenset(request.args.iteritems())
+    except TypeError:
+        return None
+
+    return (request.method, request.url, headers, args, request.extractor)
+
+
+def _chain_callbacks(callbacks):
+    callbacks = [c for c in callbacks if c]
+    if len(callbacks) <= 1:
+        return callbacks[0] if callbacks else None
+
+    def run_callbacks(response):
+        for callback in callbacks:
+            callback(response)
+
+    return run_callbacks
+
+
+def _convert_requests(items):
+    for item in items:
+        if isinstance(item, Request):
+            yield item
+        elif isinstance(item, basestring):
+            yield Request(item)
+        else:
+            raise InvalidRequest('Invalid request item')
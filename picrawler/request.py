@@ -1,15 +1,49 @@
 # -*- coding: utf-8 -*-
 
-import uuid
+import itertools
 import requests
+import time
 
-from response import Response, ErrorResponse
-
-_success_callbacks = {}
-_error_callbacks = {}
+from extractors import get_extractor_path, resolve_extractor
+from response import Response, ErrorResponse, Timings
 
 SUPPORTED_HTTP_METHODS = frozenset(['get', 'post', 'put', 'delete', 'head', 'options'])
 
+# the maximum number of distinct header dicts kept by intern_headers()
+MAX_INTERNED_HEADERS = 1024
+
+# the size of the chunks read from the body when the size is limited
+CHUNK_SIZE = 64 * 1024
+
+_id_counter = itertools.count(1)
+_interned_headers = {}
+
+
+class FrozenHeaders(dict):
+    """Read-only dict of HTTP headers shared by the requests. (See
+    :func:`intern_headers`)
+
+    The methods that modify the dict raise :class:`TypeError`. To change the
+    headers of a request, assign a new dict to
+    :attr:`Request.headers <picrawler.request.Request.headers>`.
+    """
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('The headers are read-only. Assign a new dict to '
+                        'Request.headers instead.')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        # the default pickling of dict subclasses calls __setitem__
+        return (FrozenHeaders, (dict(self),))
+
+
+_EMPTY_HEADERS = FrozenHeaders()
+
 
 class InvalidHTTPMethod(Exception):
     pass
@@ -19,6 +53,99 @@ class InvalidResponse(Exception):
     pass
 
 
+class FetchLimits(object):
+    """Class that limits the download of the bodies in the PiCloud job.
+
+    The bodies exceeding the limits are truncated, and the responses are
+    flagged by :attr:`Response.truncated <picrawler.response.Response.truncated>`.
+
+    :param int max_bytes: (optional) The maximum size of a body in bytes.
+    :param float max_time: (optional) The maximum number of seconds spent to
+        download a body. The limit is checked between the chunks, so a read
+        blocked by the server is interrupted only by the ``timeout`` argument
+        of the request.
+    :param content_types: (optional) A list of allowed content types such as
+        ``"text/html"`` or ``"text/*"``. The bodies of the other content types
+        are not downloaded at all.
+    """
+
+    __slots__ = ('_max_bytes', '_max_time', '_content_types')
+
+    def __init__(self, max_bytes=None, max_time=None, content_types=None):
+        self._max_bytes = max_bytes
+        self._max_time = max_time
+        if content_types is not None:
+            self._content_types = frozenset(t.lower() for t in content_types)
+        else:
+            self._content_types = None
+
+    def __getstate__(self):
+        return (self._max_bytes, self._max_time, self._content_types)
+
+    def __setstate__(self, state):
+        (self._max_bytes, self._max_time, self._content_types) = state
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @property
+    def max_time(self):
+        return self._max_time
+
+    def allows(self, content_type):
+        """Returns whether the body of the content type is downloaded.
+
+        :param str content_type: The value of the ``Content-Type`` header.
+        """
+
+        if self._content_types is None:
+            return True
+
+        if not content_type:
+            return False
+
+        mime_type = content_type.split(';', 1)[0].strip().lower()
+
+        return (mime_type in self._content_types or
+                mime_type.split('/', 1)[0] + '/*' in self._content_types)
+
+    def read(self, ret, start):
+        """Reads the body of a streamed response.
+
+        :param ret: A :class:`requests.Response` instance.
+        :param float start: The time when the download started.
+        :return: A tuple of the body and whether it has been truncated.
+        """
+
+        chunks = []
+        size = 0
+        truncated = False
+        for chunk in ret.iter_content(CHUNK_SIZE):
+            chunks.append(chunk)
+            size += len(chunk)
+
+            if self._max_bytes is not None and size > self._max_bytes:
+                truncated = True
+                break
+
+            if (self._max_time is not None and
+                time.time() - start > self._max_time):
+                truncated = True
+                break
+
+        content = ''.join(chunks)
+        if self._max_bytes is not None:
+            content = content[:self._max_bytes]
+
+        if truncated:
+            # the rest of the body is not read, so the connection cannot be
+            # reused
+            ret.close()
+
+        return (content, truncated)
+
+
 class Request(object):
     """Class that represents a request to PiCloud.
 
@@ -36,89 +163,251 @@ class Request(object):
     :param function error_callback: (optional) A function called if the request
         is failed. An :class:`ErrorResponse <picrawler.response.ErrorResponse>`
         instance is passed as the first argument.
+    :param extractor: (optional) A module-level function, or its import path
+        in the form of ``"package.module:function"``, that is run in the
+        PiCloud job right after the fetch. The
+        :class:`Response <picrawler.response.Response>` instance is passed as
+        the first argument, and the return value is available as
+        :attr:`Response.extracted <picrawler.response.Response.extracted>`.
+    :param bool keep_content: (optional) Whether the content is sent back
+        with the result of the extractor. By default, only the result is sent
+        back.
+    :param retry_policy: (optional) A
+        :class:`RetryPolicy <picrawler.retry.RetryPolicy>` instance that
+        decides whether the request is sent again when it fails. If not
+        specified, the policy of the connection is used.
     """
 
-    def __init__(self, url, method='get', headers={}, args={},
-                 success_callback=None, error_callback=None):
-        global _success_callbacks, _error_callbacks
+    __slots__ = ('_id', '_url', '_method', '_headers', '_args',
+                 '_enqueued_at', '_extractor', '_keep_content',
+                 '_success_callback', '_error_callback', '_retry_policy')
 
-        self._id = uuid.uuid1().hex
+    def __init__(self, url, method='get', headers=None, args=None,
+                 success_callback=None, error_callback=None, extractor=None,
+                 keep_content=False, retry_policy=None):
+        self._id = _id_counter.next()
         self._url = url
         self._method = method.lower()
-        self._headers = headers
-        self._args = args
-        self._success_callback_id = None
-        self._error_callback_id = None
+        self._headers = intern_headers(headers) if headers else None
+        self._args = args or None
+        self._enqueued_at = None
+        self._extractor = get_extractor_path(extractor) if extractor else None
+        self._keep_content = keep_content
+        self._success_callback = success_callback
+        self._error_callback = error_callback
+        self._retry_policy = retry_policy
 
         if not self._method in SUPPORTED_HTTP_METHODS:
             raise InvalidHTTPMethod('Unsupported HTTP method')
 
-        # NOTE: because the callback function cannot be pickled,
-        # it must be saved locally
-        if success_callback:
-            self._success_callback_id = uuid.uuid1().hex
-            _success_callbacks[self._success_callback_id] = success_callback
-
-        if error_callback:
-            self._error_callback_id = uuid.uuid1().hex
-            _error_callbacks[self._error_callback_id] = error_callback
-
     @property
     def id(self):
+        """The ID of the request. The ID is an integer unique in the process.
+
+        :type: int
+        """
         return self._id
 
     @property
     def url(self):
         return self._url
 
+    @url.setter
+    def url(self, url):
+        self._url = url
+
     @property
     def method(self):
         return self._method
 
     @property
     def headers(self):
-        return self._headers
+        """HTTP headers. The returned dict is read-only since it is shared by
+        the requests with the same headers.
+
+        :type: :class:`FrozenHeaders`
+        """
+        return self._headers or _EMPTY_HEADERS
+
+    @headers.setter
+    def headers(self, headers):
+        self._headers = intern_headers(headers) if headers else None
 
     @property
     def args(self):
-        return self._args
+        return self._args or {}
 
     @property
-    def success_callback(self):
-        global _success_callbacks
+    def extractor(self):
+        """The import path of the extractor.
 
-        if self._success_callback_id:
-            return _success_callbacks.get(self._success_callback_id)
-        else:
-            return None
+        :type: str
+        """
+        return self._extractor
+
+    @property
+    def keep_content(self):
+        """Whether the content is sent back with the result of the extractor.
+
+        :type: bool
+        """
+        return self._keep_content
+
+    @property
+    def enqueued_at(self):
+        """The time when the request was pushed to the queue.
+
+        :type: float
+        """
+        return self._enqueued_at
+
+    @enqueued_at.setter
+    def enqueued_at(self, value):
+        self._enqueued_at = value
+
+    @property
+    def success_callback(self):
+        return self._success_callback
 
     @property
     def error_callback(self):
-        global _error_callbacks
+        return self._error_callback
 
-        if self._error_callback_id:
-            return _error_callbacks.get(self._error_callback_id)
-        else:
-            return None
+    @property
+    def retry_policy(self):
+        return self._retry_policy
 
     def run_callback(self, response):
-        global _success_callbacks, _error_callbacks
-
         if isinstance(response, Response):
-            if self._success_callback_id:
-                _success_callbacks[self._success_callback_id](response)
+            if self._success_callback:
+                self._success_callback(response)
         elif isinstance(response, ErrorResponse):
-            if self._error_callback_id:
-                _error_callbacks[self._error_callback_id](response)
+            if self._error_callback:
+                self._error_callback(response)
         else:
             raise InvalidResponse('Invalid response')
 
-    def __call__(self):
-        method_func = getattr(requests, self._method)
+    # NOTE: because the callback function cannot be pickled, it is not sent
+    # to PiCloud. The connection keeps it locally until the response arrives.
+    # the retry policy is only used on the client, and is not sent either
+    def __getstate__(self):
+        return (self._id, self._url, self._method, self._headers, self._args,
+                self._enqueued_at, self._extractor, self._keep_content)
+
+    def __setstate__(self, state):
+        (self._id, self._url, self._method, self._headers, self._args,
+         self._enqueued_at, self._extractor, self._keep_content) = state
+        self._success_callback = None
+        self._error_callback = None
+        self._retry_policy = None
+
+    def __call__(self, session=None, limits=None, extract=True):
+        """Fetches the URL. This method is called inside the PiCloud job.
+
+        :param session: (optional) A :class:`requests.Session` instance used
+            to fetch the URL. If not specified, a new connection is created.
+        :param limits: (optional) A :class:`FetchLimits` instance that limits
+            the download of the body.
+        :param bool extract: (optional) If False, the extractor is not run,
+            and the caller runs it later with :func:`extract`.
+        :return: A :class:`BaseResponse <picrawler.response.BaseResponse>` instance.
+        """
+
+        timings = Timings(self._enqueued_at, time.time())
+        method_func = getattr(session or requests, self._method)
+
+        args = self.args
+        if 'stream' not in args:
+            # defer the download of the body to record the first byte time
+            args = dict(args, stream=True)
+
+        try:
+            ret = method_func(self._url, headers=self.headers, **args)
+            timings.first_byte = time.time()
+
+            truncated = False
+            if limits is None or not args['stream']:
+                content = ret.content
+            elif not limits.allows(ret.headers.get('content-type')):
+                content = None
+                truncated = True
+                ret.close()
+            else:
+                (content, truncated) = limits.read(ret, timings.first_byte)
+
+            timings.completed = time.time()
+
+        except Exception, e:
+            timings.completed = time.time()
+            return ErrorResponse(self, e, timings)
+
+        response = Response(self, ret.status_code, content, ret.headers,
+                            timings, truncated, ret.url)
+
+        if extract:
+            return self.extract(response)
+
+        return response
+
+    def extract(self, response):
+        """Runs the extractor on the fetched response. The content is
+        discarded unless ``keep_content`` is specified.
+
+        :param response: A :class:`Response <picrawler.response.Response>`
+            instance returned by this request.
+        :return: The response, or an
+            :class:`ErrorResponse <picrawler.response.ErrorResponse>`
+            instance if the extractor raises an exception.
+        """
+
+        if not self._extractor:
+            return response
 
         try:
-            ret = method_func(self._url, headers=self._headers, **self._args)
+            extracted = resolve_extractor(self._extractor)(response)
         except Exception, e:
-            return ErrorResponse(self, e)
+            return ErrorResponse(self, e, response.timings)
+
+        response.set_extracted(extracted, self._keep_content)
+
+        return response
+
+
+def intern_headers(headers):
+    """Returns a shared read-only dict equal to the given header dict.
+
+    The requests created with the same headers refer to a single dict, which
+    saves memory on the client, and is pickled only once in a batch.
+
+    :param dict headers: HTTP headers.
+    :return: A :class:`FrozenHeaders` instance.
+    """
+
+    try:
+        key = frozenset(headers.iteritems())
+    except TypeError:
+        # the headers contain unhashable values
+        return FrozenHeaders(headers)
+
+    interned = _interned_headers.get(key)
+    if interned is None:
+        if len(_interned_headers) >= MAX_INTERNED_HEADERS:
+            return FrozenHeaders(headers)
+
+        interned = _interned_headers[key] = FrozenHeaders(headers)
+
+    return interned
+
+
+def skip_ids(last_id):
+    """Makes the requests created afterwards have IDs larger than the given
+    ID, so that they do not collide with the requests restored from a
+    :class:`Journal <picrawler.journal.Journal>`.
+
+    :param int last_id: The largest ID in use.
+    """
+
+    global _id_counter
 
-        return Response(self, ret.status_code, ret.content, ret.headers)
+    next_id = _id_counter.next()
+    _id_counter = itertools.count(max(next_id, last_id + 1))
@@ -1,40 +1,242 @@
 # -*- coding: utf-8 -*-
 
-import cPickle as pickle
-import zlib
+import time
+
+from compression import Compressor, DEFAULT_COMPRESSOR
+from store import ContentPin
+
+# attributes that are not transferred with the instance
+_TRANSIENT_ATTRIBUTES = frozenset(['_compressor', '_encode_time',
+                                   '_decode_time', '_content',
+                                   '_encoded_content', '_content_ref'])
+
+_slot_names = {}
+
+
+def _get_slot_names(cls):
+    # returns the names of the slots defined in the class and its bases
+    names = _slot_names.get(cls)
+    if names is None:
+        names = []
+        for klass in reversed(cls.__mro__):
+            names.extend(klass.__dict__.get('__slots__', ()))
+
+        names = _slot_names[cls] = tuple(names)
+
+    return names
+
+
+class Timings(object):
+    """Class that holds the timestamps of the stages a request goes through.
+
+    Each timestamp is a float returned by :func:`time.time`, or None if the
+    stage has not been reached. ``started``, ``first_byte``, ``completed`` and
+    ``serialized`` are recorded in the PiCloud job, so the durations between
+    them and the timestamps recorded on the client are affected by the clock
+    difference between the machines.
+    """
+
+    __slots__ = ('enqueued', 'started', 'first_byte', 'completed',
+                 'serialized', 'popped', 'callback_done')
+
+    #: The names of the durations computed from the timestamps.
+    PHASES = ('queue_wait', 'fetch', 'transfer', 'serialize', 'result_wait',
+              'callback', 'total')
+
+    def __init__(self, enqueued=None, started=None):
+        self.enqueued = enqueued
+        self.started = started
+        self.first_byte = None
+        self.completed = None
+        self.serialized = None
+        self.popped = None
+        self.callback_done = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for (name, value) in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return 'Timings(%s)' % ', '.join('%s=%.3f' % (name, getattr(self, name))
+                                         for name in self.PHASES
+                                         if getattr(self, name) is not None)
+
+    @property
+    def queue_wait(self):
+        """Seconds from the enqueue to the start of the job."""
+        return _duration(self.enqueued, self.started)
+
+    @property
+    def fetch(self):
+        """Seconds from the start of the job to the first byte of the
+        response, including DNS lookup and connection."""
+        return _duration(self.started, self.first_byte)
+
+    @property
+    def transfer(self):
+        """Seconds spent to download the body."""
+        return _duration(self.first_byte, self.completed)
+
+    @property
+    def serialize(self):
+        """Seconds spent to serialize the response in the job."""
+        return _duration(self.completed, self.serialized)
+
+    @property
+    def result_wait(self):
+        """Seconds from the serialization to the pop on the client."""
+        return _duration(self.serialized, self.popped)
+
+    @property
+    def callback(self):
+        """Seconds spent to run the callback."""
+        return _duration(self.popped, self.callback_done)
+
+    @property
+    def total(self):
+        """Seconds from the enqueue to the end of the callback, or to the pop
+        if the callback has not been run."""
+        return _duration(self.enqueued, self.callback_done or self.popped)
+
+
+def _duration(start, end):
+    if start is None or end is None:
+        return None
+
+    return end - start
 
 
 class BaseResponse(object):
-    def __init__(self, request):
+    __slots__ = ('_request', '_timings', '_compressor', '_encode_time',
+                 '_decode_time')
+
+    def __init__(self, request, timings=None):
         self._request = request
+        self._timings = timings
+        self._compressor = None
+        self._encode_time = None
+        self._decode_time = None
 
     @property
     def request(self):
         return self._request
 
+    @property
+    def timings(self):
+        """The timestamps of the stages of the request, or None if they have
+        not been recorded.
+
+        :type: :class:`Timings <picrawler.response.Timings>`
+        """
+        return self._timings
+
+    @property
+    def compressor(self):
+        """The :class:`Compressor <picrawler.compression.Compressor>` used to
+        compress the content when the instance is pickled.
+
+        :type: :class:`Compressor <picrawler.compression.Compressor>`
+        """
+        return self._compressor or DEFAULT_COMPRESSOR
+
+    @compressor.setter
+    def compressor(self, compressor):
+        self._compressor = compressor
+
+    @property
+    def encode_time(self):
+        """Seconds spent to compress the content in the PiCloud job, or None
+        if the instance has not been transferred.
+
+        :type: float
+        """
+        return self._encode_time
+
+    @property
+    def decode_time(self):
+        """Seconds spent to decompress the content on the client, or None if
+        the content has not been accessed yet.
+
+        :type: float
+        """
+        return self._decode_time
+
+    @property
+    def encoded_size(self):
+        """The size of the compressed content in bytes, or None if the
+        instance has not been transferred.
+
+        :type: int
+        """
+        return None
+
     def run_callback(self):
         self._request.run_callback(self)
 
-    # override __getstate__ and __setstate__ to reduce the size of a pickled
-    # instance by compressing instance attributes using zlib
+    def _encode_content(self):
+        return (None, None)
+
+    def _set_encoded_content(self, codec_name, data):
+        pass
+
+    # override __getstate__ and __setstate__ to carry the content as a
+    # separately compressed string next to the other attributes. The state
+    # is pickled only once by the queue, and the content is decompressed
+    # lazily on the first access
     def __getstate__(self):
-        pickled_dict = pickle.dumps(self.__dict__, protocol=2)
-        return zlib.compress(pickled_dict, 9)
+        start = time.time()
+
+        (codec_name, data) = self._encode_content()
+
+        end = time.time()
+        if self._timings is not None and self._timings.serialized is None:
+            self._timings.serialized = end
+
+        attrs = tuple(getattr(self, name)
+                      for name in _get_slot_names(self.__class__)
+                      if name not in _TRANSIENT_ATTRIBUTES)
+
+        return (attrs, codec_name, data, end - start)
 
     def __setstate__(self, state):
-        pickled_dict = zlib.decompress(state)
-        self.__dict__ = pickle.loads(pickled_dict)
+        (attrs, codec_name, data, encode_time) = state
+
+        attrs = iter(attrs)
+        for name in _get_slot_names(self.__class__):
+            if name in _TRANSIENT_ATTRIBUTES:
+                setattr(self, name, None)
+            else:
+                setattr(self, name, attrs.next())
+
+        self._encode_time = encode_time
+        self._set_encoded_content(codec_name, data)
 
 
 class Response(BaseResponse):
     """Class that represents a response from PiCloud."""
 
-    def __init__(self, request, status_code, content, headers):
-        super(Response, self).__init__(request)
+    __slots__ = ('_status_code', '_headers', '_url', '_extracted',
+                 '_truncated', '_fingerprint', '_duplicate_of', '_content',
+                 '_encoded_content', '_content_ref')
+
+    def __init__(self, request, status_code, content, headers, timings=None,
+                 truncated=False, url=None):
+        super(Response, self).__init__(request, timings)
 
         self._status_code = status_code
+        # only kept if the request has been redirected
+        self._url = url if url != getattr(request, 'url', None) else None
         self._headers = headers
+        self._truncated = truncated
+        self._fingerprint = None
+        self._duplicate_of = None
+        self._extracted = None
         self._content = content
+        self._encoded_content = None
+        self._content_ref = None
 
     @property
     def status_code(self):
@@ -46,12 +248,34 @@ class Response(BaseResponse):
 
     @property
     def content(self):
-        """HTTP content.
+        """HTTP content. The content is decompressed on the first access.
+
+        If the content has been moved to a
+        :class:`ContentStore <picrawler.store.ContentStore>`, a read-only
+        memory-mapped view of the stored file is returned instead of a string.
+        The stored content is not evicted while the instance is alive.
 
         :type: str
         """
+        # the response may be read from several threads. the attribute is read
+        # once, since another thread may decode the content in the meantime
+        encoded_content = self._encoded_content
+        if encoded_content is not None:
+            self._decode_content(encoded_content)
+
+        if self._content_ref is not None:
+            return self._content_ref.get()
+
         return self._content
 
+    @property
+    def url(self):
+        """The URL of the response after the redirects.
+
+        :type: str
+        """
+        return self._url or self.request.url
+
     @property
     def headers(self):
         """HTTP headers.
@@ -60,12 +284,164 @@ class Response(BaseResponse):
         """
         return self._headers
 
+    @property
+    def truncated(self):
+        """Whether the body has not been downloaded completely because of the
+        :class:`FetchLimits <picrawler.request.FetchLimits>`. If the content
+        type is not allowed, the content is None.
+
+        :type: bool
+        """
+        return self._truncated
+
+    @property
+    def fingerprint(self):
+        """The SimHash fingerprint of the content computed in the PiCloud
+        job, or None if it has not been computed.
+        (See :func:`simhash <picrawler.simhash.simhash>`)
+
+        :type: int
+        """
+        return self._fingerprint
+
+    @fingerprint.setter
+    def fingerprint(self, fingerprint):
+        self._fingerprint = fingerprint
+
+    @property
+    def duplicate_of(self):
+        """The URL of the earlier response whose content is nearly identical
+        to this response, or None if the content is not a near-duplicate.
+
+        :type: str
+        """
+        return self._duplicate_of
+
+    def collapse(self, duplicate_of):
+        """Marks the response as a near-duplicate and discards the content.
+
+        :param str duplicate_of: The URL of the original response.
+        """
+
+        self._duplicate_of = duplicate_of
+        self._content = None
+        self._encoded_content = None
+        self._content_ref = None
+
+    @property
+    def content_key(self):
+        """The key of the content in the
+        :class:`ContentStore <picrawler.store.ContentStore>`, or None if the
+        content has not been moved to a store.
+
+        :type: str
+        """
+        if self._content_ref is None:
+            return None
+
+        return self._content_ref.key
+
+    def spill(self, store, threshold=0):
+        """Moves the content to a content store to release the memory.
+
+        :param store: A :class:`ContentStore <picrawler.store.ContentStore>`
+            instance.
+        :param int threshold: (optional) The content is moved only if it is
+            larger than this number of bytes.
+        :return: True if the content has been moved.
+        """
+
+        content = self.content
+        if content is None or len(content) < threshold:
+            return False
+
+        # the content is pinned so that the store does not evict it while the
+        # instance is alive
+        self._content_ref = ContentPin(store, store.put(content, pin=True))
+        self._content = None
+
+        return True
+
+    @property
+    def extracted(self):
+        """The return value of the extractor run in the PiCloud job, or None
+        if the extractor is not specified.
+        (See :class:`Request <picrawler.request.Request>`)
+        """
+        return self._extracted
+
+    def set_extracted(self, extracted, keep_content=False):
+        """Sets the result of the extractor.
+
+        :param extracted: The return value of the extractor.
+        :param bool keep_content: (optional) If False, the content is
+            discarded.
+        """
+
+        self._extracted = extracted
+        if not keep_content:
+            self._content = None
+
+    @property
+    def encoded_size(self):
+        """The size of the compressed content in bytes, or None if the
+        instance has not been transferred.
+
+        :type: int
+        """
+        encoded_content = self._encoded_content
+        if encoded_content is None:
+            return None
+
+        return len(encoded_content[1])
+
+    def _content_type(self):
+        if not self._headers:
+            return None
+
+        return (self._headers.get('content-type') or
+                self._headers.get('Content-Type'))
+
+    def _decode_content(self, encoded_content):
+        start = time.time()
+
+        (codec_name, data) = encoded_content
+        # the content is set before the encoded content is cleared, so that
+        # the other threads always see one of them
+        self._content = Compressor.decode(codec_name, data)
+        self._encoded_content = None
+
+        self._decode_time = time.time() - start
+
+    def _encode_content(self):
+        encoded_content = self._encoded_content
+        if encoded_content is not None:
+            # the content has not been decompressed since it was received
+            return encoded_content
+
+        if self._content_ref is not None:
+            # the content has been moved to a content store
+            content = self._content_ref.get()[:]
+        else:
+            content = self._content
+
+        if content is None:
+            return (None, None)
+
+        return self.compressor.encode(content, self._content_type())
+
+    def _set_encoded_content(self, codec_name, data):
+        if codec_name is not None:
+            self._encoded_content = (codec_name, data)
+
 
 class ErrorResponse(BaseResponse):
     """Class that represents a runtime error occurred on running the job."""
 
-    def __init__(self, request, exception):
-        super(ErrorResponse, self).__init__(request)
+    __slots__ = ('_exception',)
+
+    def __init__(self, request, exception, timings=None):
+        super(ErrorResponse, self).__init__(request, timings)
 
         self._exception = exception
 
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import calendar
+import email.utils
+import math
+import time
+
+import requests
+
+from response import Response, ErrorResponse
+
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout)
+
+
+class RetryPolicy(object):
+    """Class that decides whether and when a failed request is sent again.
+
+    The request is retried if the connection fails or times out, or if the
+    response has one of ``status_codes``. The retries are delayed
+    exponentially, or by the ``Retry-After`` header if the response has one.
+
+    Usage:
+
+        >>> policy = RetryPolicy(max_retries=5, backoff_base=2)
+        >>> req = Request('http://www.wikipedia.org', retry_policy=policy)
+
+    :param int max_retries: (optional) The maximum number of retries.
+    :param float backoff_base: (optional) Seconds to wait before the first
+        retry. The wait is doubled on each subsequent retry.
+    :param float backoff_max: (optional) The upper bound of the wait.
+    :param status_codes: (optional) HTTP status codes to be retried.
+    """
+
+    __slots__ = ('_max_retries', '_backoff_base', '_backoff_max',
+                 '_status_codes')
+
+    def __init__(self, max_retries=3, backoff_base=1.0, backoff_max=60.0,
+                 status_codes=RETRY_STATUS_CODES):
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._status_codes = frozenset(status_codes)
+
+    @property
+    def max_retries(self):
+        return self._max_retries
+
+    def should_retry(self, response, attempt):
+        """Returns whether the request of the response should be sent again.
+
+        :param response: A :class:`BaseResponse <picrawler.response.BaseResponse>`
+            instance.
+        :param int attempt: The number of retries already made.
+        """
+
+        if attempt >= self._max_retries:
+            return False
+
+        if isinstance(response, ErrorResponse):
+            return isinstance(response.exception, RETRY_EXCEPTIONS)
+
+        if isinstance(response, Response):
+            return response.status_code in self._status_codes
+
+        return False
+
+    def get_delay(self, response, attempt):
+        """Returns seconds to wait before the retry.
+
+        :param response: A :class:`BaseResponse <picrawler.response.BaseResponse>`
+            instance.
+        :param int attempt: The number of retries already made.
+        """
+
+        if isinstance(response, Response) and response.headers:
+            retry_after = parse_retry_after(
+                response.headers.get('retry-after') or
+                response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return retry_after
+
+        return min(self._backoff_max, self._backoff_base * 2 ** attempt)
+
+
+def parse_retry_after(value, now=None):
+    """Parses the value of a ``Retry-After`` header.
+
+    :param str value: Seconds or an HTTP date.
+    :return: Seconds to wait, or None if the value is invalid.
+    """
+
+    if not value:
+        return None
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        # "inf" and "nan" are accepted by float()
+        if math.isinf(seconds) or math.isnan(seconds):
+            return None
+
+        return max(0.0, seconds)
+
+    parsed = email.utils.parsedate(value)
+    if parsed is None:
+        return None
+
+    if now is None:
+        now = time.time()
+
+    return max(0.0, calendar.timegm(parsed) - now)
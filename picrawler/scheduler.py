@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import time
+import urlparse
+
+
+class TokenBucket(object):
+    """Class that limits the rate of events.
+
+    :param float rate: The number of tokens added per second.
+    :param int burst: (optional) The maximum number of tokens stored.
+    """
+
+    __slots__ = ('_rate', '_burst', '_tokens', '_updated_at')
+
+    def __init__(self, rate, burst=1, now=None):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = self._burst
+        self._updated_at = now if now is not None else time.time()
+
+    def consume(self, now=None):
+        """Takes a token if available.
+
+        :return: True if a token has been taken.
+        """
+
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+
+        return False
+
+    def wait_time(self, now=None):
+        """Returns seconds until a token becomes available."""
+
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0.0
+
+        return (1 - self._tokens) / self._rate
+
+    def _refill(self, now):
+        if now is None:
+            now = time.time()
+
+        self._tokens = min(self._burst, self._tokens +
+                           (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+
+class HostScheduler(object):
+    """Class that holds the requests back on the client until they can be
+    sent without overloading their hosts.
+
+    Each host has a :class:`TokenBucket` that limits the rate of the requests,
+    and a limit on the number of the requests in flight. The ready requests
+    are taken from the hosts in turn, so that a host with many requests does
+    not delay the others.
+
+    Usage:
+
+        >>> scheduler = HostScheduler(rate=2, max_per_host=4)
+        >>> scheduler.add(requests)
+        >>> queue.push(scheduler.ready())
+        >>> # call release() when each response arrives
+        >>> scheduler.release(response.request.id)
+
+    :param float rate: (optional) The maximum number of requests per second
+        sent to each host. If None, the rate is not limited.
+    :param int burst: (optional) The number of requests that can be sent to a
+        host at once after it has been idle.
+    :param int max_per_host: (optional) The maximum number of requests in
+        flight for each host. If None, the number is not limited.
+    """
+
+    def __init__(self, rate=None, burst=1, max_per_host=None):
+        self._rate = rate
+        self._burst = burst
+        self._max_per_host = max_per_host
+
+        self._waiting = collections.OrderedDict()
+        self._buckets = {}
+        self._in_flight = {}
+        self._host_in_flight = collections.defaultdict(int)
+        self._num_waiting = 0
+
+    def __len__(self):
+        return self._num_waiting
+
+    @property
+    def num_in_flight(self):
+        """The number of requests released by :func:`ready` and not yet
+        passed to :func:`release`.
+
+        :type: int
+        """
+        return len(self._in_flight)
+
+    def add(self, requests):
+        """Adds the requests to the waiting list.
+
+        :param requests: A list of :class:`Request <picrawler.request.Request>`
+            instances.
+        """
+
+        for request in requests:
+            host = _get_host(request.url)
+            queue = self._waiting.get(host)
+            if queue is None:
+                queue = self._waiting[host] = collections.deque()
+
+            queue.append(request)
+
+        self._num_waiting += len(requests)
+
+    def ready(self, now=None):
+        """Removes the requests that can be sent now from the waiting list.
+
+        :return: A list of :class:`Request <picrawler.request.Request>`
+            instances, interleaved across the hosts.
+        """
+
+        if now is None:
+            now = time.time()
+
+        ready = []
+        hosts = list(self._waiting.iterkeys())
+        while hosts:
+            # take one request from each host in turn
+            next_hosts = []
+            for host in hosts:
+                if not self._acquire(host, now):
+                    continue
+
+                queue = self._waiting[host]
+                request = queue.popleft()
+                self._in_flight[request.id] = host
+                ready.append(request)
+
+                if queue:
+                    next_hosts.append(host)
+                else:
+                    del self._waiting[host]
+
+            hosts = next_hosts
+
+        # rotate the hosts so that the next call starts from another host
+        for host in self._waiting.keys()[:1]:
+            self._waiting[host] = self._waiting.pop(host)
+
+        self._num_waiting -= len(ready)
+
+        return ready
+
+    def waiting_ids(self):
+        """Returns the IDs of the waiting requests.
+
+        :type: set
+        """
+        return set(request.id for queue in self._waiting.itervalues()
+                   for request in queue)
+
+    def release(self, request_id):
+        """Notifies that the request is no longer in flight.
+
+        :param int request_id: The ID of the request.
+        """
+
+        host = self._in_flight.pop(request_id, None)
+        if host is None:
+            return
+
+        self._host_in_flight[host] -= 1
+        if not self._host_in_flight[host]:
+            del self._host_in_flight[host]
+
+    def wait_time(self, now=None):
+        """Returns seconds until a waiting request may become ready, or None
+        if it depends on the responses in flight or nothing is waiting."""
+
+        if self._rate is None:
+            return None
+
+        if now is None:
+            now = time.time()
+
+        wait_times = [self._get_bucket(host, now).wait_time(now)
+                      for host in self._waiting
+                      if not self._is_saturated(host)]
+
+        return min(wait_times) if wait_times else None
+
+    def _acquire(self, host, now):
+        if self._is_saturated(host):
+            return False
+
+        if self._rate is not None and not self._get_bucket(host, now).consume(now):
+            return False
+
+        self._host_in_flight[host] += 1
+
+        return True
+
+    def _is_saturated(self, host):
+        return (self._max_per_host is not None and
+                self._host_in_flight.get(host, 0) >= self._max_per_host)
+
+    def _get_bucket(self, host, now):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self._rate, self._burst,
+                                                       now)
+
+        return bucket
+
+
+def _get_host(url):
+    return urlparse.urlsplit(url).netloc.lower()
@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import datetime
+import os
+import sys
+import threading
+import urlparse
+import Queue
+
+from picloud_connection import PiCloudConnection, iter_requests
+from request import Request
+from stats import Stats
+
+# seconds between the checks of the stop event while the merged queue or a
+# buffer of the router is full
+_PUT_INTERVAL = 0.1
+
+# the item put into the merged queue when a poller stops
+_DONE = object()
+
+
+class ShardedConnection(object):
+    """Class that spreads the requests over several
+    :class:`PiCloudConnection <picrawler.PiCloudConnection>` instances, each
+    of which has its own pair of queues.
+
+    A single connection waits for one pop of the result queue at a time,
+    which limits the number of the responses received per second when the
+    round trips to the queue dominate. The sharded connection routes each
+    request to a shard by the hash of its host, and drains the result queues
+    of the shards from parallel poller threads, so the round trips of the
+    shards overlap. The responses of all the shards are merged into a single
+    stream.
+
+    .. note::
+        The pollers are threads, so the unpickling of the responses is
+        serialized by the GIL and does not scale with the number of cores.
+        The callbacks, the journal and the coalescing state stay in the
+        client process.
+
+    Since the requests to the same host are sent through the same shard, the
+    per-host options such as ``host_rate``, ``max_per_host`` and
+    ``canonicalizer`` work as in a single connection.
+
+    Usage:
+
+        >>> from picrawler.sharded_connection import ShardedConnection
+        >>> with ShardedConnection(num_shards=4, max_parallel_jobs=10) as conn:
+        ...     for response in conn.send_iter(urls):
+        ...         print response.request.url, response.status_code
+
+    The callbacks are run in the poller threads of the shards, or in the
+    callback workers of each shard if ``callback_workers`` is specified, so
+    they may run concurrently.
+
+    :param int num_shards: (optional) The number of the shards.
+    :param int queue_size: (optional) The maximum number of the responses
+        received by the pollers and waiting to be yielded. The pollers block
+        while the queue is full.
+    :param int route_buffer_size: (optional) The maximum number of the
+        requests read from an iterable and waiting for each shard. The input
+        is not read further while the buffer of the shard of the next request
+        is full.
+    :param kwargs: (optional) The arguments passed to each
+        :class:`PiCloudConnection <picrawler.PiCloudConnection>`. If
+        ``journal_path`` or ``store_path`` is specified, each shard uses its
+        own journal file or directory suffixed with the number of the shard.
+    """
+
+    def __init__(self, num_shards=4, queue_size=1000, route_buffer_size=1000,
+                 **kwargs):
+        assert num_shards > 0, 'num_shards must be positive.'
+        assert route_buffer_size > 0, 'route_buffer_size must be positive.'
+
+        self._queue_size = queue_size
+        self._route_buffer_size = route_buffer_size
+
+        queue_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        self._shards = []
+        for n in xrange(num_shards):
+            shard_kwargs = dict(kwargs, queue_id='%s_%d' % (queue_id, n))
+            if kwargs.get('journal_path'):
+                shard_kwargs['journal_path'] = '%s.%d' % (kwargs['journal_path'],
+                                                          n)
+            if kwargs.get('store_path'):
+                shard_kwargs['store_path'] = os.path.join(kwargs['store_path'],
+                                                          str(n))
+
+            self._shards.append(PiCloudConnection(**shard_kwargs))
+
+        # the requests waiting to be pushed by the poller of each shard
+        self._inboxes = [collections.deque() for n in xrange(num_shards)]
+        # set when the iteration of the responses stops
+        self._stop = threading.Event()
+        self._iterating = False
+        self._connected = False
+
+    def __enter__(self):
+        if not self._connected:
+            self.connect()
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    @property
+    def shards(self):
+        """The :class:`PiCloudConnection <picrawler.PiCloudConnection>`
+        instances of the shards.
+
+        :type: list
+        """
+        return list(self._shards)
+
+    @property
+    def stats(self):
+        """The sum of the counters and the histograms of the shards.
+
+        :type: :class:`Stats <picrawler.stats.Stats>`
+        """
+
+        stats = Stats()
+        for shard in self._shards:
+            stats.merge(shard.stats)
+
+        return stats
+
+    def connect(self):
+        """Establishes the connections of the shards."""
+
+        for shard in self._shards:
+            shard.connect()
+
+        self._connected = True
+
+    def close(self):
+        """Closes the connections of the shards."""
+
+        assert self._connected, 'The connection to PiCloud has not been established.'
+
+        for shard in self._shards:
+            shard.close()
+
+        self._connected = False
+
+    def get_shard(self, request):
+        """Returns the shard to which the request is routed.
+
+        :param request: A :class:`Request <picrawler.request.Request>`
+            instance.
+        :return: A :class:`PiCloudConnection <picrawler.PiCloudConnection>`
+            instance.
+        """
+        return self._shards[self._get_index(request)]
+
+    def send(self, req):
+        """Sends the requests to PiCloud. The shards send their requests and
+        wait for the responses in parallel.
+
+        :param req: Requests to be sended to PiCloud. Accepts the same values
+            as :func:`PiCloudConnection.send <picrawler.PiCloudConnection.send>`.
+        :return: List of :class:`BaseResponse <picrawler.response.BaseResponse>`
+            instances in the order of the requests.
+        """
+
+        assert self._connected, 'The connection to PiCloud has not been established.'
+        assert not self._iterating, 'The responses are being iterated.'
+
+        requests = list(iter_requests(req))
+
+        groups = [[] for shard in self._shards]
+        for request in requests:
+            groups[self._get_index(request)].append(request)
+
+        results = [None] * len(self._shards)
+        errors = []
+
+        def send_shard(index):
+            try:
+                results[index] = self._shards[index].send(groups[index])
+            except Exception:
+                errors.append(sys.exc_info())
+
+        threads = [threading.Thread(target=send_shard, args=(n,))
+                   for (n, group) in enumerate(groups) if group]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            (exc_type, exc_value, exc_traceback) = errors[0]
+            raise exc_type, exc_value, exc_traceback
+
+        req_resp_map = {}
+        for (group, responses) in zip(groups, results):
+            if group:
+                for (request, response) in zip(group, responses):
+                    req_resp_map[request.id] = response
+
+        return [req_resp_map[r.id] for r in requests]
+
+    def send_iter(self, req):
+        """Sends the requests to PiCloud and yields the responses of all the
+        shards as they arrive.
+
+        :param req: Requests to be sended to PiCloud. Accepts the same values
+            as :func:`send`.
+        :return: A generator of :class:`BaseResponse <picrawler.response.BaseResponse>` instances.
+        """
+
+        assert self._connected, 'The connection to PiCloud has not been established.'
+
+        self.push(req)
+
+        return self._iter_responses()
+
+    def push(self, req):
+        """Routes the requests to the shards without waiting for the
+        responses.
+
+        The requests are pushed to the queues by the pollers started by
+        :func:`iter_responses`. This method can be called while iterating the
+        responses, including from the callbacks.
+
+        An iterable is read lazily by the shards. If ``max_in_flight`` is
+        specified, each shard reads the input while it has room in its
+        window, and the requests read for the other shards are kept until
+        those shards have room. At most ``route_buffer_size`` requests are
+        kept for each shard, so a shard waits for the others to take their
+        requests before reading further.
+
+        :param req: Requests to be sended to PiCloud. Accepts the same values
+            as :func:`send`.
+        """
+
+        assert self._connected, 'The connection to PiCloud has not been established.'
+
+        if isinstance(req, (basestring, Request)):
+            # a single request does not wake up the other shards
+            request = iter_requests(req).next()
+            self._inboxes[self._get_index(request)].append([request])
+            return
+
+        router = _Router(iter_requests(req), self._get_index, self._inboxes,
+                         self._route_buffer_size, self._stop)
+        for (index, inbox) in enumerate(self._inboxes):
+            inbox.append(router.iter_shard(index))
+
+    def iter_responses(self):
+        """Yields the responses of the pushed requests as they arrive, until
+        no request remains in flight in any shard.
+
+        :return: A generator of :class:`BaseResponse <picrawler.response.BaseResponse>` instances.
+        """
+
+        assert self._connected, 'The connection to PiCloud has not been established.'
+
+        return self._iter_responses()
+
+    def resume(self):
+        """Sends the requests left unfinished in the journals of the shards
+        again. (See :func:`PiCloudConnection.resume <picrawler.PiCloudConnection.resume>`)
+
+        :return: List of the resumed :class:`Request <picrawler.request.Request>` instances.
+        """
+
+        assert self._connected, 'The connection to PiCloud has not been established.'
+        assert not self._iterating, 'The responses are being iterated.'
+
+        requests = []
+        for shard in self._shards:
+            requests.extend(shard.resume())
+
+        return requests
+
+    def _get_index(self, request):
+        host = urlparse.urlsplit(request.url).netloc.lower()
+        return hash(host) % len(self._shards)
+
+    def _iter_responses(self):
+        assert not self._iterating, 'The responses are already being iterated.'
+
+        self._iterating = True
+        merged = Queue.Queue(self._queue_size)
+        stop = self._stop
+        stop.clear()
+        pollers = {}
+
+        try:
+            while True:
+                # (re)start the pollers of the shards that have new requests,
+                # or requests in flight such as the resumed ones. a poller is
+                # restarted here if the requests arrive after it has decided
+                # to stop. the shards are not accessed while their pollers run
+                for (index, inbox) in enumerate(self._inboxes):
+                    if index not in pollers and (
+                            inbox or not self._shards[index].is_idle):
+                        poller = threading.Thread(
+                            target=self._poll, args=(index, merged, stop))
+                        poller.daemon = True
+                        poller.start()
+                        pollers[index] = poller
+
+                if not pollers:
+                    break
+
+                try:
+                    # the pollers are checked periodically, since a poller
+                    # may wait for another shard whose requests are pushed
+                    # to its inbox after it has stopped
+                    (index, response, exc_info) = merged.get(
+                        timeout=_PUT_INTERVAL)
+                except Queue.Empty:
+                    continue
+
+                if exc_info is not None:
+                    # the exception raised in the poller
+                    (exc_type, exc_value, exc_traceback) = exc_info
+                    raise exc_type, exc_value, exc_traceback
+
+                if response is _DONE:
+                    pollers.pop(index).join()
+                    continue
+
+                yield response
+
+        finally:
+            stop.set()
+            for poller in pollers.values():
+                poller.join()
+            self._iterating = False
+
+    def _poll(self, index, merged, stop):
+        shard = self._shards[index]
+        inbox = self._inboxes[index]
+
+        try:
+            # the requests are pushed from this thread between the responses,
+            # since a connection is not shared between threads
+            while (inbox or not shard.is_idle) and not stop.is_set():
+                self._push_inbox(shard, inbox)
+
+                for response in shard.iter_responses():
+                    if not self._put(merged, (index, response, None), stop):
+                        return
+
+                    self._push_inbox(shard, inbox)
+
+        except Exception:
+            self._put(merged, (index, None, sys.exc_info()), stop)
+
+        finally:
+            self._put(merged, (index, _DONE, None), stop)
+
+    def _push_inbox(self, shard, inbox):
+        while inbox:
+            shard.push(inbox.popleft())
+
+    def _put(self, merged, item, stop):
+        # returns False if the iteration has been stopped
+        while not stop.is_set():
+            try:
+                merged.put(item, timeout=_PUT_INTERVAL)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+
+class _Router(object):
+    # distributes the requests read lazily from a single iterator to the
+    # iterators of the shards. the iterators are read from the poller threads
+
+    def __init__(self, requests, get_index, inboxes, buffer_size, stop):
+        self._requests = requests
+        self._get_index = get_index
+        self._inboxes = inboxes
+        self._buffer_size = buffer_size
+        self._stop = stop
+        self._buffers = [collections.deque() for inbox in inboxes]
+        # the number of the requests read and waiting for room in the buffers
+        self._waiting = 0
+        self._exhausted = False
+        self._cond = threading.Condition()
+
+    def iter_shard(self, index):
+        buf = self._buffers[index]
+        while True:
+            with self._cond:
+                while not buf:
+                    if self._exhausted:
+                        if not self._waiting:
+                            return
+
+                        # a waiting request may belong to this shard
+                        self._cond.wait(_PUT_INTERVAL)
+                        continue
+
+                    # read the input until a request of the shard is found
+                    request = next(self._requests, None)
+                    if request is None:
+                        self._exhausted = True
+                        continue
+
+                    if not self._route(request):
+                        # the rest of the requests of this shard are read by
+                        # a new iterator in the next iteration
+                        self._inboxes[index].append(self.iter_shard(index))
+                        return
+
+                request = buf.popleft()
+                self._cond.notify_all()
+
+            yield request
+
+    def _route(self, request):
+        # returns False if the iteration has been stopped while waiting. the
+        # shard owning a full buffer never reads the input, so it takes its
+        # requests unless it has been stopped
+        target = self._buffers[self._get_index(request)]
+
+        self._waiting += 1
+        try:
+            while len(target) >= self._buffer_size:
+                if self._stop.is_set():
+                    target.append(request)
+                    return False
+
+                self._cond.wait(_PUT_INTERVAL)
+
+            target.append(request)
+            return True
+
+        finally:
+            self._waiting -= 1
+            self._cond.notify_all()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import re
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NUM_BITS = 64
+
+_TAG_RE = re.compile(r'<[^>]*>')
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def simhash(content, shingle_size=3):
+    """Computes the 64-bit SimHash fingerprint of the content.
+
+    The similar contents have fingerprints that differ in a small number of
+    bits. The HTML tags are ignored, and the fingerprint is computed from the
+    shingles of ``shingle_size`` consecutive words.
+
+    :param str content: The content.
+    :param int shingle_size: (optional) The number of words in a shingle.
+    :return: The fingerprint as an int, or None if the content has no word.
+    """
+
+    return simhash_batch([content], shingle_size)[0]
+
+
+def simhash_batch(contents, shingle_size=3):
+    """Computes the SimHash fingerprints of the contents.
+
+    If `NumPy <http://www.numpy.org/>`_ is installed, the shingles of all the
+    contents are processed at once as a single array.
+
+    :param contents: A list of contents.
+    :param int shingle_size: (optional) The number of words in a shingle.
+    :return: A list of the fingerprints. (See :func:`simhash`)
+    """
+
+    hashes = [_shingle_hashes(content, shingle_size) for content in contents]
+
+    if numpy is not None:
+        return _simhash_numpy(hashes)
+
+    return [_simhash_python(h) for h in hashes]
+
+
+def hamming_distance(fingerprint1, fingerprint2):
+    """Returns the number of the bits that differ between the fingerprints."""
+
+    return bin(fingerprint1 ^ fingerprint2).count('1')
+
+
+class SimHashIndex(object):
+    """Class that finds the fingerprints within a Hamming distance.
+
+    The fingerprints are split into ``max_distance + 1`` bands. Since two
+    fingerprints within the distance share at least one identical band, only
+    the fingerprints sharing a band are compared.
+
+    Usage:
+
+        >>> index = SimHashIndex(max_distance=3)
+        >>> index.add(simhash(content), 'http://www.wikipedia.org/')
+        >>> index.find(simhash(similar_content))
+        'http://www.wikipedia.org/'
+
+    :param int max_distance: (optional) The maximum number of differing bits
+        of the near-duplicates.
+    """
+
+    def __init__(self, max_distance=3):
+        self._max_distance = max_distance
+
+        num_bands = max_distance + 1
+        width = NUM_BITS // num_bands
+        self._bands = [(n * width, (n + 1) * width if n < num_bands - 1
+                        else NUM_BITS)
+                       for n in range(num_bands)]
+        self._tables = [{} for n in range(num_bands)]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, fingerprint, key):
+        """Adds the fingerprint.
+
+        :param int fingerprint: The fingerprint.
+        :param key: The value returned by :func:`find`, such as a URL.
+        """
+
+        for (table, band) in zip(self._tables, self._band_values(fingerprint)):
+            table.setdefault(band, []).append((fingerprint, key))
+
+        self._size += 1
+
+    def find(self, fingerprint):
+        """Returns the key of a fingerprint within the distance, or None if
+        no such fingerprint has been added."""
+
+        for (table, band) in zip(self._tables, self._band_values(fingerprint)):
+            for (candidate, key) in table.get(band, ()):
+                if hamming_distance(fingerprint, candidate) <= self._max_distance:
+                    return key
+
+        return None
+
+    def _band_values(self, fingerprint):
+        return [(fingerprint >> start) & ((1 << (end - start)) - 1)
+                for (start, end) in self._bands]
+
+
+def _shingle_hashes(content, shingle_size):
+    if not content:
+        return []
+
+    words = _WORD_RE.findall(_TAG_RE.sub(' ', content).lower())
+    if not words:
+        return []
+
+    if len(words) <= shingle_size:
+        shingles = [' '.join(words)]
+    else:
+        shingles = [' '.join(words[n:n + shingle_size])
+                    for n in xrange(len(words) - shingle_size + 1)]
+
+    # the first 8 bytes of MD5 are used since the built-in hash() differs
+    # between the platforms
+    return [struct.unpack('<Q', hashlib.md5(_to_bytes(s)).digest()[:8])[0]
+            for s in shingles]
+
+
+def _to_bytes(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+
+    return s
+
+
+def _simhash_python(hashes):
+    if not hashes:
+        return None
+
+    fingerprint = 0
+    for bit in xrange(NUM_BITS):
+        mask = 1 << bit
+        ones = sum(1 for h in hashes if h & mask)
+        if ones * 2 > len(hashes):
+            fingerprint |= mask
+
+    return fingerprint
+
+
+def _simhash_numpy(hashes):
+    fingerprints = [None] * len(hashes)
+
+    indices = [n for (n, h) in enumerate(hashes) if h]
+    if not indices:
+        return fingerprints
+
+    counts = numpy.array([len(hashes[n]) for n in indices])
+    values = numpy.fromiter((v for n in indices for v in hashes[n]),
+                            dtype=numpy.uint64, count=counts.sum())
+
+    # the number of the shingles having each bit set in each content
+    shifts = numpy.arange(NUM_BITS, dtype=numpy.uint64)
+    bits = ((values[:, None] >> shifts) & numpy.uint64(1)).astype(numpy.uint32)
+    offsets = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    ones = numpy.add.reduceat(bits, offsets, axis=0)
+
+    # the bits set in the majority of the shingles are packed into an int
+    majority = (ones * 2 > counts[:, None]).astype(numpy.uint64)
+    packed = (majority << shifts).sum(axis=1, dtype=numpy.uint64)
+    for (n, fingerprint) in zip(indices, packed):
+        fingerprints[n] = int(fingerprint)
+
+    return fingerprints
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import math
+import threading
+import time
+
+
+class Stats(object):
+    """Class that collects runtime counters of a connection.
+
+    Usage:
+
+        >>> with PiCloudConnection() as conn:
+        ...     conn.send(urls)
+        ...     print conn.stats.rate('pop_calls')
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __getitem__(self, name):
+        return self._counters.get(name, 0)
+
+    def histogram(self, name):
+        """Returns a histogram.
+
+        :param str name: The name of the histogram.
+        :return: A :class:`Histogram` instance, or None if no value has been
+            observed.
+        """
+        return self._histograms.get(name)
+
+    def observe(self, name, value):
+        """Adds a value to a histogram.
+
+        :param str name: The name of the histogram.
+        :param float value: The value.
+        """
+
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+
+            histogram.add(value)
+
+    @property
+    def elapsed(self):
+        """Seconds elapsed since the counters were reset.
+
+        :type: float
+        """
+        return time.time() - self._started
+
+    def incr(self, name, value=1):
+        """Increments a counter.
+
+        :param str name: The name of the counter.
+        :param value: (optional) The amount to be added.
+        """
+
+        with self._lock:
+            self._counters[name] += value
+
+    def rate(self, name):
+        """Returns the per-second rate of a counter.
+
+        :param str name: The name of the counter.
+        :return: The number of events per second.
+        """
+
+        elapsed = self.elapsed
+        if elapsed <= 0:
+            return 0.0
+
+        return self[name] / elapsed
+
+    def reset(self):
+        """Resets all the counters."""
+
+        with self._lock:
+            self._counters = collections.defaultdict(int)
+            self._histograms = {}
+            self._started = time.time()
+
+    def merge(self, other):
+        """Adds the counters and the histograms of another instance.
+
+        :param other: A :class:`Stats` instance.
+        """
+
+        with other._lock:
+            counters = dict(other._counters)
+            histograms = other._histograms.items()
+            started = other._started
+
+        with self._lock:
+            for (name, value) in counters.iteritems():
+                self._counters[name] += value
+
+            for (name, histogram) in histograms:
+                if name not in self._histograms:
+                    self._histograms[name] = Histogram(histogram.ratio)
+                self._histograms[name].merge(histogram)
+
+            self._started = min(self._started, started)
+
+    def as_dict(self):
+        """Returns a snapshot of the counters.
+
+        :return: A dict that maps counter names to their values.
+        """
+
+        with self._lock:
+            return dict(self._counters)
+
+
+class Histogram(object):
+    """Class that summarizes the distribution of the observed values.
+
+    The values are counted in buckets whose bounds grow geometrically by
+    ``ratio``, so the percentiles are estimated with a relative error of
+    at most ``ratio - 1``.
+
+    :param float ratio: (optional) The ratio between the bounds of the
+        adjacent buckets.
+    """
+
+    def __init__(self, ratio=1.1):
+        self._log_ratio = math.log(ratio)
+        self._ratio = ratio
+
+        self._buckets = collections.defaultdict(int)
+        self._count = 0
+        self._sum = 0.0
+        self._min = None
+        self._max = None
+
+    @property
+    def ratio(self):
+        return self._ratio
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        if not self._count:
+            return None
+
+        return self._sum / self._count
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+    def add(self, value):
+        """Adds a value.
+
+        :param float value: The value.
+        """
+
+        if value > 0:
+            bucket = int(math.floor(math.log(value) / self._log_ratio))
+        else:
+            bucket = None
+
+        self._buckets[bucket] += 1
+        self._count += 1
+        self._sum += value
+
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    def merge(self, other):
+        """Adds the values of another histogram with the same ``ratio``.
+
+        :param other: A :class:`Histogram` instance.
+        """
+
+        assert self._ratio == other._ratio, 'The ratios of the histograms differ.'
+
+        for (bucket, count) in other._buckets.items():
+            self._buckets[bucket] += count
+
+        self._count += other._count
+        self._sum += other._sum
+
+        if other._min is not None and (self._min is None or
+                                       other._min < self._min):
+            self._min = other._min
+        if other._max is not None and (self._max is None or
+                                       other._max > self._max):
+            self._max = other._max
+
+    def percentile(self, p):
+        """Returns the estimated percentile.
+
+        :param float p: The percentile from 0 to 100.
+        """
+
+        if not self._count:
+            return None
+
+        rank = p / 100.0 * self._count
+        seen = 0
+        # the bucket of non-positive values comes first
+        for bucket in sorted(self._buckets, key=lambda b: (b is not None, b)):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                if bucket is None:
+                    return min(self._min, 0.0)
+
+                upper = self._ratio ** (bucket + 1)
+                return min(max(upper, self._min), self._max)
+
+        return self._max
+
+    def as_dict(self):
+        """Returns the summary of the distribution."""
+
+        return dict(count=self._count, mean=self.mean, min=self._min,
+                    max=self._max, p50=self.percentile(50),
+                    p90=self.percentile(90), p99=self.percentile(99))
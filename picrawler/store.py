@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+
+
+class ContentNotFound(Exception):
+    pass
+
+
+class ContentPin(object):
+    """Class that pins a content in a :class:`ContentStore` while the
+    instance is alive.
+
+    :param store: A :class:`ContentStore` instance.
+    :param str key: The key of the content pinned by the caller.
+    """
+
+    __slots__ = ('store', 'key')
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def get(self):
+        """Returns the content. (See :func:`ContentStore.get`)"""
+        return self.store.get(self.key)
+
+    def __del__(self):
+        self.store.unpin(self.key)
+
+
+class ContentStore(object):
+    """Class that stores contents on the local disk. Each content is saved in
+    a file named after its SHA-1 hash, so that the identical contents are
+    stored only once.
+
+    The least recently used contents are removed when the total size exceeds
+    ``max_size``, except the pinned contents, such as the contents of the
+    :class:`Response <picrawler.response.Response>` instances still in use.
+    The total size may exceed ``max_size`` while the contents are pinned.
+
+    Usage:
+
+        >>> store = ContentStore('/tmp/picrawler')
+        >>> key = store.put('content')
+        >>> store.get(key)[:]
+        'content'
+
+    :param str path: The directory where the contents are saved.
+    :param int max_size: (optional) The maximum total size of the contents in
+        bytes.
+    """
+
+    def __init__(self, path, max_size=1024 ** 3):
+        self._path = path
+        self._max_size = max_size
+
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        # key -> the number of the pins
+        self._pins = {}
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self._load()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def size(self):
+        """The total size of the stored contents in bytes.
+
+        :type: int
+        """
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def put(self, content, pin=False):
+        """Stores the content.
+
+        :param str content: The content to be stored.
+        :param bool pin: (optional) Whether the content is pinned. (See
+            :func:`pin`)
+        :return: The key of the content.
+        """
+
+        key = hashlib.sha1(content).hexdigest()
+
+        with self._lock:
+            if pin:
+                self._pins[key] = self._pins.get(key, 0) + 1
+
+            if key in self._entries:
+                self._touch(key)
+                return key
+
+            file_path = self._file_path(key)
+            dir_path = os.path.dirname(file_path)
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+
+            # write to a temporary file first so that a partially written
+            # file is never visible under the key
+            (fd, temp_path) = tempfile.mkstemp(dir=dir_path)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.rename(temp_path, file_path)
+
+            self._entries[key] = len(content)
+            self._size += len(content)
+
+            self._evict(keep=key)
+
+        return key
+
+    def get(self, key):
+        """Returns a read-only memory-mapped view of the content.
+
+        :param str key: The key returned by :func:`put`.
+        :return: A :class:`mmap.mmap` instance, or an empty string if the
+            content is empty.
+        """
+
+        with self._lock:
+            if key not in self._entries:
+                raise ContentNotFound(key)
+
+            self._touch(key)
+
+            if self._entries[key] == 0:
+                return ''
+
+            with open(self._file_path(key), 'rb') as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def pin(self, key):
+        """Keeps the content from being evicted until :func:`unpin` is
+        called. A content can be pinned several times.
+
+        :param str key: The key returned by :func:`put`.
+        """
+
+        with self._lock:
+            if key not in self._entries:
+                raise ContentNotFound(key)
+
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, key):
+        """Releases a pin of the content. The contents exceeding ``max_size``
+        are evicted when no pin remains.
+
+        :param str key: The key returned by :func:`put`.
+        """
+
+        with self._lock:
+            count = self._pins.get(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+                return
+
+            self._pins.pop(key, None)
+            self._evict()
+
+    def remove(self, key):
+        """Removes the content.
+
+        :param str key: The key returned by :func:`put`.
+        """
+
+        with self._lock:
+            self._remove(key)
+
+    def _file_path(self, key):
+        return os.path.join(self._path, key[:2], key[2:])
+
+    def _touch(self, key):
+        self._entries[key] = self._entries.pop(key)
+        # the modification time keeps the order across the instances
+        os.utime(self._file_path(key), None)
+
+    def _remove(self, key):
+        size = self._entries.pop(key)
+        self._size -= size
+
+        # the removed content is still readable through the opened views
+        os.remove(self._file_path(key))
+
+    def _evict(self, keep=None):
+        for key in list(self._entries):
+            if self._size <= self._max_size:
+                break
+            if key != keep and key not in self._pins:
+                self._remove(key)
+
+    def _load(self):
+        # restore the entries of the existing files, the least recently used
+        # first
+        files = []
+        for dir_name in os.listdir(self._path):
+            dir_path = os.path.join(self._path, dir_name)
+            if len(dir_name) != 2 or not os.path.isdir(dir_path):
+                continue
+
+            for file_name in os.listdir(dir_path):
+                file_path = os.path.join(dir_path, file_name)
+                if len(file_name) != 38:
+                    # a temporary file left by an interrupted write
+                    os.remove(file_path)
+                    continue
+
+                file_stat = os.stat(file_path)
+                files.append((file_stat.st_mtime, dir_name + file_name,
+                              file_stat.st_size))
+
+        for (_, key, size) in sorted(files):
+            self._entries[key] = size
+            self._size += size
+
+        self._evict()
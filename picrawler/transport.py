@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import cookielib
+import threading
+import time
+import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class SessionPool(object):
+    """Class that keeps a `requests <http://docs.python-requests.org>`_
+    session per scheme and host, so that the keep-alive connections are reused
+    across the requests.
+
+    Only the connections are shared. The sessions neither store nor send
+    cookies, so each request starts without the cookies set by the earlier
+    responses, as a fresh session would.
+
+    :param int pool_size: (optional) The maximum number of connections kept
+        alive per host.
+    :param float idle_timeout: (optional) Seconds after which an unused
+        session is closed.
+    """
+
+    def __init__(self, pool_size=10, idle_timeout=60):
+        self._pool_size = pool_size
+        self._idle_timeout = idle_timeout
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_purged = time.time()
+
+    @property
+    def pool_size(self):
+        return self._pool_size
+
+    @property
+    def idle_timeout(self):
+        return self._idle_timeout
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, url):
+        """Returns the session for the host of the URL.
+
+        :param str url: A URL to be fetched.
+        :return: A :class:`requests.Session` instance.
+        """
+
+        parsed = urlparse.urlsplit(url)
+        key = (parsed.scheme.lower(), parsed.netloc.lower())
+        now = time.time()
+
+        with self._lock:
+            if now - self._last_purged > self._idle_timeout:
+                self._purge(now)
+
+            entry = self._sessions.get(key)
+            if entry and now - entry[1] > self._idle_timeout:
+                entry[0].close()
+                entry = None
+
+            if entry:
+                session = entry[0]
+            else:
+                session = self._create_session(parsed.scheme)
+
+            self._sessions[key] = (session, now)
+
+        return session
+
+    def close(self):
+        """Closes all the sessions."""
+
+        with self._lock:
+            for (session, _) in self._sessions.itervalues():
+                session.close()
+
+            self._sessions = {}
+
+    def _create_session(self, scheme):
+        session = requests.Session()
+        # the cookies of a response must not leak into the other requests
+        session.cookies.set_policy(cookielib.DefaultCookiePolicy(
+            allowed_domains=[]))
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+        session.mount(scheme.lower() + '://', adapter)
+
+        return session
+
+    def _purge(self, now):
+        for (key, (session, last_used)) in self._sessions.items():
+            if now - last_used > self._idle_timeout:
+                session.close()
+                del self._sessions[key]
+
+        self._last_purged = now
+
+
+def get_session_pool(pool_size=10, idle_timeout=60):
+    """Returns the process-wide :class:`SessionPool` with the given settings.
+
+    :param int pool_size: (optional) The maximum number of connections kept
+        alive per host.
+    :param float idle_timeout: (optional) Seconds after which an unused
+        session is closed.
+    """
+
+    key = (pool_size, idle_timeout)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SessionPool(pool_size, idle_timeout)
+
+    return pool
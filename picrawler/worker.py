@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from multiprocessing.pool import ThreadPool
+
+from compression import DEFAULT_COMPRESSOR
+from response import Response
+from simhash import simhash_batch
+from transport import get_session_pool
+
+
+class RequestHandler(object):
+    """Class that processes the requests popped from the request queue.
+
+    The instance is attached to the request queue, and is called inside the
+    PiCloud job with either a :class:`Request <picrawler.request.Request>`
+    instance or a list of them. A list of requests is fetched concurrently,
+    and a list of the responses is returned as a single result.
+
+    :param int pool_size: (optional) The maximum number of connections kept
+        alive per host.
+    :param float pool_idle_timeout: (optional) Seconds after which an unused
+        connection pool is closed.
+    :param int concurrency: (optional) The maximum number of requests in a
+        batch fetched at the same time.
+    :param compressor: (optional) A :class:`Compressor <picrawler.compression.Compressor>`
+        instance used to compress the responses.
+    :param limits: (optional) A :class:`FetchLimits <picrawler.request.FetchLimits>`
+        instance that limits the download of the bodies.
+    :param bool fingerprint: (optional) Whether the SimHash fingerprints of
+        the contents are computed. The fingerprints of a batch are computed
+        at once, before the extractors of the requests are run.
+    """
+
+    def __init__(self, pool_size=10, pool_idle_timeout=60, concurrency=1,
+                 compressor=DEFAULT_COMPRESSOR, limits=None, fingerprint=False):
+        self._pool_size = pool_size
+        self._pool_idle_timeout = pool_idle_timeout
+        self._concurrency = concurrency
+        self._compressor = compressor
+        self._limits = limits
+        self._fingerprint = fingerprint
+
+        self._thread_pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # threads cannot be pickled; the pool is created in the job
+        state['_thread_pool'] = None
+
+        return state
+
+    def __call__(self, message):
+        if isinstance(message, list):
+            responses = self._fetch_batch(message)
+            if self._fingerprint:
+                responses = self._set_fingerprints(responses)
+
+            return responses
+        else:
+            response = self._fetch(message)
+            if self._fingerprint:
+                (response,) = self._set_fingerprints([response])
+
+            return response
+
+    def _fetch(self, req):
+        # the session pool is shared by all the handlers in the process
+        session_pool = get_session_pool(self._pool_size,
+                                        self._pool_idle_timeout)
+
+        if self._fingerprint:
+            # the extractors are run after the fingerprints are computed,
+            # since they may discard the contents
+            response = req(session=session_pool.get(req.url),
+                           limits=self._limits, extract=False)
+        else:
+            response = req(session=session_pool.get(req.url),
+                           limits=self._limits)
+
+        response.compressor = self._compressor
+
+        return response
+
+    def _fetch_batch(self, requests):
+        if self._concurrency <= 1 or len(requests) <= 1:
+            return [self._fetch(req) for req in requests]
+
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPool(self._concurrency)
+
+        return self._thread_pool.map(self._fetch, requests)
+
+    def _set_fingerprints(self, responses):
+        # returns the responses on which the extractors have been run
+        targets = [r for r in responses
+                     if isinstance(r, Response) and r.content is not None]
+
+        fingerprints = simhash_batch([r.content for r in targets])
+        for (response, fingerprint) in zip(targets, fingerprints):
+            response.fingerprint = fingerprint
+
+        ret = []
+        for response in responses:
+            if isinstance(response, Response):
+                response = response.request.extract(response)
+                response.compressor = self._compressor
+            ret.append(response)
+
+        return ret
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+from mock import patch
+import multiprocessing
+
+from picrawler.backends import LocalBackend, LocalQueue, PiCloudBackend
+from picrawler.picloud_connection import PiCloudConnection
+
+
+def _double(n):
+    return n * 2
+
+
+class TestPiCloudBackend(object):
+    @patch('picrawler.backends.cloud')
+    def test_get_queue(self, mock_cloud):
+        backend = PiCloudBackend()
+
+        eq_(mock_cloud.queue.get.return_value, backend.get_queue('name'))
+        mock_cloud.queue.get.assert_called_once_with('name')
+
+    @patch('picrawler.backends.cloud')
+    def test_close(self, mock_cloud):
+        PiCloudBackend().close()
+        mock_cloud.close.assert_called_once_with()
+
+
+class TestLocalQueue(object):
+    def test_push_and_pop(self):
+        queue = LocalQueue('name')
+        queue.push(range(15))
+
+        eq_(15, queue.count())
+        eq_(range(10), queue.pop())
+        eq_(range(10, 15), queue.pop(timeout=0))
+        eq_([], queue.pop(timeout=0))
+
+    def test_push_with_delay(self):
+        queue = LocalQueue('name')
+        queue.push([1], delay=0.01)
+
+        eq_([], queue.pop(timeout=0))
+        eq_([1], queue.pop(timeout=1))
+
+    def test_info(self):
+        queue = LocalQueue('name')
+        queue.push([1])
+
+        eq_(dict(count=1, processing_jobs=0, queued_jobs=0), queue.info())
+
+    def test_attach(self):
+        request_queue = LocalQueue('request')
+        result_queue = LocalQueue('result')
+
+        request_queue.attach(_double, output_queues=[result_queue],
+                             max_parallel_jobs=2, readers_per_job=2)
+        request_queue.push(range(5))
+
+        results = []
+        while len(results) < 5:
+            results += result_queue.pop(timeout=1)
+
+        eq_([0, 2, 4, 6, 8], sorted(results))
+
+        workers = list(request_queue._workers)
+        request_queue.delete()
+        # the jobs are stopped when the queue is deleted
+        ok_(not any(worker.is_alive() for worker in workers))
+
+    def test_attach_processes(self):
+        request_queue = LocalQueue('request', multiprocessing)
+        result_queue = LocalQueue('result', multiprocessing)
+
+        request_queue.attach(_double, output_queues=[result_queue],
+                             max_parallel_jobs=2)
+        request_queue.push(range(5))
+
+        results = []
+        while len(results) < 5:
+            results += result_queue.pop(timeout=1)
+
+        eq_([0, 2, 4, 6, 8], sorted(results))
+        request_queue.delete()
+
+
+class TestLocalBackend(object):
+    def test_get_queue(self):
+        backend = LocalBackend()
+        queue = backend.get_queue('name')
+
+        ok_(isinstance(queue, LocalQueue))
+        eq_(queue, backend.get_queue('name'))
+
+    @patch('requests.Session.get')
+    def test_send(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = 'content'
+        mock_get.return_value.headers = {}
+
+        with PiCloudConnection(backend=LocalBackend(), max_parallel_jobs=2,
+                               pop_timeout=1) as conn:
+            responses = conn.send(['http://dummy/%d' % n for n in range(5)])
+
+        eq_([200] * 5, [r.status_code for r in responses])
+        eq_(['http://dummy/%d' % n for n in range(5)],
+            [r.request.url for r in responses])
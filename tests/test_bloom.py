@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+
+from picrawler.bloom import BloomFilter
+
+
+class TestBloomFilter(object):
+    def test_add(self):
+        bloom = BloomFilter(100)
+
+        ok_(bloom.add('http://dummy/'))
+        ok_(not bloom.add('http://dummy/'))
+        ok_(bloom.add(u'http://dummy/あ'))
+        eq_(2, len(bloom))
+
+    def test_contains(self):
+        bloom = BloomFilter(100)
+        bloom.add('http://dummy/')
+
+        ok_('http://dummy/' in bloom)
+        ok_('http://dummy2/' not in bloom)
+
+    def test_error_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for n in range(1000):
+            bloom.add('http://dummy/%d' % n)
+
+        false_positives = sum(1 for n in range(1000, 11000)
+                              if 'http://dummy/%d' % n in bloom)
+        ok_(false_positives < 200)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+import shutil
+import tempfile
+
+from picrawler.cache import HTTPCache
+from picrawler.request import Request
+from picrawler.response import Response, ErrorResponse
+from picrawler.store import ContentStore
+
+
+def _response(url, status_code=200, content='content', **headers):
+    return Response(Request(url), status_code, content, headers)
+
+
+class TestHTTPCache(object):
+    def test_fresh_response(self):
+        cache = HTTPCache()
+        cache.update(_response('http://dummy/', **{'Cache-Control': 'max-age=60'}),
+                     now=0)
+
+        req = Request('http://dummy/')
+        response = cache.prepare(req, now=30)
+
+        eq_(200, response.status_code)
+        eq_('content', response.content)
+        ok_(response.request is req)
+        eq_(1, cache.stats['hits'])
+        eq_(1.0, cache.hit_ratio)
+
+    def test_conditional_request(self):
+        cache = HTTPCache()
+        cache.update(_response('http://dummy/', ETag='"abc"',
+                               **{'Last-Modified': 'Thu, 01 Jan 1970 00:00:00 GMT',
+                                  'Cache-Control': 'max-age=60'}),
+                     now=0)
+
+        req = Request('http://dummy/', headers={'User-Agent': 'dummy'})
+        eq_(None, cache.prepare(req, now=60))
+        eq_({'User-Agent': 'dummy', 'If-None-Match': '"abc"',
+             'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'},
+            req.headers)
+
+        response = cache.update(Response(req, 304, None, {}), now=61)
+        eq_(200, response.status_code)
+        eq_('content', response.content)
+        eq_(1, cache.stats['revalidations'])
+
+        # the freshness is renewed by the 304 response
+        ok_(cache.prepare(Request('http://dummy/'), now=100) is not None)
+
+    def test_miss(self):
+        cache = HTTPCache()
+        req = Request('http://dummy/')
+
+        eq_(None, cache.prepare(req))
+        eq_({}, req.headers)
+        eq_(1, cache.stats['misses'])
+        eq_(0.0, cache.hit_ratio)
+
+        # the 304 response is returned as is if nothing is cached
+        response = Response(req, 304, None, {})
+        ok_(cache.update(response) is response)
+
+    def test_not_cached(self):
+        cache = HTTPCache()
+        cache.update(_response('http://dummy/1', 500))
+        cache.update(_response('http://dummy/2', **{'cache-control': 'no-store'}))
+        cache.update(Response(Request('http://dummy/3', 'post'), 200, '', {}))
+        cache.update(ErrorResponse(Request('http://dummy/4'), ValueError()))
+
+        eq_(0, len(cache))
+
+    def test_no_cache(self):
+        cache = HTTPCache(default_max_age=60)
+        cache.update(_response('http://dummy/', etag='"abc"',
+                               **{'cache-control': 'no-cache'}), now=0)
+
+        req = Request('http://dummy/')
+        eq_(None, cache.prepare(req, now=1))
+        eq_('"abc"', req.headers['If-None-Match'])
+
+    def test_max_entries(self):
+        cache = HTTPCache(max_entries=2)
+        for n in range(3):
+            cache.update(_response('http://dummy/%d' % n))
+
+        ok_('http://dummy/0' not in cache)
+        eq_(2, len(cache))
+        eq_(1, cache.stats['evictions'])
+
+    def test_ttl(self):
+        cache = HTTPCache(ttl=10)
+        cache.update(_response('http://dummy/', etag='"abc"'), now=0)
+
+        req = Request('http://dummy/')
+        eq_(None, cache.prepare(req, now=10))
+        eq_({}, req.headers)
+        eq_(0, len(cache))
+
+    def test_store(self):
+        path = tempfile.mkdtemp()
+        try:
+            cache = HTTPCache(default_max_age=60, store=ContentStore(path))
+            cache.update(_response('http://dummy/'), now=0)
+
+            eq_('content', cache.prepare(Request('http://dummy/'), now=1).content)
+        finally:
+            shutil.rmtree(path)
+
+    def test_extractor(self):
+        cache = HTTPCache(default_max_age=60)
+        req = Request('http://dummy/', extractor='picrawler.extractors:extract_links')
+        response = Response(req, 200, 'content', {})
+        response.set_extracted(['http://dummy/a'])
+        cache.update(response, now=0)
+
+        # the response without the content is not served to a plain request
+        eq_(None, cache.prepare(Request('http://dummy/'), now=1))
+        ok_('http://dummy/' not in cache)
+
+        req2 = Request('http://dummy/', extractor='picrawler.extractors:extract_links')
+        ok_(req2 in cache)
+        eq_(['http://dummy/a'], cache.prepare(req2, now=1).extracted)
+
+    def test_store_evicted(self):
+        path = tempfile.mkdtemp()
+        try:
+            content_store = ContentStore(path)
+            cache = HTTPCache(default_max_age=60, store=content_store)
+            cache.update(_response('http://dummy/'), now=0)
+            content_store.remove(content_store.put('content'))
+
+            # the entry whose content has been evicted is a miss
+            eq_(None, cache.prepare(Request('http://dummy/'), now=1))
+            eq_(0, len(cache))
+            eq_(1, cache.stats['misses'])
+        finally:
+            shutil.rmtree(path)
+
+    def test_conditional_request_evicted(self):
+        cache = HTTPCache(max_entries=1)
+        cache.update(_response('http://dummy/1', ETag='"abc"'), now=0)
+
+        req = Request('http://dummy/1', headers={'User-Agent': 'dummy'})
+        eq_(None, cache.prepare(req, now=1))
+        eq_('"abc"', req.headers['If-None-Match'])
+
+        cache.update(_response('http://dummy/2'), now=2)
+
+        # the request needs to be sent again without the conditional headers
+        eq_(None, cache.update(Response(req, 304, None, {}), now=3))
+        eq_({'User-Agent': 'dummy'}, req.headers)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+from mock import Mock
+
+from picrawler.callbacks import CallbackRegistry
+from picrawler.request import Request
+from picrawler.response import Response, ErrorResponse
+
+
+class TestCallbackRegistry(object):
+    def test_register(self):
+        registry = CallbackRegistry()
+        success_callback = Mock()
+        error_callback = Mock()
+
+        registry.register(Request('http://dummy', success_callback=success_callback,
+                                  error_callback=error_callback))
+        registry.register(Request('http://dummy'))
+
+        eq_(1, len(registry))
+        eq_(2, registry.num_callbacks)
+
+    def test_register_shared_callback(self):
+        registry = CallbackRegistry()
+        success_callback = Mock()
+        requests = [Request('http://dummy', success_callback=success_callback)
+                    for n in range(3)]
+        for req in requests:
+            registry.register(req)
+
+        eq_(3, len(registry))
+        eq_(1, registry.num_callbacks)
+
+        eq_((success_callback, None), registry.release(requests[0].id))
+        eq_(1, registry.num_callbacks)
+
+        registry.release(requests[1].id)
+        registry.release(requests[2].id)
+        eq_(0, len(registry))
+        eq_(0, registry.num_callbacks)
+
+    def test_release_unknown_request(self):
+        registry = CallbackRegistry()
+        eq_((None, None), registry.release('dummy'))
+
+    def test_run(self):
+        registry = CallbackRegistry()
+        success_callback = Mock()
+        error_callback = Mock()
+
+        requests = [Request('http://dummy', success_callback=success_callback,
+                            error_callback=error_callback) for n in range(2)]
+        for req in requests:
+            registry.register(req)
+
+        response = Response(requests[0], 200, 'content', {})
+        registry.run(response)
+        success_callback.assert_called_once_with(response)
+
+        error_response = ErrorResponse(requests[1], Exception())
+        registry.run(error_response)
+        error_callback.assert_called_once_with(error_response)
+
+        eq_(0, len(registry))
+
+        # the callbacks are run only once
+        registry.run(response)
+        eq_(1, success_callback.call_count)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+
+from picrawler import compression
+from picrawler.compression import Compressor, get_codec, is_compressed_type
+
+
+class TestCodec(object):
+    def test_codecs(self):
+        data = 'dummy' * 100
+        for name in compression.available_codecs():
+            codec = get_codec(name)
+            eq_(data, codec.decompress(codec.compress(data)))
+
+    def test_zlib_level(self):
+        data = 'dummy' * 100
+        ok_(len(get_codec('zlib', level=9).compress(data)) < len(data))
+
+    @raises(compression.UnsupportedCodec)
+    def test_unsupported_codec(self):
+        get_codec('dummy')
+
+
+class TestCompressor(object):
+    def test_encode(self):
+        compressor = Compressor('zlib', threshold=10)
+        data = 'dummy' * 100
+        (codec_name, encoded) = compressor.encode(data, 'text/html')
+
+        eq_('zlib', codec_name)
+        eq_(data, Compressor.decode(codec_name, encoded))
+
+    def test_encode_small_data(self):
+        compressor = Compressor('zlib', threshold=10)
+        eq_(('none', 'dummy'), compressor.encode('dummy'))
+
+    def test_encode_compressed_content(self):
+        compressor = Compressor('zlib', threshold=10)
+        data = 'dummy' * 100
+        eq_(('none', data), compressor.encode(data, 'Image/JPEG'))
+
+
+def test_is_compressed_type():
+    ok_(is_compressed_type('image/png'))
+    ok_(is_compressed_type('application/x-gzip; charset=binary'))
+    ok_(not is_compressed_type('text/html; charset=utf-8'))
+    ok_(not is_compressed_type(None))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+import collections
+
+from picrawler.crawler import Crawler
+from picrawler.response import Response
+
+SITE = {
+    'http://dummy/': ['http://dummy/a', 'http://dummy/b', 'http://other/'],
+    'http://dummy/a': ['http://dummy/', 'http://sub.dummy/c'],
+    'http://dummy/b': ['http://dummy/a', 'http://dummy/d'],
+    'http://sub.dummy/c': ['http://dummy/e'],
+}
+
+
+class DummyConnection(object):
+    def __init__(self):
+        self.queue = collections.deque()
+        self.pushed = []
+
+    def push(self, requests):
+        self.queue.extend(requests)
+        self.pushed.extend(r.url for r in requests)
+
+    def iter_responses(self):
+        while self.queue:
+            request = self.queue.popleft()
+            response = Response(request, 200, None, {})
+            response.set_extracted(SITE.get(request.url, []))
+            yield response
+
+
+class TestCrawler(object):
+    def test_crawl(self):
+        conn = DummyConnection()
+        crawler = Crawler(conn, max_depth=2, allowed_domains=['dummy'])
+
+        urls = [r.request.url for r in crawler.crawl(['http://dummy/'])]
+
+        eq_(['http://dummy/', 'http://dummy/a', 'http://dummy/b',
+             'http://sub.dummy/c', 'http://dummy/d'], urls)
+        eq_(5, crawler.num_pushed)
+
+    def test_crawl_max_depth(self):
+        conn = DummyConnection()
+        crawler = Crawler(conn, max_depth=1)
+
+        urls = [r.request.url for r in crawler.crawl(['http://dummy/'])]
+
+        eq_(['http://dummy/', 'http://dummy/a', 'http://dummy/b',
+             'http://other/'], urls)
+
+    def test_crawl_max_urls(self):
+        conn = DummyConnection()
+        crawler = Crawler(conn, max_depth=5, max_urls=2, seen=set())
+
+        urls = [r.request.url for r in crawler.crawl(['http://dummy/'])]
+
+        eq_(['http://dummy/', 'http://dummy/a'], urls)
+
+    def test_is_allowed(self):
+        crawler = Crawler(DummyConnection(), allowed_domains=['Dummy.com'])
+
+        ok_(crawler.is_allowed('http://dummy.com/'))
+        ok_(crawler.is_allowed('https://www.dummy.com:8080/'))
+        ok_(not crawler.is_allowed('http://notdummy.com/'))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+from mock import Mock
+import threading
+import time
+
+from picrawler.dispatcher import CallbackDispatcher
+from picrawler.stats import Stats
+
+
+def _response(url):
+    response = Mock()
+    response.request.url = url
+
+    return response
+
+
+class TestCallbackDispatcher(object):
+    def test_submit(self):
+        dispatcher = CallbackDispatcher(2)
+        callback = Mock()
+        on_done = Mock()
+        response = _response('http://dummy')
+
+        dispatcher.submit(callback, response, on_done)
+        dispatcher.join()
+
+        callback.assert_called_once_with(response)
+        on_done.assert_called_once_with(response)
+        dispatcher.close()
+
+    def test_submit_without_callback(self):
+        dispatcher = CallbackDispatcher(1)
+        on_done = Mock()
+        response = _response('http://dummy')
+
+        dispatcher.submit(None, response, on_done)
+        dispatcher.close()
+
+        on_done.assert_called_once_with(response)
+
+    def test_callback_error(self):
+        stats = Stats()
+        dispatcher = CallbackDispatcher(1, stats=stats)
+        callback = Mock(side_effect=ValueError())
+        on_done = Mock()
+
+        dispatcher.submit(callback, _response('http://dummy'), on_done)
+        dispatcher.submit(callback, _response('http://dummy'), on_done)
+        dispatcher.close()
+
+        eq_(2, stats['callback_errors'])
+        eq_(2, on_done.call_count)
+
+    def test_ordered_per_host(self):
+        dispatcher = CallbackDispatcher(4, ordered_per_host=True)
+        results = []
+        lock = threading.Lock()
+
+        def callback(response):
+            time.sleep(0.001 * (5 - response.n))
+            with lock:
+                results.append((response.request.url, response.n))
+
+        for n in range(5):
+            for host in ('a', 'b'):
+                response = _response('http://%s/' % host)
+                response.n = n
+                dispatcher.submit(callback, response)
+
+        dispatcher.close()
+
+        for host in ('a', 'b'):
+            eq_(range(5), [n for (url, n) in results
+                           if url == 'http://%s/' % host])
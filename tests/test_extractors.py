@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+
+from picrawler import extractors
+from picrawler.extractors import extract_links, get_extractor_path, resolve_extractor
+from picrawler.request import Request
+from picrawler.response import Response
+
+
+def extract_dummy(response):
+    return 'dummy'
+
+
+class TestExtractors(object):
+    def test_get_extractor_path(self):
+        eq_('tests.test_extractors:extract_dummy',
+            get_extractor_path(extract_dummy))
+        eq_('package.module:function',
+            get_extractor_path('package.module:function'))
+
+    @raises(extractors.InvalidExtractor)
+    def test_get_extractor_path_with_lambda(self):
+        get_extractor_path(lambda response: None)
+
+    @raises(extractors.InvalidExtractor)
+    def test_get_extractor_path_with_nested_function(self):
+        def extract(response):
+            pass
+
+        get_extractor_path(extract)
+
+    @raises(extractors.InvalidExtractor)
+    def test_get_extractor_path_with_invalid_path(self):
+        get_extractor_path('package.module.function')
+
+    def test_resolve_extractor(self):
+        eq_(extract_dummy,
+            resolve_extractor('tests.test_extractors:extract_dummy'))
+
+
+def test_extract_links():
+    content = """
+        <a href="/a">a</a> <A class="c" HREF='b#fragment'>b</A>
+        <a href=http://other/c>c</a> <a href="/a">a</a>
+        <a href="#top">top</a> <a href="mailto:dummy@dummy">mail</a>
+    """
+    response = Response(Request('http://dummy/dir/page'), 200, content,
+                        {'content-type': 'text/html'})
+
+    eq_(['http://dummy/a', 'http://dummy/dir/b', 'http://other/c'],
+        extract_links(response))
+
+
+def test_extract_links_with_entities():
+    content = '<a href="/p?x=1&amp;y=2">p</a> <a href="/q?a=&#x31;&amp;b">q</a>'
+    response = Response(Request('http://dummy/'), 200, content,
+                        {'content-type': 'text/html'})
+
+    eq_(['http://dummy/p?x=1&y=2', 'http://dummy/q?a=1&b'],
+        extract_links(response))
+
+
+def test_extract_links_after_redirect():
+    response = Response(Request('http://dummy/old/page'), 200,
+                        '<a href="next">next</a>',
+                        {'content-type': 'text/html'},
+                        url='http://other/new/page')
+
+    eq_(['http://other/new/next'], extract_links(response))
+
+
+def test_extract_links_from_non_html():
+    response = Response(Request('http://dummy/'), 200, '<a href="/a">',
+                        {'content-type': 'image/png'})
+
+    eq_([], extract_links(response))
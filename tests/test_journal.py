@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+import os
+import shutil
+import tempfile
+
+from picrawler.journal import Journal
+from picrawler.request import Request
+
+
+class TestJournal(object):
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'journal.db')
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def test_pending_requests(self):
+        journal = Journal(self.path)
+        requests = [Request('http://dummy/%d' % n, headers={'a': 'b'})
+                    for n in range(3)]
+        journal.add_pending(requests)
+        journal.close()
+
+        journal = Journal(self.path)
+        pending = journal.pending_requests()
+
+        eq_([r.id for r in requests], [r.id for r in pending])
+        eq_([r.url for r in requests], [r.url for r in pending])
+        eq_({'a': 'b'}, pending[0].headers)
+        eq_(requests[-1].id, journal.max_id())
+
+    def test_add_completed(self):
+        journal = Journal(self.path, flush_interval=60)
+        requests = [Request('http://dummy/%d' % n) for n in range(3)]
+        journal.add_pending(requests)
+
+        journal.add_completed(requests[0].id)
+        journal.add_completed(requests[2].id, 'key')
+
+        eq_([requests[1].id], [r.id for r in journal.pending_requests()])
+        eq_([(requests[0].id, 'http://dummy/0', None),
+             (requests[2].id, 'http://dummy/2', 'key')], journal.completed())
+
+    def test_buffered_completions(self):
+        journal = Journal(self.path, flush_interval=60, flush_size=2)
+        requests = [Request('http://dummy/%d' % n) for n in range(3)]
+        journal.add_pending(requests)
+
+        journal.add_completed(requests[0].id)
+        # the completions are not written until the buffer is full
+        reader = Journal(self.path)
+        eq_(3, len(reader.pending_requests()))
+
+        journal.add_completed(requests[1].id)
+        eq_(1, len(reader.pending_requests()))
+
+    def test_max_id_of_empty_journal(self):
+        eq_(0, Journal(self.path).max_id())
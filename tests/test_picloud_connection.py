@@ -2,14 +2,33 @@
 
 from nose.tools import *
 from mock import Mock, patch
-
-from picrawler.picloud_connection import PiCloudConnection
+import os
+import pickle
+import shutil
+import tempfile
+
+from picrawler.cache import HTTPCache
+from picrawler.canonical import URLCanonicalizer
+from picrawler.picloud_connection import MAX_PUSH_DELAY, PiCloudConnection
+from picrawler.worker import RequestHandler
 from picrawler import picloud_connection
 from picrawler import request
+from picrawler.response import Response, Timings
+from picrawler.retry import RetryPolicy
+
+
+def _mock_response(req):
+    response = Mock()
+    response.request.id = req.id
+    response.encode_time = None
+    response.encoded_size = None
+    response.timings = None
+
+    return response
 
 
 class TestPiCloudConnection(object):
-    @patch('picrawler.picloud_connection.cloud')
+    @patch('picrawler.backends.cloud')
     def test_context_manager(self, mock_cloud):
         conn = PiCloudConnection()
         with conn:
@@ -17,14 +36,14 @@ class TestPiCloudConnection(object):
 
         ok_(not conn.is_connected)
 
-    @patch('picrawler.picloud_connection.cloud')
+    @patch('picrawler.backends.cloud')
     def test_connect(self, mock_cloud):
         conn = PiCloudConnection()
         conn.connect()
         ok_(conn.is_connected)
         conn.close()
 
-    @patch('picrawler.picloud_connection.cloud')
+    @patch('picrawler.backends.cloud')
     def test_connect_initialize_queues(self, mock_cloud):
         conn = PiCloudConnection(max_parallel_jobs=100, core_type='c1')
         conn.connect()
@@ -41,11 +60,46 @@ class TestPiCloudConnection(object):
         eq_(1, conn.request_queue.attach.call_count)
         (args, kwargs) = conn.request_queue.attach.call_args
 
+        ok_(isinstance(args[0], RequestHandler))
         eq_([conn.result_queue], kwargs['output_queues'])
         eq_(100, kwargs['max_parallel_jobs'])
+        eq_(1, kwargs['readers_per_job'])
         eq_('c1', kwargs['_type'])
 
-    @patch('picrawler.picloud_connection.cloud')
+    @patch('picrawler.backends.cloud')
+    def test_per_job_concurrency(self, mock_cloud):
+        conn = PiCloudConnection(per_job_concurrency=20)
+        conn.connect()
+
+        (args, kwargs) = conn.request_queue.attach.call_args
+        eq_(20, kwargs['readers_per_job'])
+        eq_(20, args[0]._concurrency)
+
+        conn = PiCloudConnection(batch_size=50, per_job_concurrency=20)
+        conn.connect()
+
+        (args, kwargs) = conn.request_queue.attach.call_args
+        eq_(1, kwargs['readers_per_job'])
+        eq_(20, args[0]._concurrency)
+
+    @patch('picrawler.backends.cloud')
+    def test_fetch_limits(self, mock_cloud):
+        conn = PiCloudConnection(max_content_bytes=100,
+                                 allowed_content_types=['text/html'])
+        conn.connect()
+
+        (args, kwargs) = conn.request_queue.attach.call_args
+        eq_(100, args[0]._limits.max_bytes)
+        eq_(None, args[0]._limits.max_time)
+        ok_(args[0]._limits.allows('text/html'))
+
+        conn = PiCloudConnection()
+        conn.connect()
+
+        (args, kwargs) = conn.request_queue.attach.call_args
+        eq_(None, args[0]._limits)
+
+    @patch('picrawler.backends.cloud')
     def test_close(self, mock_cloud):
         conn = PiCloudConnection()
         conn.connect()
@@ -55,7 +109,7 @@ class TestPiCloudConnection(object):
         mock_cloud.close.assert_called_once_with()
         ok_(not conn.is_connected)
 
-    @patch('picrawler.picloud_connection.cloud')
+    @patch('picrawler.backends.cloud')
     def test_close_destroy_queues(self, mock_cloud):
         conn = PiCloudConnection()
         conn.connect()
@@ -70,7 +124,7 @@ class TestPiCloudConnection(object):
         result_queue.delete.assert_called_with()
         eq_(None, conn.result_queue)
 
-    @patch('picrawler.picloud_connection.cloud')
+    @patch('picrawler.backends.cloud')
     def test_send(self, mock_cloud):
         conn = PiCloudConnection()
         conn.connect()
@@ -92,7 +146,7 @@ class TestPiCloudConnection(object):
         eq_([results[2], results[0], results[1]], ret)
 
 
-    @patch('picrawler.picloud_connection.cloud')
+    @patch('picrawler.backends.cloud')
     @raises(picloud_connection.InvalidRequest)
     def test_send_with_none(self, mock_cloud):
         conn = PiCloudConnection()
@@ -100,7 +154,7 @@ class TestPiCloudConnection(object):
 
         conn.send(None)
 
-    @patch('picrawler.picloud_connection.cloud')
+    @patch('picrawler.backends.cloud')
     @raises(picloud_connection.InvalidRequest)
     def test_send_with_invalid_list(self, mock_cloud):
         conn = PiCloudConnection()
@@ -109,32 +163,200 @@ class TestPiCloudConnection(object):
 
         conn.send([req, None])
 
-    @patch('picrawler.picloud_connection.cloud')
-    def test_loop(self, mock_cloud):
-        conn = PiCloudConnection()
+    @patch('picrawler.picloud_connection.time')
+    @patch('picrawler.backends.cloud')
+    def test_loop(self, mock_cloud, mock_time):
+        conn = PiCloudConnection(pop_timeout=5)
         conn.connect()
+        mock_time.time.return_value = 0
 
-        mock_request_completed = Mock()
-        mock_request_completed.side_effect = [False, True]
-        conn._requests_completed = mock_request_completed
+        success_callback = Mock()
+        requests = [request.Request('http://dummy',
+                                    success_callback=success_callback)
+                    for n in range(2)]
+        conn._push(requests)
 
         mock_result_queue = Mock()
-        result1 = Mock()
-        result2 = Mock()
-        mock_result_queue.pop.side_effect = [[result1], [result2]] + [None] * 2
+        result1 = _mock_response(requests[0])
+        result2 = _mock_response(requests[1])
+        mock_result_queue.pop.side_effect = [[result1], [], [], [result2]]
         conn._result_queue = mock_result_queue
 
         ret = conn._loop()
 
         eq_([result1, result2], ret)
-        result1.run_callback.assert_called_once_with()
-        result2.run_callback.assert_called_once_with()
+        eq_([((result1,), {}), ((result2,), {})],
+            success_callback.call_args_list)
+        # the callbacks are released once the responses are delivered
+        eq_(0, len(conn.callbacks))
+
+        eq_(4, mock_result_queue.pop.call_count)
+        mock_result_queue.pop.assert_called_with(timeout=5)
+        eq_(4, conn.stats['pop_calls'])
+        eq_(2, conn.stats['empty_pops'])
+
+        # the sleep is doubled while the result queue is empty
+        eq_([((0.1,), {}), ((0.2,), {})], mock_time.sleep.call_args_list)
+
+    @patch('picrawler.picloud_connection.time')
+    @patch('picrawler.backends.cloud')
+    def test_loop_ignores_stray_responses(self, mock_cloud, mock_time):
+        conn = PiCloudConnection()
+        conn.connect()
+
+        req = request.Request('http://dummy')
+        conn._push([req])
+
+        stray = _mock_response(request.Request('http://dummy'))
+        result = _mock_response(req)
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [[stray, result]]
+
+        eq_([result], conn._loop())
+        eq_(1, conn.stats['stray_responses'])
+
+    @patch('picrawler.backends.cloud')
+    def test_push_while_iterating(self, mock_cloud):
+        conn = PiCloudConnection()
+        conn.connect()
+
+        req1 = request.Request('http://dummy/1')
+        req2 = request.Request('http://dummy/2')
+        result1 = _mock_response(req1)
+        result2 = _mock_response(req2)
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [[result1], [result2]]
+
+        conn.push([req1])
+        ret = []
+        for response in conn.iter_responses():
+            ret.append(response)
+            if response is result1:
+                # requests pushed during the iteration are also waited for
+                conn.push(req2)
+
+        eq_([result1, result2], ret)
+        eq_(2, conn.request_queue.push.call_count)
+
+    @patch('picrawler.backends.cloud')
+    def test_send_batch(self, mock_cloud):
+        conn = PiCloudConnection(batch_size=2)
+        conn.connect()
+
+        (args, kwargs) = conn.request_queue.attach.call_args
+        eq_(2, args[0]._concurrency)
+
+        requests = [request.Request('http://dummy') for n in range(3)]
+        results = [_mock_response(req) for req in requests]
+
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [[[results[1], results[0]]],
+                                              [[results[2]]]]
+
+        ret = conn.send(requests)
+
+        conn.request_queue.push.assert_called_once_with([requests[:2],
+                                                         requests[2:]])
+        eq_(results, ret)
+
+    @patch('picrawler.backends.cloud')
+    def test_spill(self, mock_cloud):
+        path = tempfile.mkdtemp()
+        try:
+            conn = PiCloudConnection(store_path=path, spill_threshold=10)
+            conn.connect()
+
+            requests = [request.Request('http://dummy') for n in range(2)]
+            results = [Response(requests[0], 200, 'a' * 100, {}),
+                       Response(requests[1], 200, 'a', {})]
+            conn._result_queue = Mock()
+            conn._result_queue.pop.side_effect = [results]
+
+            ret = conn.send(requests)
+
+            eq_(1, len(conn.store))
+            eq_(1, conn.stats['spilled_responses'])
+            eq_('a' * 100, ret[0].content[:])
+            eq_('a', ret[1].content)
+        finally:
+            shutil.rmtree(path)
+
+    @patch('picrawler.backends.cloud')
+    def test_callback_error(self, mock_cloud):
+        conn = PiCloudConnection()
+        conn.connect()
+
+        success_callback = Mock(side_effect=ValueError())
+        requests = [request.Request('http://dummy',
+                                    success_callback=success_callback)
+                    for n in range(2)]
+        results = [Response(req, 200, 'content', {}) for req in requests]
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [results]
+
+        # the exceptions raised in the inline callbacks are captured too
+        eq_(results, conn.send(requests))
+        eq_(2, success_callback.call_count)
+        eq_(2, conn.stats['callback_errors'])
+
+    @patch('picrawler.backends.cloud')
+    def test_callback_workers(self, mock_cloud):
+        conn = PiCloudConnection(callback_workers=2)
+        conn.connect()
+
+        success_callback = Mock(side_effect=ValueError())
+        requests = [request.Request('http://dummy',
+                                    success_callback=success_callback)
+                    for n in range(3)]
+        results = [Response(req, 200, 'content', {}) for req in requests]
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [results]
+
+        eq_(results, conn.send(requests))
+        # the exceptions raised in the callbacks do not stop the loop
+        eq_(3, success_callback.call_count)
+        eq_(3, conn.stats['callback_errors'])
+
+        conn.close()
+
+    @patch('picrawler.backends.cloud')
+    def test_timings(self, mock_cloud):
+        conn = PiCloudConnection()
+        conn.connect()
+
+        req = request.Request('http://dummy')
+        result = Response(req, 200, 'content', {}, Timings(started=0.0))
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [[result]]
+
+        conn.send(req)
+
+        ok_(req.enqueued_at is not None)
+        ok_(result.timings.popped <= result.timings.callback_done)
+        eq_(1, conn.stats.histogram('callback').count)
 
-    @patch('picrawler.picloud_connection.cloud')
+    @patch('picrawler.backends.cloud')
     def test_requests_completed(self, mock_cloud):
         conn = PiCloudConnection()
         conn.connect()
 
+        ok_(conn._requests_completed())
+
+        req = request.Request('http://dummy')
+        conn._push([req])
+        ok_(not conn._requests_completed())
+
+        # remote queue stats are not used to detect the completion
+        eq_(0, conn.request_queue.info.call_count)
+        eq_(0, conn.stats['info_calls'])
+
+    @patch('picrawler.backends.cloud')
+    def test_check_stalled(self, mock_cloud):
+        conn = PiCloudConnection()
+        conn.connect()
+
+        conn._push([request.Request('http://dummy')])
+
         mock_request_queue = Mock()
         conn._request_queue = mock_request_queue
 
@@ -152,17 +374,454 @@ class TestPiCloudConnection(object):
             )
             mock_result_queue.count.return_value = result_count
 
-        set_queue_info()
-        ok_(conn._requests_completed())
-
         set_queue_info(request_count=1)
+        conn._check_stalled()
         ok_(not conn._requests_completed())
 
         set_queue_info(request_processing_jobs=1)
+        conn._check_stalled()
         ok_(not conn._requests_completed())
 
         set_queue_info(request_queued_jobs=1)
+        conn._check_stalled()
         ok_(not conn._requests_completed())
 
         set_queue_info(result_count=1)
+        conn._check_stalled()
         ok_(not conn._requests_completed())
+
+        set_queue_info()
+        conn._check_stalled()
+        ok_(conn._requests_completed())
+        eq_(1, conn.stats['lost_requests'])
+
+    @patch('picrawler.backends.cloud')
+    def test_resume(self, mock_cloud):
+        path = tempfile.mkdtemp()
+        journal_path = os.path.join(path, 'journal.db')
+        try:
+            conn = PiCloudConnection(journal_path=journal_path)
+            conn.connect()
+
+            requests = [request.Request('http://dummy/%d' % n)
+                        for n in range(3)]
+            conn._result_queue = Mock()
+            conn._result_queue.pop.side_effect = [
+                [Response(requests[1], 200, 'content', {})]]
+
+            # the client dies after receiving the first response
+            iterator = conn.send_iter(requests)
+            iterator.next()
+            conn.close()
+
+            conn = PiCloudConnection(journal_path=journal_path)
+            conn.connect()
+
+            # the new requests do not reuse the IDs in the journal
+            ok_(request.Request('http://dummy').id > requests[-1].id)
+
+            resumed = conn.resume()
+            eq_([requests[0].id, requests[2].id], [r.id for r in resumed])
+            conn.request_queue.push.assert_called_with(resumed)
+
+            conn._result_queue = Mock()
+            conn._result_queue.pop.side_effect = [
+                [Response(r, 200, 'content', {}) for r in resumed]]
+            eq_(2, len(list(conn.iter_responses())))
+            conn.close()
+
+            eq_([], conn.journal.pending_requests())
+        finally:
+            shutil.rmtree(path)
+
+    @patch('picrawler.picloud_connection.time')
+    @patch('picrawler.backends.cloud')
+    def test_max_per_host(self, mock_cloud, mock_time):
+        mock_time.time.return_value = 0
+        conn = PiCloudConnection(max_per_host=1)
+        conn.connect()
+
+        requests = [request.Request('http://a/1'), request.Request('http://a/2'),
+                    request.Request('http://b/1')]
+        results = [Response(req, 200, 'content', {}) for req in requests]
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [[results[0]], [results[2]],
+                                              [results[1]]]
+
+        eq_(results, conn.send(requests))
+
+        # the second request to the same host is pushed after the first one
+        # is completed
+        eq_([((requests[0::2],), {}), ((requests[1:2],), {})],
+            conn.request_queue.push.call_args_list)
+
+    @patch('picrawler.scheduler.time')
+    @patch('picrawler.picloud_connection.time')
+    @patch('picrawler.backends.cloud')
+    def test_host_rate(self, mock_cloud, mock_time, mock_scheduler_time):
+        mock_time.time.return_value = 0
+        mock_scheduler_time.time = mock_time.time
+        conn = PiCloudConnection(host_rate=0.5, pop_timeout=5)
+        conn.connect()
+
+        requests = [request.Request('http://a/%d' % n) for n in range(2)]
+        conn.push(requests)
+        conn.request_queue.push.assert_called_once_with(requests[:1])
+
+        pushed = requests[:1]
+        conn._request_queue = Mock()
+        conn._request_queue.push.side_effect = pushed.extend
+
+        def pop(timeout):
+            mock_time.time.return_value += timeout
+            if pushed:
+                return [Response(pushed.pop(0), 200, 'content', {})]
+            return []
+
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = pop
+
+        eq_(requests, [r.request for r in conn.iter_responses()])
+        conn.request_queue.push.assert_called_once_with(requests[1:])
+
+        # the pop does not block longer than the next scheduled push
+        eq_([((), {'timeout': 2}), ((), {'timeout': 5})],
+            conn._result_queue.pop.call_args_list)
+
+    @patch('picrawler.picloud_connection.time')
+    @patch('picrawler.backends.cloud')
+    def test_retry(self, mock_cloud, mock_time):
+        mock_time.time.return_value = 0
+        conn = PiCloudConnection(retry_policy=RetryPolicy(max_retries=1))
+        conn.connect()
+
+        req = request.Request('http://dummy')
+        failed = Response(req, 503, '', {'retry-after': '10'})
+        result = Response(req, 503, '', {})
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [[failed], [result]]
+
+        eq_([result], conn.send(req))
+
+        eq_([(([req],), {}), (([req],), {'delay': 10})],
+            conn.request_queue.push.call_args_list)
+        eq_(1, conn.stats['retries'])
+
+    @patch('picrawler.picloud_connection.time')
+    @patch('picrawler.backends.cloud')
+    def test_retry_huge_delay(self, mock_cloud, mock_time):
+        mock_time.time.return_value = 0
+        conn = PiCloudConnection(retry_policy=RetryPolicy(max_retries=2))
+        conn.connect()
+
+        req = request.Request('http://dummy')
+        huge = Response(req, 503, '', {'retry-after': '1e300'})
+        inf = Response(req, 503, '', {'retry-after': '1e400'})
+        result = Response(req, 200, '', {})
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [[huge], [inf], [result]]
+
+        eq_([result], conn.send(req))
+
+        # the huge delay is clamped, and the infinite one falls back to the
+        # backoff
+        eq_([(([req],), {}), (([req],), {'delay': MAX_PUSH_DELAY}),
+             (([req],), {'delay': 2})],
+            conn.request_queue.push.call_args_list)
+
+    @patch('picrawler.backends.cloud')
+    def test_hedge(self, mock_cloud):
+        conn = PiCloudConnection(hedge_percentile=95, hedge_min_samples=1)
+        conn.connect()
+
+        conn.stats.observe('response_latency', 0.01)
+
+        requests = [request.Request('http://dummy') for n in range(2)]
+        conn.push(requests)
+        for req in requests:
+            req.enqueued_at -= 1
+
+        # the requests are copied by the queue
+        originals = [pickle.loads(pickle.dumps(req)) for req in requests]
+        hedge = Response(requests[0], 200, 'hedge', {})
+        conn._result_queue = Mock()
+
+        def pop(timeout):
+            if conn.stats['hedged_requests']:
+                conn._result_queue.pop.side_effect = [
+                    [hedge, Response(originals[1], 200, 'content', {})],
+                    [Response(originals[0], 200, 'original', {})]]
+            return []
+
+        conn._result_queue.pop.side_effect = pop
+
+        ret = list(conn.iter_responses())
+
+        eq_(['hedge', 'content'], [r.content for r in ret])
+        conn.request_queue.push.assert_called_with(requests)
+        eq_(2, conn.stats['hedged_requests'])
+        eq_(1, conn.stats['hedge_wins'])
+
+    @patch('picrawler.picloud_connection.time')
+    @patch('picrawler.backends.cloud')
+    def test_hedge_skips_delayed_retry(self, mock_cloud, mock_time):
+        mock_time.time.return_value = 0
+        conn = PiCloudConnection(retry_policy=RetryPolicy(max_retries=1),
+                                 hedge_percentile=95, hedge_min_samples=1)
+        conn.connect()
+        conn.stats.observe('response_latency', 0.01)
+
+        req = request.Request('http://dummy')
+        failed = Response(req, 429, '', {'retry-after': '120'})
+        result = Response(req, 200, '', {})
+        conn._result_queue = Mock()
+
+        popped = [[failed], [], [result]]
+
+        def pop(timeout):
+            if len(popped) == 2:
+                # the latency percentile has passed long ago
+                mock_time.time.return_value = 10
+            return popped.pop(0)
+
+        conn._result_queue.pop.side_effect = pop
+
+        eq_([result], conn.send(req))
+
+        # the retry is delayed as requested, and is not hedged
+        eq_([(([req],), {}), (([req],), {'delay': 120})],
+            conn.request_queue.push.call_args_list)
+        eq_(0, conn.stats['hedged_requests'])
+
+    @patch('picrawler.picloud_connection.time')
+    @patch('picrawler.backends.cloud')
+    def test_hedge_wait_time(self, mock_cloud, mock_time):
+        mock_time.time.return_value = 100
+        conn = PiCloudConnection(hedge_percentile=95, hedge_min_samples=1)
+        conn.connect()
+        conn.stats.observe('response_latency', 2.0)
+
+        req = request.Request('http://dummy')
+        conn._result_queue = Mock()
+        conn._result_queue.pop.return_value = [Response(req, 200, '', {})]
+
+        conn.send(req)
+
+        # the pop does not block longer than the time until the hedge
+        conn._result_queue.pop.assert_called_once_with(timeout=2)
+
+    @patch('picrawler.backends.cloud')
+    def test_cache(self, mock_cloud):
+        cache = HTTPCache()
+        conn = PiCloudConnection(cache=cache)
+        conn.connect()
+
+        cache.update(Response(request.Request('http://dummy/1'), 200, 'cached',
+                              {'cache-control': 'max-age=60'}))
+        cache.update(Response(request.Request('http://dummy/2'), 200, 'stale',
+                              {'etag': '"abc"'}))
+
+        requests = [request.Request('http://dummy/%d' % n) for n in range(1, 4)]
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [
+            [Response(requests[1], 304, None, {}),
+             Response(requests[2], 200, 'content', {})]]
+
+        ret = conn.send(requests)
+
+        eq_(['cached', 'stale', 'content'], [r.content for r in ret])
+        # the fresh response is not requested
+        conn.request_queue.push.assert_called_once_with(requests[1:])
+        eq_('"abc"', requests[1].headers['If-None-Match'])
+        eq_(2.0 / 3, cache.hit_ratio)
+
+    @patch('picrawler.backends.cloud')
+    def test_cache_evicted_during_revalidation(self, mock_cloud):
+        cache = HTTPCache(max_entries=1)
+        conn = PiCloudConnection(cache=cache)
+        conn.connect()
+
+        cache.update(Response(request.Request('http://dummy/1'), 200, 'stale',
+                              {'etag': '"abc"'}))
+
+        req = request.Request('http://dummy/1')
+        conn._result_queue = Mock()
+
+        def pop(timeout):
+            # another response evicts the cached response
+            cache.update(Response(request.Request('http://dummy/2'), 200,
+                                  'other', {}))
+            conn._result_queue.pop.side_effect = [
+                [Response(req, 200, 'content', {})]]
+            return [Response(req, 304, None, {})]
+
+        conn._result_queue.pop.side_effect = pop
+
+        eq_(['content'], [r.content for r in conn.send(req)])
+
+        # the request is sent again without the conditional headers
+        eq_(2, conn.request_queue.push.call_count)
+        eq_({}, req.headers)
+        eq_(1, conn.stats['cache_resends'])
+
+    @patch('picrawler.backends.cloud')
+    def test_near_duplicates(self, mock_cloud):
+        for mode in ('drop', 'collapse'):
+            conn = PiCloudConnection(near_duplicates=mode)
+            conn.connect()
+
+            (args, kwargs) = conn.request_queue.attach.call_args
+            ok_(args[0]._fingerprint)
+
+            requests = [request.Request('http://dummy/%d' % n)
+                        for n in range(4)]
+            results = [Response(req, 200, 'content', {}) for req in requests]
+            results[3] = Response(requests[3], 404, 'content', {})
+            for (result, fingerprint) in zip(results, [0, 1, 2 ** 64 - 1, 0]):
+                result.fingerprint = fingerprint
+
+            conn._result_queue = Mock()
+            conn._result_queue.pop.side_effect = [results]
+
+            ret = conn.send(requests)
+
+            eq_(1, conn.stats['near_duplicates'])
+            eq_('content', ret[0].content)
+            eq_('content', ret[2].content)
+            # the responses of the errors are not compared
+            eq_('content', ret[3].content)
+
+            if mode == 'drop':
+                eq_(None, ret[1])
+            else:
+                eq_(None, ret[1].content)
+                eq_('http://dummy/0', ret[1].duplicate_of)
+
+    @raises(ValueError)
+    def test_invalid_near_duplicates(self):
+        PiCloudConnection(near_duplicates='invalid')
+
+    @patch('picrawler.backends.cloud')
+    def test_coalesce(self, mock_cloud):
+        conn = PiCloudConnection(canonicalizer=URLCanonicalizer())
+        conn.connect()
+
+        callbacks = [Mock() for n in range(3)]
+        requests = [request.Request('http://dummy/?b=1&a=1',
+                                    success_callback=callbacks[0]),
+                    request.Request('http://DUMMY/?a=1&b=1#top',
+                                    success_callback=callbacks[1]),
+                    request.Request('http://dummy/?a=1&b=1', 'post',
+                                    success_callback=callbacks[2])]
+        results = [Response(requests[0], 200, 'content', {}),
+                   Response(requests[2], 200, 'content', {})]
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [results]
+
+        ret = conn.send(requests)
+
+        conn.request_queue.push.assert_called_once_with([requests[0],
+                                                         requests[2]])
+        eq_('http://dummy/?a=1&b=1', requests[0].url)
+        eq_([results[0], results[0], results[1]], ret)
+        for (callback, result) in zip(callbacks, [results[0], results[0], results[1]]):
+            callback.assert_called_once_with(result)
+
+        eq_(1, conn.stats['coalesced_requests'])
+        eq_(0, len(conn.callbacks))
+
+        # the same URL is sent again once the response has arrived
+        req = request.Request('http://dummy/?a=1&b=1')
+        conn._result_queue.pop.side_effect = [[Response(req, 200, '', {})]]
+        conn.send(req)
+        conn.request_queue.push.assert_called_with([req])
+
+    @patch('picrawler.backends.cloud')
+    def test_push_chunk_size(self, mock_cloud):
+        conn = PiCloudConnection(push_chunk_size=2)
+        conn.connect()
+
+        requests = [request.Request('http://dummy') for n in range(5)]
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = [
+            [Response(req, 200, '', {}) for req in requests]]
+
+        conn.send(requests)
+
+        eq_([((requests[0:2],), {}), ((requests[2:4],), {}),
+             ((requests[4:],), {})], conn.request_queue.push.call_args_list)
+        eq_(3, conn.stats['push_calls'])
+
+    @patch('picrawler.backends.cloud')
+    def test_max_in_flight(self, mock_cloud):
+        conn = PiCloudConnection(max_in_flight=2)
+        conn.connect()
+
+        consumed = []
+
+        def generate():
+            for n in range(5):
+                consumed.append(n)
+                yield 'http://dummy/%d' % n
+
+        pushed = []
+        conn._request_queue = Mock()
+        conn._request_queue.push.side_effect = pushed.extend
+
+        num_in_flight = []
+
+        def pop(timeout):
+            num_in_flight.append(len(conn._outstanding))
+            return [Response(pushed.pop(0), 200, '', {})]
+
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = pop
+
+        iterator = conn.send_iter(generate())
+        # the input is read lazily
+        eq_([0, 1], consumed)
+
+        ret = list(iterator)
+        eq_(['http://dummy/%d' % n for n in range(5)],
+            [r.request.url for r in ret])
+        # the window is topped up as the responses arrive
+        eq_([2, 2, 2, 2, 1], num_in_flight)
+        eq_([2, 1, 1, 1], [len(args[0]) for (args, kwargs) in
+                           conn.request_queue.push.call_args_list])
+
+    @patch('picrawler.backends.cloud')
+    def test_max_in_flight_with_canonicalizer(self, mock_cloud):
+        conn = PiCloudConnection(max_in_flight=2,
+                                 canonicalizer=URLCanonicalizer())
+        conn.connect()
+
+        pushed = []
+        conn._request_queue = Mock()
+        conn._request_queue.push.side_effect = pushed.extend
+
+        def pop(timeout):
+            # the fast response arrives first
+            return [Response(pushed.pop(), 200, '', {})]
+
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = pop
+
+        ret = conn.send(['http://a/slow', 'http://b/fast', 'http://A/slow'])
+
+        # the duplicate is coalesced while the window is topped up
+        eq_(1, conn.stats['coalesced_requests'])
+        eq_(['http://a/slow', 'http://b/fast', 'http://a/slow'],
+            [r.request.url for r in ret])
+        ok_(ret[0] is ret[2])
+
+    @patch('picrawler.backends.cloud')
+    @raises(picloud_connection.InvalidRequest)
+    def test_max_in_flight_with_invalid_item(self, mock_cloud):
+        conn = PiCloudConnection(max_in_flight=1)
+        conn.connect()
+
+        conn._result_queue = Mock()
+        conn._result_queue.pop.side_effect = lambda timeout: [
+            Response(conn.request_queue.push.call_args[0][0][0], 200, '', {})]
+
+        list(conn.send_iter(['http://dummy', None]))
@@ -2,13 +2,21 @@
 
 from nose.tools import *
 from mock import Mock, patch
-import re
+import pickle
 
 from picrawler import request
 from picrawler.request import Request
 from picrawler.response import Response, ErrorResponse
 
 
+def extract_length(response):
+    return len(response.content)
+
+
+def extract_error(response):
+    raise ValueError('error')
+
+
 class TestRequest(object):
     def test_constructor(self):
         Request('http://dummy', 'get')
@@ -19,7 +27,13 @@ class TestRequest(object):
 
     def test_id(self):
         req = Request('http://dummy', 'get')
-        ok_(re.match(r'^[0-9a-f]{32}$', req.id))
+        req2 = Request('http://dummy', 'get')
+        ok_(isinstance(req.id, int))
+        ok_(req.id < req2.id)
+
+    def test_slots(self):
+        req = Request('http://dummy', 'get')
+        ok_(not hasattr(req, '__dict__'))
 
     def test_url(self):
         req = Request('http://dummy', 'get')
@@ -33,6 +47,38 @@ class TestRequest(object):
         req = Request('http://dummy', 'get', headers=dict(n='v'))
         eq_(dict(n='v'), req.headers)
 
+    def test_headers_not_specified(self):
+        req = Request('http://dummy', 'get')
+        eq_({}, req.headers)
+
+    def test_headers_interned(self):
+        headers = {'User-Agent': 'dummy'}
+        req = Request('http://dummy', headers=headers)
+        req2 = Request('http://dummy2', headers=dict(headers))
+
+        ok_(req.headers is req2.headers)
+        # the shared dict is not affected by the modification of the argument
+        headers['User-Agent'] = 'dummy2'
+        eq_({'User-Agent': 'dummy'}, req.headers)
+
+    def test_headers_read_only(self):
+        req = Request('http://dummy', headers={'User-Agent': 'dummy'})
+        req2 = Request('http://dummy2', headers={'User-Agent': 'dummy'})
+
+        assert_raises(TypeError, req.headers.__setitem__, 'X', 'x')
+        assert_raises(TypeError, req.headers.update, X='x')
+        assert_raises(TypeError, Request('http://dummy').headers.setdefault,
+                      'X', 'x')
+
+        # the setter replaces the headers of the request only
+        req.headers = dict(req.headers, X='x')
+        eq_({'User-Agent': 'dummy', 'X': 'x'}, req.headers)
+        eq_({'User-Agent': 'dummy'}, req2.headers)
+
+        req3 = pickle.loads(pickle.dumps(req2, 2))
+        eq_({'User-Agent': 'dummy'}, req3.headers)
+        ok_(isinstance(req3.headers, request.FrozenHeaders))
+
     def test_args(self):
         req = Request('http://dummy', 'get', args=dict(n='v'))
         eq_(dict(n='v'), req.args)
@@ -77,6 +123,16 @@ class TestRequest(object):
 
         mock_error_cb.assert_called_once_with(mock_resp)
 
+    def test_pickle_without_callbacks(self):
+        req = Request('http://dummy', success_callback=lambda r: None,
+                      error_callback=lambda r: None)
+        req2 = pickle.loads(pickle.dumps(req, 2))
+
+        eq_(req.id, req2.id)
+        eq_('http://dummy', req2.url)
+        eq_(None, req2.success_callback)
+        eq_(None, req2.error_callback)
+
     @raises(request.InvalidResponse)
     def test_run_callback_with_invalid_response(self):
         req = Request('http://dummy')
@@ -92,6 +148,101 @@ class TestRequest(object):
         (args, kwargs) = requests_get.call_args
         eq_('http://dummy', args[0])
 
+    def test_call_with_session(self):
+        session = Mock()
+        session.post.return_value.status_code = 200
+
+        req = request.Request('http://dummy', 'POST', args=dict(data='d'))
+        ret = req(session=session)
+
+        ok_(isinstance(ret, Response))
+        eq_(200, ret.status_code)
+        session.post.assert_called_once_with('http://dummy', headers={},
+                                             data='d', stream=True)
+
+    def test_call_timings(self):
+        session = Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.content = 'content'
+        session.get.return_value.headers = {}
+        session.get.return_value.url = 'http://dummy'
+
+        req = request.Request('http://dummy')
+        req.enqueued_at = 1.0
+        ret = req(session=session)
+
+        eq_(1.0, ret.timings.enqueued)
+        ok_(ret.timings.started <= ret.timings.first_byte <= ret.timings.completed)
+        eq_(None, ret.timings.serialized)
+
+        pickle.dumps(ret, 2)
+        ok_(ret.timings.completed <= ret.timings.serialized)
+
+    def _streaming_session(self, chunks, content_type='text/html'):
+        session = Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {'content-type': content_type}
+        session.get.return_value.iter_content.return_value = iter(chunks)
+        session.get.return_value.url = 'http://dummy'
+
+        return session
+
+    def test_call_with_limits(self):
+        session = self._streaming_session(['abc', 'def'])
+        limits = request.FetchLimits(max_bytes=10, content_types=['text/*'])
+
+        ret = request.Request('http://dummy')(session=session, limits=limits)
+
+        eq_('abcdef', ret.content)
+        ok_(not ret.truncated)
+        session.get.return_value.iter_content.assert_called_once_with(
+            request.CHUNK_SIZE)
+
+    def test_call_with_max_bytes(self):
+        session = self._streaming_session(['abc', 'def', 'ghi'])
+        limits = request.FetchLimits(max_bytes=4)
+
+        ret = request.Request('http://dummy')(session=session, limits=limits)
+
+        eq_('abcd', ret.content)
+        ok_(ret.truncated)
+        session.get.return_value.close.assert_called_once_with()
+
+    @patch('picrawler.request.time')
+    def test_call_with_max_time(self, mock_time):
+        mock_time.time.side_effect = [0, 1, 2, 3, 4]
+        session = self._streaming_session(['abc', 'def', 'ghi'])
+        limits = request.FetchLimits(max_time=1.5)
+
+        ret = request.Request('http://dummy')(session=session, limits=limits)
+
+        eq_('abcdef', ret.content)
+        ok_(ret.truncated)
+
+    def test_call_with_content_types(self):
+        session = self._streaming_session(['abc'], 'image/png')
+        limits = request.FetchLimits(content_types=['text/html'])
+
+        ret = request.Request('http://dummy')(session=session, limits=limits)
+
+        eq_(None, ret.content)
+        ok_(ret.truncated)
+        eq_(0, session.get.return_value.iter_content.call_count)
+        session.get.return_value.close.assert_called_once_with()
+
+        # the truncated flag is transferred
+        ok_(pickle.loads(pickle.dumps(ret)).truncated)
+
+    def test_call_with_redirect(self):
+        session = self._streaming_session(['abc'])
+        session.get.return_value.content = 'abc'
+        session.get.return_value.url = 'http://dummy/redirected'
+
+        ret = request.Request('http://dummy')(session=session)
+
+        eq_('http://dummy/redirected', ret.url)
+        eq_('http://dummy/redirected', pickle.loads(pickle.dumps(ret, 2)).url)
+
     @patch('requests.get')
     def test_call_with_error(self, requests_get):
         req = request.Request('http://dummy', 'GET')
@@ -102,3 +253,82 @@ class TestRequest(object):
 
         ok_(isinstance(ret, ErrorResponse))
         eq_(exception, ret.exception)
+
+    def test_call_with_extractor(self):
+        session = Mock()
+        session.get.return_value.content = 'content'
+
+        req = request.Request('http://dummy', extractor=extract_length)
+        eq_('tests.test_request:extract_length', req.extractor)
+
+        ret = req(session=session)
+
+        eq_(7, ret.extracted)
+        # only the result of the extractor is sent back
+        eq_(None, ret.content)
+
+    def test_call_with_extractor_keep_content(self):
+        session = Mock()
+        session.get.return_value.content = 'content'
+
+        req = request.Request('http://dummy',
+                              extractor='tests.test_request:extract_length',
+                              keep_content=True)
+        req = pickle.loads(pickle.dumps(req, 2))
+        ret = req(session=session)
+
+        eq_(7, ret.extracted)
+        eq_('content', ret.content)
+
+    def test_call_without_extract(self):
+        session = Mock()
+        session.get.return_value.content = 'content'
+
+        req = request.Request('http://dummy', extractor=extract_length)
+        ret = req(session=session, extract=False)
+
+        eq_(None, ret.extracted)
+        eq_('content', ret.content)
+
+        ret = req.extract(ret)
+
+        eq_(7, ret.extracted)
+        eq_(None, ret.content)
+
+    def test_call_with_extractor_error(self):
+        session = Mock()
+        session.get.return_value.content = 'content'
+
+        req = request.Request('http://dummy', extractor=extract_error)
+        ret = req(session=session)
+
+        ok_(isinstance(ret, ErrorResponse))
+        eq_('error', ret.exception.args[0])
+
+
+def test_skip_ids():
+    last_id = request.Request('http://dummy').id
+
+    request.skip_ids(last_id + 100)
+    eq_(last_id + 101, request.Request('http://dummy').id)
+
+    # the counter never goes back
+    request.skip_ids(0)
+    ok_(request.Request('http://dummy').id > last_id + 101)
+
+
+def test_retry_policy_is_not_pickled():
+    req = Request('http://dummy', retry_policy=Mock())
+    ok_(req.retry_policy is not None)
+
+    eq_(None, pickle.loads(pickle.dumps(req)).retry_policy)
+
+
+def test_fetch_limits_allows():
+    limits = request.FetchLimits(content_types=['text/html', 'Application/*'])
+
+    ok_(limits.allows('text/html; charset=utf-8'))
+    ok_(limits.allows('application/json'))
+    ok_(not limits.allows('text/plain'))
+    ok_(not limits.allows(None))
+    ok_(request.FetchLimits().allows(None))
@@ -3,8 +3,41 @@
 from nose.tools import *
 from mock import Mock
 import pickle
+import shutil
+import tempfile
 
-from picrawler.response import BaseResponse, Response, ErrorResponse
+from picrawler.compression import Compressor
+from picrawler.response import BaseResponse, Response, ErrorResponse, Timings
+from picrawler.store import ContentStore
+
+
+class TestTimings(object):
+    def test_phases(self):
+        timings = Timings(enqueued=1.0, started=2.0)
+        timings.first_byte = 4.0
+        timings.completed = 7.0
+        timings.serialized = 8.0
+        timings.popped = 10.0
+
+        eq_(1.0, timings.queue_wait)
+        eq_(2.0, timings.fetch)
+        eq_(3.0, timings.transfer)
+        eq_(1.0, timings.serialize)
+        eq_(2.0, timings.result_wait)
+        eq_(None, timings.callback)
+        eq_(9.0, timings.total)
+
+        timings.callback_done = 11.0
+        eq_(1.0, timings.callback)
+        eq_(10.0, timings.total)
+
+    def test_pickle_instance(self):
+        timings = Timings(enqueued=1.0, started=2.0)
+        timings2 = pickle.loads(pickle.dumps(timings, 2))
+
+        eq_(1.0, timings2.enqueued)
+        eq_(2.0, timings2.started)
+        eq_(None, timings2.popped)
 
 
 class TestBaseResponse(object):
@@ -23,10 +56,80 @@ class TestBaseResponse(object):
         request_mock = {}
         ins = BaseResponse(request_mock)
         ins2 = pickle.loads(pickle.dumps(ins))
-        eq_(ins.__dict__, ins2.__dict__)
+        eq_(ins.request, ins2.request)
+        ok_(ins2.encode_time >= 0)
+        eq_(None, ins2.encoded_size)
 
 
 class TestResponse(object):
+    def test_pickle_instance(self):
+        ins = Response({}, 200, 'a' * 2000, {'content-type': 'text/html'})
+        ins.compressor = Compressor('zlib', level=1, threshold=1000)
+        (attrs, codec_name, data, encode_time) = ins.__getstate__()
+
+        # the content is carried separately from the other attributes
+        ok_('_content' not in attrs)
+        eq_('zlib', codec_name)
+        ok_(len(data) < 2000)
+
+        ins2 = pickle.loads(pickle.dumps(ins, 2))
+        eq_(200, ins2.status_code)
+        eq_({'content-type': 'text/html'}, ins2.headers)
+        eq_(len(data), ins2.encoded_size)
+
+        # the content is decompressed lazily
+        eq_(None, ins2.decode_time)
+        eq_('a' * 2000, ins2.content)
+        ok_(ins2.decode_time >= 0)
+
+    def test_pickle_without_access(self):
+        ins = Response({}, 200, 'a' * 2000, {})
+        ins2 = pickle.loads(pickle.dumps(ins, 2))
+        ins3 = pickle.loads(pickle.dumps(ins2, 2))
+
+        eq_('a' * 2000, ins3.content)
+
+    def test_spill(self):
+        path = tempfile.mkdtemp()
+        try:
+            content_store = ContentStore(path)
+            ins = Response({}, 200, 'a' * 2000, {})
+
+            ok_(not ins.spill(content_store, threshold=3000))
+            ok_(ins.spill(content_store, threshold=1000))
+            eq_(1, len(content_store))
+            eq_('a' * 2000, ins.content[:])
+
+            ins2 = pickle.loads(pickle.dumps(ins, 2))
+            eq_('a' * 2000, ins2.content)
+        finally:
+            shutil.rmtree(path)
+
+    def test_spill_keeps_content_alive(self):
+        path = tempfile.mkdtemp()
+        try:
+            content_store = ContentStore(path, max_size=3000)
+            ins = Response({}, 200, 'a' * 2000, {})
+            ins2 = Response({}, 200, 'b' * 2000, {})
+            ok_(ins.spill(content_store))
+            ok_(ins2.spill(content_store))
+
+            # the content of a live instance is not evicted
+            eq_('a' * 2000, ins.content[:])
+            eq_('b' * 2000, ins2.content[:])
+
+            key = ins.content_key
+            del ins
+            ok_(key not in content_store)
+        finally:
+            shutil.rmtree(path)
+
+    def test_pickle_skips_compressed_content(self):
+        ins = Response({}, 200, 'a' * 2000, {'content-type': 'image/png'})
+        eq_('none', ins.__getstate__()[1])
+
+        ins = Response({}, 200, 'a' * 10, {})
+        eq_('none', ins.__getstate__()[1])
     def test_constructor(self):
         request_mock = Mock()
         ins = Response(request_mock, 200, 'dummy', dict(name='value'))
@@ -45,3 +148,11 @@ class TestErrorResponse(object):
 
         eq_(exception, ins.exception)
         eq_(ins.request, request_mock)
+
+    def test_pickle_instance(self):
+        exception = ValueError('error')
+        ins = ErrorResponse({}, exception)
+        ins2 = pickle.loads(pickle.dumps(ins, 2))
+
+        eq_('error', ins2.exception.args[0])
+        eq_(None, ins2.encoded_size)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+import requests
+
+from picrawler.request import Request
+from picrawler.response import Response, ErrorResponse
+from picrawler.retry import RetryPolicy, parse_retry_after
+
+
+class TestRetryPolicy(object):
+    def test_should_retry(self):
+        policy = RetryPolicy(max_retries=2)
+        req = Request('http://dummy')
+
+        ok_(policy.should_retry(Response(req, 503, '', {}), 0))
+        ok_(policy.should_retry(Response(req, 429, '', {}), 1))
+        ok_(not policy.should_retry(Response(req, 503, '', {}), 2))
+        ok_(not policy.should_retry(Response(req, 200, '', {}), 0))
+        ok_(not policy.should_retry(Response(req, 404, '', {}), 0))
+
+    def test_should_retry_error_response(self):
+        policy = RetryPolicy()
+        req = Request('http://dummy')
+
+        ok_(policy.should_retry(
+            ErrorResponse(req, requests.exceptions.ConnectionError()), 0))
+        ok_(policy.should_retry(
+            ErrorResponse(req, requests.exceptions.Timeout()), 0))
+        # the errors raised by the extractors are not retried
+        ok_(not policy.should_retry(ErrorResponse(req, ValueError()), 0))
+
+    def test_get_delay(self):
+        policy = RetryPolicy(backoff_base=1, backoff_max=5)
+        response = Response(Request('http://dummy'), 503, '', {})
+
+        eq_([1, 2, 4, 5], [policy.get_delay(response, n) for n in range(4)])
+
+    def test_get_delay_with_retry_after(self):
+        policy = RetryPolicy()
+        response = Response(Request('http://dummy'), 429, '',
+                            {'retry-after': '120'})
+
+        eq_(120, policy.get_delay(response, 0))
+
+
+def test_parse_retry_after():
+    eq_(10.0, parse_retry_after('10'))
+    eq_(30.0, parse_retry_after('Thu, 01 Jan 1970 00:01:00 GMT', now=30))
+    eq_(0.0, parse_retry_after('Thu, 01 Jan 1970 00:01:00 GMT', now=100))
+    eq_(None, parse_retry_after('invalid'))
+    eq_(None, parse_retry_after('inf'))
+    eq_(None, parse_retry_after('nan'))
+    eq_(1e300, parse_retry_after('1e300'))
+    eq_(None, parse_retry_after(None))
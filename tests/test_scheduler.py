@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+
+from picrawler.request import Request
+from picrawler.scheduler import HostScheduler, TokenBucket
+
+
+class TestTokenBucket(object):
+    def test_consume(self):
+        bucket = TokenBucket(2, burst=2, now=0)
+
+        ok_(bucket.consume(0))
+        ok_(bucket.consume(0))
+        ok_(not bucket.consume(0))
+        eq_(0.5, bucket.wait_time(0))
+
+        ok_(bucket.consume(0.5))
+        ok_(not bucket.consume(0.5))
+
+    def test_burst(self):
+        bucket = TokenBucket(1, burst=2, now=0)
+
+        # the tokens are not accumulated beyond the burst
+        ok_(bucket.consume(100))
+        ok_(bucket.consume(100))
+        ok_(not bucket.consume(100))
+
+
+class TestHostScheduler(object):
+    def test_ready_interleaves_hosts(self):
+        scheduler = HostScheduler()
+        requests = [Request('http://a/1'), Request('http://a/2'),
+                    Request('http://a/3'), Request('http://b/1')]
+        scheduler.add(requests)
+
+        eq_(4, len(scheduler))
+        eq_(['http://a/1', 'http://b/1', 'http://a/2', 'http://a/3'],
+            [r.url for r in scheduler.ready()])
+        eq_(0, len(scheduler))
+        eq_(4, scheduler.num_in_flight)
+
+    def test_rate(self):
+        scheduler = HostScheduler(rate=1)
+        scheduler.add([Request('http://a/%d' % n) for n in range(3)] +
+                      [Request('http://B/%d' % n) for n in range(2)])
+
+        eq_(['http://a/0', 'http://B/0'],
+            [r.url for r in scheduler.ready(now=0)])
+        eq_(0.5, scheduler.wait_time(now=0.5))
+        eq_([], scheduler.ready(now=0.5))
+
+        ready = scheduler.ready(now=1)
+        eq_(set(['http://a/1', 'http://B/1']), set(r.url for r in ready))
+        eq_(['http://a/2'], [r.url for r in scheduler.ready(now=2)])
+        eq_(None, scheduler.wait_time(now=2))
+
+    def test_max_per_host(self):
+        scheduler = HostScheduler(max_per_host=2)
+        requests = [Request('http://a/%d' % n) for n in range(3)]
+        scheduler.add(requests)
+
+        eq_(requests[:2], scheduler.ready())
+        eq_([], scheduler.ready())
+        eq_(set([requests[2].id]), scheduler.waiting_ids())
+
+        scheduler.release(requests[0].id)
+        # releasing an unknown request is ignored
+        scheduler.release(requests[0].id)
+
+        eq_(requests[2:], scheduler.ready())
+        eq_(2, scheduler.num_in_flight)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+from mock import patch
+import collections
+import os
+import shutil
+import tempfile
+import threading
+
+from picrawler.backends import LocalBackend
+from picrawler.request import Request
+from picrawler.sharded_connection import ShardedConnection
+from picrawler import sharded_connection
+
+URLS = ['http://host%d/%d' % (n % 5, n) for n in range(20)]
+
+
+def _mock_get(mock_get):
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.content = 'content'
+    mock_get.return_value.headers = {}
+
+
+class TestShardedConnection(object):
+    @patch('picrawler.backends.cloud')
+    def test_shards(self, mock_cloud):
+        with ShardedConnection(num_shards=3) as conn:
+            eq_(3, len(conn.shards))
+            ok_(all(shard.is_connected for shard in conn.shards))
+
+        ok_(not any(shard.is_connected for shard in conn.shards))
+
+        # each shard has its own queues
+        names = [args[0] for (args, kwargs) in
+                 mock_cloud.queue.get.call_args_list]
+        eq_(6, len(set(names)))
+
+    @patch('picrawler.backends.cloud')
+    def test_get_shard(self, mock_cloud):
+        conn = ShardedConnection(num_shards=4)
+
+        # the requests to the same host are routed to the same shard
+        eq_(conn.get_shard(Request('http://host/a')),
+            conn.get_shard(Request('http://HOST/b?c=d')))
+
+        shards = set(conn.get_shard(Request('http://host%d/' % n))
+                     for n in range(100))
+        eq_(4, len(shards))
+
+    @patch('picrawler.backends.cloud')
+    def test_paths(self, mock_cloud):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            conn = ShardedConnection(
+                num_shards=2, journal_path=os.path.join(temp_dir, 'journal'),
+                store_path=os.path.join(temp_dir, 'store'))
+
+            eq_([os.path.join(temp_dir, 'journal.0'),
+                 os.path.join(temp_dir, 'journal.1')],
+                [shard.journal.path for shard in conn.shards])
+            eq_([os.path.join(temp_dir, 'store', '0'),
+                 os.path.join(temp_dir, 'store', '1')],
+                [shard.store.path for shard in conn.shards])
+
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @patch('requests.Session.get')
+    def test_send(self, mock_get):
+        _mock_get(mock_get)
+
+        with ShardedConnection(num_shards=3, backend=LocalBackend(),
+                               pop_timeout=1) as conn:
+            responses = conn.send(URLS)
+
+            # the responses are returned in the order of the requests
+            eq_(URLS, [r.request.url for r in responses])
+            eq_([200] * 20, [r.status_code for r in responses])
+            eq_(0, sum(len(shard.callbacks) for shard in conn.shards))
+
+    @patch('requests.Session.get')
+    def test_send_iter(self, mock_get):
+        _mock_get(mock_get)
+
+        with ShardedConnection(num_shards=3, backend=LocalBackend(),
+                               pop_timeout=1) as conn:
+            urls = [r.request.url for r in conn.send_iter(URLS)]
+
+            eq_(sorted(URLS), sorted(urls))
+            ok_(conn.stats['pop_calls'] >= 3)
+
+    @patch('requests.Session.get')
+    def test_push_from_callback(self, mock_get):
+        _mock_get(mock_get)
+
+        with ShardedConnection(num_shards=3, backend=LocalBackend(),
+                               pop_timeout=1) as conn:
+            def callback(response):
+                url = response.request.url
+                if not url.endswith('/next'):
+                    conn.push(Request(url + '/next'))
+
+            conn.push([Request(url, success_callback=callback)
+                       for url in URLS[:5]])
+            urls = [r.request.url for r in conn.iter_responses()]
+
+            eq_(sorted(URLS[:5] + [url + '/next' for url in URLS[:5]]),
+                sorted(urls))
+
+    @patch('requests.Session.get')
+    def test_send_iter_lazy(self, mock_get):
+        _mock_get(mock_get)
+
+        consumed = []
+
+        def generate():
+            for url in URLS:
+                consumed.append(url)
+                yield url
+
+        with ShardedConnection(num_shards=2, backend=LocalBackend(),
+                               pop_timeout=1, max_in_flight=2) as conn:
+            in_flight = []
+
+            def get(*args, **kwargs):
+                in_flight.append(max(len(shard._outstanding)
+                                     for shard in conn.shards))
+                return mock_get.return_value
+
+            mock_get.side_effect = get
+
+            iterator = conn.send_iter(generate())
+            # the input is read by the pollers
+            eq_([], consumed)
+
+            urls = [r.request.url for r in iterator]
+
+            eq_(sorted(URLS), sorted(urls))
+            # the window of each shard is kept
+            ok_(max(in_flight) <= 2)
+
+    @patch('requests.Session.get')
+    def test_send_iter_skewed(self, mock_get):
+        _mock_get(mock_get)
+
+        with ShardedConnection(num_shards=2, backend=LocalBackend(),
+                               pop_timeout=1, max_in_flight=2,
+                               route_buffer_size=2) as conn:
+            # most of the requests are routed to a single shard
+            urls = [url for url in URLS
+                    if conn.get_shard(Request(url)) is conn.shards[0]]
+            other = [url for url in URLS
+                     if conn.get_shard(Request(url)) is conn.shards[1]]
+            urls = urls * 5 + other[:1]
+
+            consumed = []
+            read_ahead = []
+
+            def generate():
+                for url in urls:
+                    consumed.append(url)
+                    yield url
+
+            def get(*args, **kwargs):
+                read_ahead.append(len(consumed) - mock_get.call_count)
+                return mock_get.return_value
+
+            mock_get.side_effect = get
+
+            responses = list(conn.send_iter(generate()))
+
+            eq_(sorted(urls), sorted(r.request.url for r in responses))
+            # the input is not read far ahead of the requests sent
+            ok_(max(read_ahead) <= 10)
+
+    @patch('requests.Session.get')
+    def test_resume(self, mock_get):
+        _mock_get(mock_get)
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with ShardedConnection(num_shards=2, backend=LocalBackend(),
+                                   pop_timeout=1,
+                                   journal_path=os.path.join(temp_dir,
+                                                             'journal')) as conn:
+                requests = [Request(url) for url in URLS[:5]]
+                for req in requests:
+                    conn.get_shard(req).journal.add_pending([req])
+
+                eq_(sorted(URLS[:5]),
+                    sorted(r.url for r in conn.resume()))
+
+                # the resumed requests are received without a push
+                eq_(sorted(URLS[:5]),
+                    sorted(r.request.url for r in conn.iter_responses()))
+                ok_(all(shard.is_idle for shard in conn.shards))
+
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @patch('picrawler.backends.cloud')
+    def test_poller_error(self, mock_cloud):
+        with ShardedConnection(num_shards=2) as conn:
+            def iter_responses():
+                raise ValueError('error')
+                yield
+
+            conn.shards[0].iter_responses = iter_responses
+            conn.shards[1].iter_responses = iter_responses
+
+            assert_raises(ValueError, list, conn.send_iter(URLS))
+            ok_(not conn._iterating)
+
+
+def test_router_stopped():
+    inboxes = [collections.deque() for n in range(2)]
+    stop = threading.Event()
+    stop.set()
+    router = sharded_connection._Router(iter([0, 0, 0, 1]), lambda n: n,
+                                        inboxes, 1, stop)
+
+    # the iterator waiting for room in the buffer of the other shard ends
+    # when the iteration is stopped, and a new one is put in the inbox
+    eq_([], list(router.iter_shard(1)))
+    eq_(1, len(inboxes[1]))
+
+    stop.clear()
+    eq_([0, 0, 0], list(router.iter_shard(0)))
+    eq_([1], list(inboxes[1].popleft()))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+from mock import patch
+
+from picrawler import simhash
+from picrawler.simhash import SimHashIndex, hamming_distance
+
+WORDS = ('the quick brown fox jumps over the lazy dog and runs away into the '
+         'dark forest where nobody can find it until the next morning comes '
+         'with the bright sun shining over the green hills').split()
+
+TEXT = ' '.join(WORDS * 3)
+SIMILAR_TEXT = '<html><body>%s <b>printable</b></body></html>' % TEXT
+OTHER_TEXT = ' '.join(reversed(WORDS)) + ' lorem ipsum dolor sit amet'
+
+
+def test_simhash():
+    fingerprint = simhash.simhash(TEXT)
+
+    ok_(0 <= fingerprint < 2 ** 64)
+    eq_(fingerprint, simhash.simhash(TEXT.upper()))
+    ok_(hamming_distance(fingerprint, simhash.simhash(SIMILAR_TEXT)) <= 3)
+    ok_(hamming_distance(fingerprint, simhash.simhash(OTHER_TEXT)) > 3)
+
+
+def test_simhash_without_words():
+    eq_(None, simhash.simhash(''))
+    eq_(None, simhash.simhash('<br/> !!'))
+    ok_(simhash.simhash(u'caf\xe9') is not None)
+
+
+def test_simhash_batch():
+    contents = [TEXT, '', OTHER_TEXT, 'short']
+    expected = [simhash._simhash_python(simhash._shingle_hashes(c, 3))
+                for c in contents]
+
+    eq_(expected, simhash.simhash_batch(contents))
+
+    with patch('picrawler.simhash.numpy', None):
+        eq_(expected, simhash.simhash_batch(contents))
+
+
+def test_hamming_distance():
+    eq_(0, hamming_distance(5, 5))
+    eq_(2, hamming_distance(0b1010, 0b0110))
+
+
+class TestSimHashIndex(object):
+    def test_find(self):
+        index = SimHashIndex(max_distance=3)
+        index.add(0, 'a')
+        index.add(2 ** 64 - 1, 'b')
+
+        eq_(2, len(index))
+        eq_('a', index.find(0b111))
+        eq_('a', index.find(1 << 63 | 1 << 40 | 1 << 20))
+        eq_(None, index.find(0b1111))
+        eq_('b', index.find(2 ** 64 - 1 - 0b101))
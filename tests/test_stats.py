@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+from mock import patch
+
+from picrawler.stats import Histogram, Stats
+
+
+class TestStats(object):
+    def test_incr(self):
+        stats = Stats()
+        stats.incr('name')
+        stats.incr('name', 2)
+
+        eq_(3, stats['name'])
+        eq_(0, stats['unknown'])
+
+    @patch('picrawler.stats.time')
+    def test_rate(self, mock_time):
+        mock_time.time.return_value = 100
+        stats = Stats()
+        stats.incr('name', 10)
+
+        mock_time.time.return_value = 105
+        eq_(2.0, stats.rate('name'))
+
+    def test_reset(self):
+        stats = Stats()
+        stats.incr('name')
+        stats.reset()
+
+        eq_({}, stats.as_dict())
+
+    def test_observe(self):
+        stats = Stats()
+        eq_(None, stats.histogram('name'))
+
+        stats.observe('name', 1.0)
+        stats.observe('name', 3.0)
+
+        eq_(2, stats.histogram('name').count)
+        eq_(2.0, stats.histogram('name').mean)
+
+    def test_merge(self):
+        stats = Stats()
+        stats.incr('name')
+        stats.observe('latency', 1.0)
+
+        stats2 = Stats()
+        stats2.incr('name', 2)
+        stats2.incr('name2')
+        stats2.observe('latency', 3.0)
+        stats2.observe('latency2', 5.0)
+
+        stats.merge(stats2)
+
+        eq_(dict(name=3, name2=1), stats.as_dict())
+        eq_(2, stats.histogram('latency').count)
+        eq_(3.0, stats.histogram('latency').max)
+        eq_(5.0, stats.histogram('latency2').mean)
+        # the histograms of the other instance are not shared
+        eq_(1, stats2.histogram('latency').count)
+
+
+class TestHistogram(object):
+    def test_percentile(self):
+        histogram = Histogram(ratio=1.1)
+        for n in range(1, 101):
+            histogram.add(n / 100.0)
+
+        eq_(100, histogram.count)
+        eq_(0.01, histogram.min)
+        eq_(1.0, histogram.max)
+        ok_(0.5 <= histogram.percentile(50) <= 0.55)
+        ok_(0.99 <= histogram.percentile(99) <= 1.0)
+        eq_(1.0, histogram.percentile(100))
+
+    def test_percentile_with_zero(self):
+        histogram = Histogram()
+        histogram.add(0.0)
+        histogram.add(0.0)
+        histogram.add(2.0)
+
+        eq_(0.0, histogram.percentile(50))
+        ok_(histogram.percentile(90) <= 2.0)
+
+    def test_empty(self):
+        histogram = Histogram()
+        eq_(None, histogram.percentile(50))
+        eq_(None, histogram.mean)
+
+    def test_merge(self):
+        histogram = Histogram()
+        histogram.add(1.0)
+        histogram2 = Histogram()
+        histogram2.add(0.5)
+        histogram2.add(4.5)
+
+        histogram.merge(histogram2)
+
+        eq_(3, histogram.count)
+        eq_(2.0, histogram.mean)
+        eq_(0.5, histogram.min)
+        eq_(4.5, histogram.max)
+        eq_(4.5, histogram.percentile(100))
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+import shutil
+import tempfile
+
+from picrawler import store
+from picrawler.store import ContentStore
+
+
+class TestContentStore(object):
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+
+    def test_put_and_get(self):
+        content_store = ContentStore(self.path)
+        key = content_store.put('content')
+
+        eq_('content', content_store.get(key)[:])
+        eq_(7, content_store.size)
+        ok_(key in content_store)
+
+    def test_put_empty_content(self):
+        content_store = ContentStore(self.path)
+        key = content_store.put('')
+
+        eq_('', content_store.get(key))
+
+    def test_put_duplicate_content(self):
+        content_store = ContentStore(self.path)
+
+        eq_(content_store.put('content'), content_store.put('content'))
+        eq_(1, len(content_store))
+        eq_(7, content_store.size)
+
+    @raises(store.ContentNotFound)
+    def test_get_unknown_key(self):
+        ContentStore(self.path).get('dummy')
+
+    def test_evict(self):
+        content_store = ContentStore(self.path, max_size=10)
+        key1 = content_store.put('a' * 4)
+        key2 = content_store.put('b' * 4)
+
+        # key1 becomes the most recently used one
+        content_store.get(key1)
+        key3 = content_store.put('c' * 4)
+
+        ok_(key1 in content_store)
+        ok_(key2 not in content_store)
+        ok_(key3 in content_store)
+        eq_(8, content_store.size)
+
+    def test_pin(self):
+        content_store = ContentStore(self.path, max_size=4)
+        key1 = content_store.put('a' * 4, pin=True)
+        key2 = content_store.put('b' * 4)
+
+        # the pinned content is kept beyond max_size
+        ok_(key1 in content_store)
+        ok_(key2 in content_store)
+        eq_(8, content_store.size)
+
+        content_store.pin(key1)
+        content_store.unpin(key1)
+        ok_(key1 in content_store)
+
+        content_store.unpin(key1)
+        ok_(key1 not in content_store)
+        eq_(4, content_store.size)
+
+    @raises(store.ContentNotFound)
+    def test_pin_unknown_key(self):
+        ContentStore(self.path).pin('dummy')
+
+    def test_content_pin(self):
+        content_store = ContentStore(self.path, max_size=4)
+        pin = store.ContentPin(content_store,
+                               content_store.put('a' * 4, pin=True))
+        content_store.put('b' * 4)
+
+        eq_('aaaa', pin.get()[:])
+
+        # the least recently used content is evicted once the pin is released
+        del pin
+        eq_(4, content_store.size)
+
+    def test_evicted_view(self):
+        content_store = ContentStore(self.path, max_size=4)
+        key = content_store.put('a' * 4)
+        view = content_store.get(key)
+        content_store.put('b' * 4)
+
+        eq_('aaaa', view[:])
+
+    def test_load(self):
+        key = ContentStore(self.path).put('content')
+        content_store = ContentStore(self.path)
+
+        eq_('content', content_store.get(key)[:])
+        eq_(7, content_store.size)
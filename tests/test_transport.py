@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+from mock import Mock, patch
+import httplib
+import requests
+import StringIO
+
+from picrawler import transport
+from picrawler.transport import SessionPool, get_session_pool
+
+
+class TestSessionPool(object):
+    def test_get_same_host(self):
+        pool = SessionPool()
+        session = pool.get('http://dummy/a')
+
+        eq_(session, pool.get('http://DUMMY/b?q=1'))
+        eq_(1, len(pool))
+
+    def test_get_different_hosts(self):
+        pool = SessionPool()
+        session = pool.get('http://dummy/')
+
+        ok_(session is not pool.get('https://dummy/'))
+        ok_(session is not pool.get('http://dummy2/'))
+        eq_(3, len(pool))
+
+    def test_no_cookies(self):
+        session = SessionPool().get('http://dummy/')
+
+        response = Mock()
+        response._original_response.msg = httplib.HTTPMessage(
+            StringIO.StringIO('Set-Cookie: name=value\r\n\r\n'))
+        req = requests.Request('GET', 'http://dummy/').prepare()
+
+        # the cookie is accepted by a plain jar, but not by the session
+        jar = requests.cookies.RequestsCookieJar()
+        requests.cookies.extract_cookies_to_jar(jar, req, response)
+        eq_(1, len(jar))
+
+        requests.cookies.extract_cookies_to_jar(session.cookies, req, response)
+        eq_(0, len(session.cookies))
+
+    def test_pool_size(self):
+        pool = SessionPool(pool_size=3)
+        session = pool.get('http://dummy/')
+
+        eq_(3, session.get_adapter('http://dummy/')._pool_maxsize)
+
+    @patch('picrawler.transport.time')
+    def test_idle_timeout(self, mock_time):
+        mock_time.time.return_value = 0
+        pool = SessionPool(idle_timeout=10)
+        session = pool.get('http://dummy/')
+        pool.get('http://dummy2/')
+
+        mock_time.time.return_value = 5
+        eq_(session, pool.get('http://dummy/'))
+
+        mock_time.time.return_value = 16
+        ok_(session is not pool.get('http://dummy/'))
+        # the idle session of the other host is purged
+        eq_(1, len(pool))
+
+    def test_close(self):
+        pool = SessionPool()
+        pool.get('http://dummy/')
+        pool.close()
+
+        eq_(0, len(pool))
+
+
+def test_get_session_pool():
+    pool = get_session_pool(5, 30)
+
+    eq_(pool, get_session_pool(5, 30))
+    ok_(pool is not get_session_pool(6, 30))
+    eq_(5, pool.pool_size)
+    eq_(30, pool.idle_timeout)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *
+from mock import Mock, patch
+
+from picrawler.request import Request
+from picrawler.response import Response, ErrorResponse
+from picrawler.worker import RequestHandler
+
+
+class TestRequestHandler(object):
+    @patch('picrawler.worker.get_session_pool')
+    def test_call(self, mock_get_session_pool):
+        handler = RequestHandler(pool_size=5, pool_idle_timeout=30)
+        req = Mock()
+        req.url = 'http://dummy'
+
+        ret = handler(req)
+
+        mock_get_session_pool.assert_called_once_with(5, 30)
+        session_pool = mock_get_session_pool.return_value
+        session_pool.get.assert_called_once_with('http://dummy')
+        req.assert_called_once_with(session=session_pool.get.return_value,
+                                    limits=None)
+        eq_(req.return_value, ret)
+
+    @patch('picrawler.worker.get_session_pool')
+    def test_call_with_batch(self, mock_get_session_pool):
+        handler = RequestHandler(concurrency=2)
+        requests = [Mock() for n in range(3)]
+
+        ret = handler(requests)
+
+        eq_([req.return_value for req in requests], ret)
+        for req in requests:
+            eq_(1, req.call_count)
+
+    @patch('picrawler.worker.simhash_batch')
+    @patch('picrawler.worker.get_session_pool')
+    def test_call_with_fingerprint(self, mock_get_session_pool,
+                                   mock_simhash_batch):
+        handler = RequestHandler(fingerprint=True)
+        requests = [Mock() for n in range(3)]
+        requests[0].return_value = Response(Request('http://dummy'), 200,
+                                            'content', {})
+        requests[1].return_value = Response(Request('http://dummy'), 200,
+                                            None, {})
+        requests[2].return_value = ErrorResponse(Request('http://dummy'),
+                                                 Exception())
+        mock_simhash_batch.return_value = [123]
+
+        ret = handler(requests)
+
+        # the fingerprints of the batch are computed at once
+        mock_simhash_batch.assert_called_once_with(['content'])
+        eq_(123, ret[0].fingerprint)
+        eq_(None, ret[1].fingerprint)
+
+        eq_(123, handler(requests[0]).fingerprint)
+
+    @patch('picrawler.worker.simhash_batch')
+    @patch('picrawler.worker.get_session_pool')
+    def test_call_with_fingerprint_and_extractor(self, mock_get_session_pool,
+                                                 mock_simhash_batch):
+        handler = RequestHandler(fingerprint=True)
+        session = mock_get_session_pool.return_value.get.return_value
+        session.get.return_value.content = 'content'
+        session.get.return_value.url = 'http://dummy'
+        mock_simhash_batch.return_value = [123]
+
+        req = Request('http://dummy', extractor='tests.test_request:extract_length')
+        ret = handler(req)
+
+        # the fingerprint is computed before the content is discarded
+        mock_simhash_batch.assert_called_once_with(['content'])
+        eq_(123, ret.fingerprint)
+        eq_(7, ret.extracted)
+        eq_(None, ret.content)
+
+    def test_pickle(self):
+        handler = RequestHandler(concurrency=2)
+        handler._thread_pool = object()
+
+        eq_(None, handler.__getstate__()['_thread_pool'])